@@ -0,0 +1,78 @@
+# coding: utf-8
+
+"""
+Asynchronous Kuaipan client. Operations are submitted from any thread,
+e.g. FUSE callbacks, and run on workers of a transfer scheduler, so many
+concurrent operations do not need as many threads.
+"""
+
+import threading
+
+from .scheduler import TransferScheduler
+from .scheduler import FOREGROUND
+from .download import fetch_range
+
+# operations running at the same time, unless scheduler is given
+CONCURRENCY = 8
+# operations submitted but not finished, submit blocks beyond it
+MAX_PENDING = 1000
+
+
+class AsyncKuaiPan(object):
+    """
+    Asynchronous facade of KuaiPan. Operations return a Task, which is a
+    Future, at once, and run on workers of scheduler sharing the connection
+    pool of the client. Submitting blocks when max_pending operations are
+    not finished.
+
+    :type kp: kpfuse.kuaipan.KuaiPan
+    :type scheduler: TransferScheduler
+    """
+    OPERATIONS = ('metadata', 'download', 'upload', 'move', 'copy', 'delete', 'mkdir')
+
+    def __init__(self, kp, scheduler=None, concurrency=CONCURRENCY, max_pending=MAX_PENDING):
+        self.kp = kp
+        self._own_scheduler = scheduler is None
+        self.scheduler = scheduler or TransferScheduler(concurrency)
+        self._budget = threading.BoundedSemaphore(max_pending)
+        if kp.pool_size < self.scheduler.workers:
+            kp.set_pool_size(self.scheduler.workers)
+
+    def submit(self, key, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) on a worker, safe to call from any thread.
+
+        :param key: key of operation in scheduler, e.g. path of file
+        :param priority: keyword argument of scheduler priority, FOREGROUND by default
+        :rtype: kpfuse.scheduler.Task
+        """
+        kwargs.setdefault('priority', FOREGROUND)
+        self._budget.acquire()
+        try:
+            task = self.scheduler.submit(key, func, *args, **kwargs)
+        except Exception:
+            self._budget.release()
+            raise
+        # finished, failed or cancelled
+        task.add_done_callback(lambda t: self._budget.release())
+        return task
+
+    def __getattr__(self, name):
+        if name not in self.OPERATIONS:
+            raise AttributeError(name)
+        func = getattr(self.kp, name)
+        return lambda path, *args, **kwargs: self.submit(path, func, path, *args, **kwargs)
+
+    def fetch_range(self, path, begin, end, write):
+        """
+        Download [begin, end) bytes of file to write(offset, chunk),
+        see download.fetch_range.
+
+        :rtype: kpfuse.scheduler.Task
+        """
+        return self.submit(path, fetch_range, self.kp, path, begin, end, write)
+
+    def close(self):
+        """Finish submitted operations, and stop workers of own scheduler"""
+        if self._own_scheduler:
+            self.scheduler.close()
@@ -0,0 +1,126 @@
+# coding: utf-8
+
+"""
+Block presence map for sparse cache files
+"""
+
+import os
+import json
+import base64
+
+BLOCK_SIZE = 1024 * 1024
+BLOCK_MAP_SUFFIX = '.kpblocks'
+
+
+class BlockMap(object):
+    """
+    Record which fixed-size blocks of a sparse cache file have been
+    downloaded from server.
+
+    :param size: file size in bytes
+    :param mtime: server modified time of the version being cached
+    """
+    def __init__(self, size, mtime=None, block_size=BLOCK_SIZE, bits=None):
+        self.size = size
+        self.mtime = mtime
+        self.block_size = block_size
+        self.modified = False
+        self._bits = bytearray(bits or (self.count + 7) // 8)
+
+    @property
+    def count(self):
+        return (self.size + self.block_size - 1) // self.block_size
+
+    @property
+    def completed(self):
+        return all(self.has(i) for i in xrange(self.count))
+
+    def has(self, index):
+        return bool(self._bits[index >> 3] & (1 << (index & 7)))
+
+    def add(self, index):
+        self._bits[index >> 3] |= 1 << (index & 7)
+
+    def discard(self, index):
+        self._bits[index >> 3] &= ~(1 << (index & 7)) & 0xff
+
+    def add_blocks(self, start, stop):
+        for i in xrange(start, stop):
+            self.add(i)
+
+    def block_range(self, offset, size):
+        """Return [start, stop) index of blocks covering given bytes"""
+        end = min(offset + size, self.size)
+        if offset >= end:
+            return 0, 0
+        return offset // self.block_size, (end - 1) // self.block_size + 1
+
+    def byte_range(self, start, stop):
+        """Return [begin, end) bytes of given blocks"""
+        return start * self.block_size, min(stop * self.block_size, self.size)
+
+    def missing(self, offset=0, size=None):
+        """
+        Return list of [start, stop) runs of missing blocks covering given bytes.
+        """
+        if size is None:
+            size = self.size - offset
+        runs = []
+        start, stop = self.block_range(offset, size)
+        for i in xrange(start, stop):
+            if self.has(i):
+                continue
+            if runs and runs[-1][1] == i:
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1])
+        return [tuple(x) for x in runs]
+
+    def next_missing(self, limit=None):
+        """Return the first run of missing blocks, at most limit blocks"""
+        for i in xrange(self.count):
+            if not self.has(i):
+                stop = i + 1
+                while stop < self.count and not self.has(stop):
+                    if limit and stop - i >= limit:
+                        break
+                    stop += 1
+                return i, stop
+        return None
+
+    def resize(self, size):
+        """
+        Change file size. Blocks beyond the previous size only exist locally,
+        so they are marked as present.
+        """
+        old_count = self.count
+        old_size = self.size
+        self.size = size
+        self._bits.extend(bytearray(max(0, (self.count + 7) // 8 - len(self._bits))))
+        for i in xrange(self.count, old_count):
+            self.discard(i)
+        first = (old_size + self.block_size - 1) // self.block_size
+        for i in xrange(first, self.count):
+            self.add(i)
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wt') as f:
+            json.dump(dict(size=self.size,
+                           mtime=self.mtime,
+                           block_size=self.block_size,
+                           modified=self.modified,
+                           bits=base64.b64encode(str(self._bits))), f)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Return None if block map is missing or corrupted"""
+        try:
+            with open(path, 'rt') as f:
+                d = json.load(f)
+            m = cls(d['size'], d['mtime'], d['block_size'], base64.b64decode(d['bits']))
+            m.modified = d.get('modified', False)
+            return m
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
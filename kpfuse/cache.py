@@ -5,15 +5,44 @@ Local cache for FuseFS
 """
 
 import os
+import mmap
 import logging
 import threading
 import time
-import shutil
-import Queue
+import contextlib
 
 from .node import AbstractNode
 from .node import NodeTree
 from .kuaipan import KuaiPan
+from .blocks import BlockMap
+from .blocks import BLOCK_MAP_SUFFIX
+from .download import RangeDownloader
+from .download import DEFAULT_WORKERS
+from .download import split_ranges
+from .scheduler import TransferScheduler
+from .scheduler import FOREGROUND
+from .scheduler import READAHEAD
+from .scheduler import UPLOAD
+from .scheduler import BACKGROUND
+from .writeback import WriteBack
+from .writeback import WRITEBACK_DELAY
+from .journal import Journal
+from .fileio import pread
+from .fileio import pwrite_all
+from .fileio import FileReader
+from .digest import SequentialHash
+from .digest import file_sha1
+from .extents import DirtyExtents
+from .multipart import log_progress
+from .index import CacheIndex
+from .index import disk_usage
+from .index import DEFAULT_MAX_SIZE
+from .index import DEFAULT_MAX_COUNT
+
+# cache objects not accessed for given days are removed
+EXPIRE_DAYS = 30
+# ratio of quota to evict down to, once quota is exceeded
+LOW_WATERMARK = 0.9
 
 log = logging.getLogger(__name__)
 
@@ -24,18 +53,42 @@ NOT_UPLOADED = 2
 
 class FileCache(object):
     """
-    :type raw: io.RawIOBase
+    Cache object of a file, stored as a sparse file of fixed-size blocks.
+    Blocks are downloaded on demand, and the presence of blocks is recorded
+    in a block map beside the cache file until the download is completed.
+
     :type node: AbstractNode
+    :type downloader: RangeDownloader
+    :type blocks: BlockMap
+    :param on_modified: function of on_modified(cache, dirty), called before cache
+        object becomes modified, and after it is uploaded
+    :param use_mmap: serve reads of complete and unmodified objects from a
+        memory map shared by all handles
     """
-    def __init__(self, node, cache_path):
+    def __init__(self, node, cache_path, downloader, on_modified=None, use_mmap=False):
         self.node = node
-        self.cache_path = cache_path
-        self.raw = None
         self.fh = None
+        self._reader = None  # reads of threads, without the lock
+        self.cache_path = cache_path
+        self.downloader = downloader
+        self.on_modified = on_modified
         self.flags = None
+        self.blocks = None  # None if all blocks are present
         self.modified = NOT_MODIFIED
+        self.sha1 = None  # hash of complete and unmodified content, if known
+        self.dirty = None  # DirtyExtents of modified content, None if unknown
+        self._hash = None  # hash of data written in order, for new files
         self._rwlock = threading.RLock()
-        self._data = ''
+        # protect cache file writing from download threads
+        self._io_lock = threading.Lock()
+        self._inflight = dict()  # index of block -> Task of read-ahead
+        self.use_mmap = use_mmap
+        self._map = None
+        self._map_users = 0  # reads using the map
+        # guard the map, and modified state deciding whether to map
+        self._map_lock = threading.Lock()
+        self._map_cond = threading.Condition(self._map_lock)
+        self._unmapping = 0  # threads waiting for reads using the map
         # reference count is needed, as file may be opened more than once.
         self._ref_lock = threading.Lock()
         self._refcount = 0
@@ -56,88 +109,185 @@ class FileCache(object):
     @property
     def is_opened(self):
         with self._rwlock:
-            return self.raw is not None or self.fh is not None
+            return self.fh is not None
 
-    def open(self, kp, flags):
-        """
-        :type kp: KuaiPan
-        """
+    @property
+    def cache_path(self):
+        return self._cache_path
+
+    @cache_path.setter
+    def cache_path(self, value):
+        self._cache_path = value
+        if self._reader is not None:
+            self._reader.path = value  # renamed while opened
+
+    @property
+    def blocks_path(self):
+        return self.cache_path + BLOCK_MAP_SUFFIX
+
+    def open(self, flags):
         with self._rwlock:
             log.info(u'opening %s (refcount=%d)', self.node.path, self.refcount)
             self.flags = flags
             if self.is_opened:
                 return
 
+            if self.modified != NOT_MODIFIED:
+                # reopened or recovered before uploaded
+                log.debug(u'open modified cache: %s', self.node.path)
+                self._open_cache()
+                return
+
+            attribute = self.node.attribute
+            blocks = BlockMap.load(self.blocks_path) if os.path.exists(self.cache_path) else None
+            if blocks is not None:
+                if blocks.modified:
+                    attribute.size = blocks.size  # correct size
+                    self.modified = NOT_UPLOADED  # previous not-uploaded cache
+                elif blocks.mtime != attribute.mtime or blocks.size != attribute.size:
+                    log.debug(u'outdated partial cache: %s', self.node.path)
+                    self._create_sparse_cache()
+                    return
+                log.debug(u'open partial cache: %s (missing=%s)', self.node.path, blocks.missing())
+                self.blocks = blocks
+                self._open_cache()
+                return
+
             cache_mtime = os.path.getmtime(self.cache_path) if os.path.exists(self.cache_path) else 0
-            log.debug(u'modified time (%s -> %s): %s', cache_mtime, self.node.attribute.mtime, self.node.path)
-            if cache_mtime < self.node.attribute.mtime and len(self._data) != self.node.attribute.size:
-                log.debug(u'from net (size=%d -> %d): %s', len(self._data), self.node.attribute.size, self.node.path)
-                self._data = ''
-                self.raw = kp.download(self.node.path).raw
+            log.debug(u'modified time (%s -> %s): %s', cache_mtime, attribute.mtime, self.node.path)
+            if cache_mtime and cache_mtime < attribute.mtime and self.sha1 == self.node.sha1 \
+                    and self.sha1 and os.path.getsize(self.cache_path) == attribute.size:
+                log.debug(u'content unchanged at server: %s', self.node.path)
+                self._update_cache_utime()
+                self.blocks = None
+                self._open_cache()
+            elif cache_mtime < attribute.mtime:
+                log.debug(u'from net (size=%d): %s', attribute.size, self.node.path)
+                self._create_sparse_cache()
             else:
-                if cache_mtime > self.node.attribute.mtime:
-                    self.node.attribute.size = os.path.getsize(self.cache_path) # correct size
-                    self.modified = NOT_UPLOADED  # previous not-uploaded _cache_dict
+                if cache_mtime > attribute.mtime:
+                    attribute.size = os.path.getsize(self.cache_path)  # correct size
+                    self.modified = NOT_UPLOADED  # previous not-uploaded cache
                 log.debug(u'open cache: %s (modified=%d)', self.node.path, self.modified)
+                self.blocks = None
                 self._open_cache()
 
     def create(self):
         with self._rwlock:
-            assert self.raw is None
+            assert self.fh is None
             log.info(u'creating %s (refcount=%d)', self.node.path, self.refcount)
-            self.modified = MODIFIED
-            self.fh = os.open(self.cache_path, os.O_CREAT | os.O_RDWR)
+            self._set_modified()
+            self.dirty = None  # content is replaced
+            self.blocks = None
+            self._hash = SequentialHash()
+            self._make_cache_dir()
+            self.fh = os.open(self.cache_path, os.O_CREAT | os.O_TRUNC | os.O_RDWR)
+            self._reader = FileReader(self.fh, self.cache_path)
+
+    def read(self, size, offset, readahead=None):
+        """
+        Read cached data, downloading missing blocks first. Reads of present
+        blocks do not take the lock, so they run in parallel.
 
-    def read(self, size, offset):
-        with self._rwlock:
-            if self.fh is None:
-                total = size + offset
-                if len(self._data) < total:
-                    if self.download(total - len(self._data)):
-                        self._open_cache()
-            if self.fh is not None:
-                os.lseek(self.fh, offset, 0)
-                return os.read(self.fh, size)
-            else:
-                return self._data[offset:(size + offset)]
+        :type readahead: kpfuse.readahead.ReadAhead
+        """
+        ahead = readahead and readahead.update(offset, size)
+        if self.blocks is not None:
+            with self._rwlock:
+                if ahead and self.blocks is not None:
+                    self._read_ahead(*ahead)
+                self._fetch(offset, size)
+                self._check_completed()
+        # present blocks are not downloaded again, so they are read without the lock
+        if self.use_mmap:
+            data = self._read_mapped(size, offset)
+            if data is not None:
+                return data
+        return self._reader.read(size, offset)
+
+    def _read_mapped(self, size, offset):
+        """Slice of memory map of cache file, or None if it can not be mapped"""
+        with self._map_lock:
+            m = self._map
+            if m is None:
+                if self.blocks is not None or self.modified != NOT_MODIFIED or self.fh is None:
+                    return None
+                try:
+                    m = self._map = mmap.mmap(self.fh, 0, access=mmap.ACCESS_READ)
+                except (mmap.error, ValueError, OverflowError):
+                    return None  # empty, or too large for address space
+            self._map_users += 1
+        try:
+            return m[offset:offset + size]
+        finally:
+            with self._map_lock:
+                self._map_users -= 1
+                if self._unmapping and not self._map_users:
+                    self._map_cond.notify_all()
+
+    def _unmap(self):
+        """Drop memory map before cache file is changed, once reads using it finish"""
+        with self._map_cond:
+            self._unmapping += 1
+            while self._map_users:
+                self._map_cond.wait()
+            self._unmapping -= 1
+            if self._map is not None:
+                self._map.close()
+                self._map = None
 
     def truncate(self, length):
-        with self._rwlock:
-            if self.fh is not None:
-                os.ftruncate(self.fh, length)
-                self.modified = MODIFIED
-            elif len(self._data) != length:
-                self._data = self._data[:length]
-                self.modified = MODIFIED
+        with self._rwlock, self._cache_opened():
+            self._drain_readahead()
+            if self.blocks is not None:
+                self._resize_blocks(length)
+                self._mark_modified()
+                self._check_completed()
+            self._set_modified()
+            if self.dirty is not None:
+                self.dirty.truncate(self.node.attribute.size, length)
+            if length == 0:
+                self._hash = SequentialHash()
+            elif self._hash is not None:
+                self._hash.truncate(length)
+            os.ftruncate(self.fh, length)
+            self.node.attribute.size = length
 
     def write(self, data, offset):
         with self._rwlock:
-            self.modified = MODIFIED
-            if self.fh is not None:
-                os.lseek(self.fh, offset, 0)
-                return os.write(self.fh, data)
-            else:
-                if self.raw:
-                    self.raw.close()
-                    self.raw = None
-                self._data = self._data[:offset] + data
-                return len(data)
+            self._drain_readahead()
+            if self._same_data(data, offset):
+                return len(data)  # rewrite of the same bytes, nothing is changed
+            if self.blocks is not None:
+                # blocks partially overwritten must be downloaded first
+                end = offset + len(data)
+                self._fetch(offset, 1)
+                self._fetch(end - 1, 1)
+                if end > self.blocks.size:
+                    self._resize_blocks(end)
+                self.blocks.add_blocks(*self.blocks.block_range(offset, len(data)))
+                self._mark_modified()
+                self._check_completed()
+            self._set_modified()
+            if self._hash is not None:
+                self._hash.update(offset, data)
+            n = pwrite_all(self.fh, data, offset)
+            if self.dirty is not None:
+                self.dirty.add(offset, offset + n)
+            # size of file is reported before it is uploaded
+            if offset + n > self.node.attribute.size:
+                self.node.attribute.size = offset + n
+            return n
 
     def flush(self):
-        if self.fh is not None and self.modified != NOT_MODIFIED:
-            os.fsync(self.fh)
+        with self._rwlock:
+            if self.fh is not None and self.modified != NOT_MODIFIED:
+                os.fsync(self.fh)
 
     @property
     def completed(self):
         with self._rwlock:
-            if self.fh is not None:
-                return True
-            elif self.modified != NOT_MODIFIED:
-                return True
-            elif self.node.attribute.size == len(self._data):
-                return True
-            elif self.raw is None:
-                return True
+            return self.blocks is None or self.modified != NOT_MODIFIED
 
     @property
     def ignored(self):
@@ -146,71 +296,316 @@ class FileCache(object):
         return name.startswith('.~') or name.startswith('~')
 
     @property
-    def data_size(self):
+    def missing_size(self):
+        """Size of blocks not downloaded yet"""
         with self._rwlock:
-            return len(self._data)
+            if self.blocks is None:
+                return 0
+            return sum(self.blocks.byte_range(*run)[1] - self.blocks.byte_range(*run)[0]
+                       for run in self.blocks.missing())
 
     def close(self):
         log.info(u'closing %s', self.node.path)
         with self._rwlock:
+            if self.fh is not None:
+                self._drain_readahead()
+                self._close_cache()
+
             if self.ignored:
                 log.warn(u'ignore %s', self.node.path)
                 return True
 
-            if self.fh:
-                os.close(self.fh)
-
-            if self.modified == MODIFIED and self.fh is None:
-                self._write_cache()
+    def _make_cache_dir(self):
+        cache_dir = os.path.dirname(self.cache_path)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
 
-            self.fh = None
+    def _create_sparse_cache(self):
+        self._make_cache_dir()
+        self.fh = os.open(self.cache_path, os.O_CREAT | os.O_TRUNC | os.O_RDWR)
+        self._reader = FileReader(self.fh, self.cache_path)
+        attribute = self.node.attribute
+        # preallocate the whole file, downloaded data is written in place
+        os.ftruncate(self.fh, attribute.size)
+        self.blocks = BlockMap(attribute.size, attribute.mtime)
+        if self.blocks.completed:
+            self._complete_download()
+        else:
+            self.blocks.save(self.blocks_path)
 
     def _open_cache(self):
-        self.fh = os.open(self.cache_path, self.flags)
-        self._data = ''
+        self.fh = os.open(self.cache_path, os.O_RDWR)
+        self._reader = FileReader(self.fh, self.cache_path)
+
+    @contextlib.contextmanager
+    def _cache_opened(self):
+        """Open cache file temporarily if it is closed"""
+        opened = self.fh is not None
+        if not opened:
+            self._open_cache()
+        try:
+            yield
+        finally:
+            if not opened:
+                self._close_cache()
+
+    def _close_cache(self):
+        self._unmap()
+        if self.blocks is not None:
+            self.blocks.save(self.blocks_path)
+        os.close(self.fh)
+        self.fh = None
+        self._reader.close()
 
-    def download(self, size):
+    def recover(self):
+        """
+        Take over cache object modified but not uploaded by previous mount.
+        Return False if it is missing.
+        """
         with self._rwlock:
-            assert self.modified == NOT_MODIFIED
-            """Return True if completed"""
-            assert self.raw is not None
-            self._data += self.raw.read(size)
-            if self.raw.readable() and len(self._data) < self.node.attribute.size:
+            if not os.path.exists(self.cache_path):
                 return False
+            blocks = BlockMap.load(self.blocks_path)
+            if blocks is not None:
+                blocks.modified = True
+                self.blocks = blocks
+                self.node.attribute.size = blocks.size
+            else:
+                self.node.attribute.size = os.path.getsize(self.cache_path)
+            self.modified = NOT_UPLOADED
+            return True
+
+    def _set_modified(self):
+        if self.modified == MODIFIED and self._map is None:
+            return  # files being modified are never mapped again
+        if self.modified != MODIFIED and self.on_modified is not None:
+            self.on_modified(self, True)
+        if self.modified == NOT_MODIFIED:
+            # content is the same as at server until written
+            self.dirty = DirtyExtents(self.node.attribute.size, self.node.sha1)
+        with self._map_lock:
+            self.modified = MODIFIED
+        self._unmap()
+        self.sha1 = None
+
+    def _same_data(self, data, offset):
+        """Whether data equals bytes at offset of file unmodified since downloaded"""
+        if self.modified != NOT_MODIFIED or not data:
+            return False  # written bytes are compared at upload by hash
+        if offset + len(data) > self.node.attribute.size:
+            return False
+        if self.blocks is not None and self.blocks.missing(offset, len(data)):
+            return False
+        return pread(self.fh, len(data), offset) == data
 
-            assert len(self._data) == self.node.attribute.size
-            log.info(u'complete download (size=%d): %s', len(self._data), self.node.path)
-            self.raw.close()
-            self.raw = None
-            self._write_cache()
+    def dirty_state(self):
+        """JSON of dirty extents of modified object for cache index, None if unknown"""
+        with self._rwlock:
+            if self.modified == NOT_MODIFIED or self.dirty is None \
+                    or not os.path.exists(self.cache_path):
+                return None
+            self.dirty.mtime = os.path.getmtime(self.cache_path)
+            return self.dirty.to_json()
+
+    def restore_dirty(self, extents):
+        """Take over dirty extents of cache index, unless cache file is written since recorded"""
+        if not extents:
+            return
+        dirty = DirtyExtents.from_json(extents)
+        if os.path.exists(self.cache_path) and os.path.getmtime(self.cache_path) == dirty.mtime:
+            self.dirty = dirty
+
+    def _mark_modified(self):
+        if not self.blocks.modified:
+            self.blocks.modified = True
+            self.blocks.save(self.blocks_path)
+
+    def _fetch(self, offset, size, priority=FOREGROUND):
+        """Download missing blocks covering given bytes"""
+        if self.blocks is None:
+            return
+        with self._io_lock:
+            runs, tasks = self._split_inflight(self.blocks.missing(offset, size))
+        self._fetch_blocks(runs, priority)
+        if tasks:
+            for task in tasks:
+                task.run()  # not taken by workers yet
+                task.error()
+            # again, in case read-ahead failed
+            self._fetch_blocks(self.blocks.missing(offset, size), priority)
+
+    def _split_inflight(self, runs):
+        """Split runs of blocks to runs not read ahead, and tasks reading ahead the rest"""
+        if not self._inflight:
+            return runs, set()
+        free, tasks = [], set()
+        for start, stop in runs:
+            begin = start
+            for i in xrange(start, stop):
+                task = self._inflight.get(i)
+                if task is not None:
+                    tasks.add(task)
+                    if begin < i:
+                        free.append((begin, i))
+                    begin = i + 1
+            if begin < stop:
+                free.append((begin, stop))
+        return free, tasks
+
+    def _read_ahead(self, begin, end):
+        """Download missing blocks of [begin, end) bytes on workers, without waiting"""
+        end = min(end, self.blocks.size)
+        if begin >= end:
+            return
+        submitted = []
+        with self._io_lock:
+            runs, _ = self._split_inflight(self.blocks.missing(begin, end - begin))
+            ranges = [self.blocks.byte_range(start, stop) for start, stop in runs]
+            for part in split_ranges(ranges, self.downloader.part_size, self.blocks.block_size):
+                task = self.downloader.submit(self.node.path, part[0], part[1],
+                                              self._write_data, self._add_blocks,
+                                              priority=READAHEAD)
+                blocks = self.blocks.block_range(part[0], part[1] - part[0])
+                for i in xrange(*blocks):
+                    self._inflight[i] = task
+                submitted.append((task, blocks))
+        if submitted:
+            log.debug(u'read ahead [%d, %d): %s', begin, end, self.node.path)
+        # outside of lock, as callback of finished task is called at once
+        for task, blocks in submitted:
+            task.add_done_callback(lambda t, blocks=blocks: self._read_ahead_done(t, *blocks))
+
+    def _read_ahead_done(self, task, start, stop):
+        with self._io_lock:
+            for i in xrange(start, stop):
+                if self._inflight.get(i) is task:
+                    del self._inflight[i]
+
+    def _drain_readahead(self):
+        """Cancel read-ahead not started, and wait for running one"""
+        if not self._inflight:
+            return  # only filled in lock held by caller
+        with self._io_lock:
+            tasks = set(self._inflight.itervalues())
+        for task in tasks:
+            if not task.cancel():
+                task.error()
+
+    def _resize_blocks(self, size):
+        # boundary block must be present, as data after old end only exists locally.
+        edge = min(size, self.blocks.size)
+        if edge > 0:
+            self._fetch(edge - 1, 1)
+        self.blocks.resize(size)
+
+    def _check_completed(self):
+        if self.blocks is not None and self.blocks.completed:
+            self._complete_download()
+
+    def _fetch_blocks(self, runs, priority=FOREGROUND):
+        """Download [start, stop) runs of blocks concurrently"""
+        if not runs:
+            return
+        log.debug(u'download blocks %s: %s', runs, self.node.path)
+        ranges = [self.blocks.byte_range(start, stop) for start, stop in runs]
+        self.downloader.download(self.node.path, ranges,
+                                 self._write_data, self._add_blocks,
+                                 align=self.blocks.block_size, priority=priority)
+
+    def _write_data(self, offset, data):
+        # positioned write, shared by download threads. Block is only marked
+        # present after all of its data is written.
+        pwrite_all(self.fh, data, offset)
+
+    def _add_blocks(self, begin, end):
+        with self._io_lock:
+            if self.blocks is not None:
+                self.blocks.add_blocks(*self.blocks.block_range(begin, end - begin))
+
+    def _complete_download(self):
+        log.info(u'complete download (size=%d): %s', self.blocks.size, self.node.path)
+        if not self.blocks.modified:
             self._update_cache_utime()
-            return True
+            self.sha1 = self.node.sha1
+        self.blocks = None
+        if os.path.exists(self.blocks_path):
+            os.remove(self.blocks_path)
 
-    def upload(self, kp):
-        """:type kp: KuaiPan"""
+    def download(self):
+        """
+        Download next missing blocks in background, one part for each download worker.
+        Return True if completed
+        """
+        with self._rwlock:
+            if self.blocks is None:
+                return True
+            with self._cache_opened():
+                part_blocks = max(1, self.downloader.part_size // self.blocks.block_size)
+                run = self.blocks.next_missing(part_blocks * self.downloader.workers)
+                self._fetch_blocks([run], BACKGROUND)
+                self._check_completed()
+            return self.blocks is None
+
+    def upload(self, kp, find_source=None):
+        """
+        Upload modified file, unless the same content is at server already.
+
+        :type kp: KuaiPan
+        :param find_source: function of find_source(sha1), returning path of
+            file at server with given content, which is copied instead.
+        """
         with self._rwlock:
             if self.modified == NOT_MODIFIED:
                 return
 
-            """:type kp: KuaiPan"""
-            log.info(u"upload: %s", self.node.path)
-            if self.fh is not None:
-                os.close(self.fh)
-                kp.upload(self.node.path, open(self.cache_path, 'rb'), True)
+            if self.blocks is not None:
+                with self._cache_opened():
+                    self._fetch(0, self.blocks.size, UPLOAD)
+                    self._check_completed()
+
+            size = os.path.getsize(self.cache_path)
+            dirty = self.dirty
+            if dirty is not None and not dirty.changed(size) \
+                    and dirty.sha1 is not None and dirty.sha1 == self.node.sha1:
+                # server is not asked again, as nothing is written
+                log.info(u'skip upload of unwritten content: %s', self.node.path)
+                digest = dirty.sha1
             else:
-                kp.upload(self.node.path, self._data, True)
+                if dirty is not None:
+                    log.info(u'dirty %d bytes in %d ranges: %s', len(dirty), len(dirty.ranges),
+                             self.node.path)
+                digest = self._upload(kp, size, find_source)
 
-            self.node.update_meta(kp)
             self._update_cache_utime()
             self.modified = NOT_MODIFIED
+            self.dirty = None
+            self.sha1 = digest
+            if self.on_modified is not None:
+                self.on_modified(self, False)
+
+    def _upload(self, kp, size, find_source):
+        """Upload or copy content unless it is at server, return its hash"""
+        digest = (self._hash and self._hash.hexdigest(size)) or file_sha1(self.cache_path)
+        source = find_source(digest) if find_source and self.node.local else None
+        if digest == self.node.sha1:
+            log.info(u'skip upload of unchanged content: %s', self.node.path)
+        elif source and self._copy(kp, source):
+            log.info(u'copied from %s: %s', source, self.node.path)
+        else:
+            log.info(u"upload: %s", self.node.path)
+            with open(self.cache_path, 'rb') as f:
+                kp.upload(self.node.path, f, True, progress=log_progress(self.node.path))
+        self.node.update_meta(kp)
+        return digest
 
-    def _write_cache(self):
-        log.debug(u'writing to cache: %s', self.node.path)
-        cache_dir = os.path.dirname(self.cache_path)
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-        with open(self.cache_path, 'wb') as f:
-            f.write(self._data)
+    def _copy(self, kp, source):
+        """Copy file of the same content at server, return whether succeeded"""
+        try:
+            kp.copy(source, self.node.path)
+            return True
+        except Exception, e:
+            log.warn(u'failed to copy %s to %s: %s', source, self.node.path, e)
+            return False
 
     def _update_cache_utime(self):
         if os.path.exists(self.cache_path):
@@ -220,77 +615,141 @@ class FileCache(object):
 
 
 class CachePool(object):
-    def __init__(self, tree, pool_dir):
+    def __init__(self, tree, pool_dir, index_path,
+                 download_workers=DEFAULT_WORKERS,
+                 max_size=DEFAULT_MAX_SIZE, max_count=DEFAULT_MAX_COUNT,
+                 frequency_weight=0, expire_days=EXPIRE_DAYS,
+                 writeback_delay=WRITEBACK_DELAY, journal_path=None, use_mmap=False):
         """
         :type tree: NodeTree
+        :param index_path: path of cache index file
+        :param download_workers: number of concurrent connections for downloading
+        :param max_size: quota of total cache size in bytes
+        :param max_count: quota of cache object count
+        :param frequency_weight: seconds of recency worth every doubling of hits
+            when choosing objects to evict, 0 for pure LRU.
+        :param expire_days: evict objects not accessed for given days
+        :param writeback_delay: seconds a modified file must stay closed before upload
+        :param journal_path: path of journal of files not uploaded, beside index by default
+        :param use_mmap: serve reads of complete cache objects from memory maps
         :return:
         """
         assert os.path.isdir(pool_dir)
         self._cache_dict = dict()
+        # guard cache objects in dict and their reference counts
+        self._lock = threading.RLock()
         self.tree = tree
         self.kp = tree.kp
         self.pool_dir = pool_dir
-        self._clear_old_files()
-        self.thread_queue = Queue.Queue(1000)
+        self.max_size = max_size
+        self.max_count = max_count
+        self.use_mmap = use_mmap
+        self.frequency_weight = frequency_weight
+        # uploads, background downloads and parts of reads share the workers
+        self.scheduler = TransferScheduler(download_workers)
+        self.downloader = RangeDownloader(self.kp, scheduler=self.scheduler)
+        self.writeback = WriteBack(self._queue_upload, writeback_delay)
+        self.journal = Journal(journal_path or os.path.join(os.path.dirname(index_path),
+                                                            'journal.jsonl'))
+        self.journal.load()
+        # index may be saved before files in journal are modified
+        self.index = CacheIndex(index_path, pool_dir)
+        self.index.load(self.journal.paths())
+        self._evict(time.time() - expire_days * 24 * 60 * 60)
+        for path in self.journal.paths():
+            self.scheduler.submit(path, self._recover, path, priority=UPLOAD)
 
     def __del__(self):
-        while True:
-            a_thread = self.thread_queue.get()
-            if a_thread is None:
-                break
-            """:type a_thread: HelperThread"""
-            assert isinstance(a_thread, HelperThread)
-            a_thread.join()
-            self.thread_queue.task_done()
-
-    def _start_thread(self, t):
-        for i in xrange(self.thread_queue.qsize()):
-            a_thread = self.thread_queue.get()
-            if a_thread is None:
-                break
-            assert isinstance(a_thread, HelperThread)
-            if a_thread.is_alive:
-                self.thread_queue.put(a_thread)
-            self.thread_queue.task_done()
-
-        self.thread_queue.put(t)
-        t.start()
-
-    def _clear_old_files(self, passed_day=30):
+        self.shutdown()
+
+    def shutdown(self):
+        """Finish pending uploads and queued downloads, and save cache index"""
+        self.writeback.stop()
+        self.scheduler.close()
+        log.info(u'transfers: %s', self.scheduler.metrics())
+        self.journal.close()
+        log.info(u'pending upload: %d files, %d bytes', *self.index.pending())
+        self.save()
+
+    def _evict(self, expire_time=0):
         """
-        Clean cache files who's access time is before given days ago.
+        Remove cache objects exceeding quota or accessed before expire_time.
+        Opened, uploading and not-uploaded objects are pinned.
         """
-        import time
-        time_threshold = time.time() - passed_day * 60 * 60 * 24
-        log.info(u'remove files elder than %d days', passed_day)
-
-        def remove_if_old(name):
-            path = os.path.join(root, name)
-            if os.path.getatime(path) >= time_threshold:
-                return True
-            log.warn(u'remove old cache %s', path)
-            if os.path.isfile(path):
-                os.remove(path)
-            else:
-                shutil.rmtree(path)
-            return False
+        if self.index.over_quota(self.max_size, self.max_count):
+            # evict more than needed, so eviction does not run on every close
+            max_size = self.max_size * LOW_WATERMARK
+            max_count = int(self.max_count * LOW_WATERMARK)
+        elif expire_time:
+            max_size, max_count = self.max_size, self.max_count
+        else:
+            return
+        for path in self.index.victims(max_size, max_count, self._pinned,
+                                       self.frequency_weight, expire_time):
+            if self._pinned(path):
+                continue
+            log.info(u'evict cache: %s', path)
+            self._remove_cache_object(path)
+
+    def _pinned(self, path):
+        return self.contains(path) or path in self.journal
+
+    def _remove_cache_object(self, path):
+        cache_path = self._get_cache_path(path)
+        for x in (cache_path, cache_path + BLOCK_MAP_SUFFIX):
+            if os.path.exists(x):
+                os.remove(x)
+        self.index.remove(path)
+        self._remove_empty_dirs(os.path.dirname(cache_path))
+
+    def _remove_empty_dirs(self, cache_dir):
+        while len(cache_dir) > len(self.pool_dir) and cache_dir.startswith(self.pool_dir):
+            try:
+                os.rmdir(cache_dir)
+            except OSError:
+                break
+            cache_dir = os.path.dirname(cache_dir)
 
-        for root, dirs, files in os.walk(self.pool_dir):
-            dirs[:] = filter(remove_if_old, dirs)
-            files[:] = filter(remove_if_old, files)
+    def _update_index(self, c):
+        """:type c: FileCache"""
+        self.index.update(c.node.path,
+                          size=disk_usage(c.cache_path),
+                          mtime=c.node.attribute.mtime,
+                          dirty=c.modified != NOT_MODIFIED,
+                          sha1=c.sha1,
+                          extents=c.dirty_state())
+        self.index.save_if_needed()
 
     def _get_cache_path(self, path):
         return self.pool_dir + path
 
+    def _cancel(self, path):
+        """Cancel queued upload and background download of file"""
+        self.scheduler.cancel(path, UPLOAD)
+        self.scheduler.cancel(path, BACKGROUND)
+
     def _add(self, path):
         log.debug(u'add cache path: %s', path)
-        if path in self._cache_dict:
-            c = self.get(path)
-        else:
-            node = self.tree.get(path)
-            c = FileCache(node, self._get_cache_path(path))
-            self._cache_dict[path] = c
-        c.add_ref()
+        with self._lock:
+            c = self._cache_dict.get(path)
+            if c is not None:
+                c.add_ref()
+        if c is not None:
+            self._cancel(path)
+            return c
+        # node may be revalidated with server, not in lock
+        node = self.tree.get(path)
+        with self._lock:
+            c = self._cache_dict.get(path)
+            if c is None:
+                c = FileCache(node, self._get_cache_path(path), self.downloader, self._on_modified,
+                              self.use_mmap)
+                e = self.index.get(path)
+                if e is not None:
+                    c.sha1 = e.sha1
+                    c.restore_dirty(e.extents)
+                self._cache_dict[path] = c
+            c.add_ref()
         return c
 
     def _remove(self, c, delete=True):
@@ -303,30 +762,89 @@ class CachePool(object):
     def _remove_if_no_ref(self, c):
         """:type c: FileCache"""
         log.debug(u'remove cache path: %s (refcount=%d)', c.node.path, c.refcount)
-        if c.refcount == 0:
-            c = self._cache_dict.pop(c.node.path, None)
+        with self._lock:
+            if c.refcount == 0:
+                c = self._cache_dict.pop(c.node.path, None)
         return c
 
     def _download_item(self, c):
-        """:type c: FileCache"""
-        while True:
-            if c.refcount > 0:
-                break
-            if c.download(1024):
-                break
+        """
+        Download one part of file, and queue the next part behind other
+        files, so background downloads share workers fairly.
 
+        :type c: FileCache
+        """
+        try:
+            if c.refcount == 0 and not c.download():
+                self.scheduler.submit(c.node.path, self._download_item, c, priority=BACKGROUND)
+                return
+        except Exception:
+            log.exception(u'background download failed: %s', c.node.path)
+        self._update_index(c)
         self._remove_if_no_ref(c)
-        log.debug(u'download thread exited (size=%d): %s', c.data_size, c.node.path)
+        log.debug(u'background download stopped (missing=%d): %s', c.missing_size, c.node.path)
 
-    def _upload_item(self, c):
+    def _on_modified(self, c, dirty):
         """:type c: FileCache"""
-        time.sleep(0.5)
+        if dirty:
+            self.journal.add(c.node.path)
+        else:
+            self.journal.remove(c.node.path)
 
+    def _recover(self, path):
+        """Upload file modified but not uploaded by previous mount"""
+        if path in self._cache_dict:
+            return  # opened again, uploaded after closed
+        try:
+            node = self.tree.get(path)
+            if node is None:
+                node = self.tree.create(path, False)  # never uploaded
+                if node.parent is None:
+                    # not inserted, its path would be wrong. Kept in journal.
+                    log.warn(u'directory of not uploaded file is missing: %s', path)
+                    return
+            c = FileCache(node, self._get_cache_path(path), self.downloader, self._on_modified)
+            e = self.index.get(path)
+            if e is not None:
+                c.restore_dirty(e.extents)
+            if not c.recover():
+                log.warn(u'lost cache of modified file: %s', path)
+                self.journal.remove(path)
+                return
+        except Exception:
+            log.exception(u'failed to recover %s', path)
+            return
+        with self._lock:
+            if path in self._cache_dict:
+                return
+            self._cache_dict[path] = c
+        log.info(u'recovered modified file: %s', path)
+        self._upload_item(c)
+
+    def _find_source(self, sha1):
+        """Path of file at server with content of given hash, known from cache"""
+        path = self.index.find(sha1)
+        node = path and self.tree.peek(path)
+        if node is not None and not node.local and getattr(node, 'sha1', None) == sha1:
+            return path
+
+    def _queue_upload(self, path, c):
+        self.scheduler.submit(path, self._upload_item, c, priority=UPLOAD)
+
+    def _upload_item(self, c):
+        """:type c: FileCache"""
         if c.refcount == 0:
-            c.upload(self.kp)
+            try:
+                c.upload(self.kp, self._find_source)
+            except Exception:
+                log.exception(u'upload failed: %s', c.node.path)
+            self._update_index(c)
             self._remove_if_no_ref(c)
+        log.debug(u'upload finished: %s', c.node.path)
 
-        log.debug(u'upload thread exited: %s', c.node.path)
+    def save(self):
+        """Save cache index"""
+        self.index.save()
 
     def contains(self, path):
         return path in self._cache_dict
@@ -338,11 +856,12 @@ class CachePool(object):
     def open(self, path, flags):
         c = self._add(path)
         try:
-            c.open(self.kp, flags)
+            c.open(flags)
         except:
             log.warn(u'open failed: %s (refcount=%d)', path, c.refcount)
             self._remove(c)
             raise
+        self.index.touch(path)
         return c
 
     def create(self, path):
@@ -353,39 +872,71 @@ class CachePool(object):
             log.warn(u'create failed: %s (refcount=%d)', path, c.refcount)
             self._remove(c)
             raise
+        self.index.touch(path)
         return c
 
     def close(self, path):
         c = self._remove(self.get(path), delete=False)
         if c.refcount == 0:
-            if c.close():
-                self._cache_dict.pop(path)
+            ignored = c.close()
+            self._update_index(c)
+            if ignored:
+                self.journal.remove(path)
+                self._remove_if_no_ref(c)
             elif c.modified:
-                log.debug(u'running upload thread: %s', path)
-                self._start_thread(HelperThread(self._upload_item, c))
+                log.debug(u'write back later: %s', path)
+                self.writeback.add(path, c)
             elif not c.completed:
-                log.debug(u'running download thread: %s', path)
-                self._start_thread(HelperThread(self._download_item, c))
+                log.debug(u'queue background download: %s', path)
+                self.scheduler.submit(path, self._download_item, c, priority=BACKGROUND)
             else:
-                log.debug(u'pop file cache: %s', path)
+                self._remove_if_no_ref(c)
+            self._evict()
+
+    def sync(self, path):
+        """Upload modified file now, even if it is opened"""
+        c = self._cache_dict.get(path)
+        if c is None:
+            return
+        self.writeback.cancel(path)
+        self.scheduler.cancel(path, UPLOAD)
+        c.flush()
+        c.upload(self.kp, self._find_source)
+        self._update_index(c)
+
+    def delete(self, path):
+        """Cancel transfers of deleted file, and remove its cache object unless opened"""
+        self.writeback.cancel(path)
+        self._cancel(path)
+        self.journal.remove(path, 'delete')
+        with self._lock:
+            c = self._cache_dict.get(path)
+            if c is not None:
+                if c.refcount > 0:
+                    return
                 self._cache_dict.pop(path)
+        self._remove_cache_object(path)
 
     def move(self, old, new):
         old_cache_path = self._get_cache_path(old)
+        new_cache_path = self._get_cache_path(new)
         if os.path.exists(old_cache_path):
-            new_cache_path = self._get_cache_path(new)
+            new_cache_dir = os.path.dirname(new_cache_path)
+            if not os.path.exists(new_cache_dir):
+                os.makedirs(new_cache_dir)
             os.rename(old_cache_path, new_cache_path)
+            if os.path.exists(old_cache_path + BLOCK_MAP_SUFFIX):
+                os.rename(old_cache_path + BLOCK_MAP_SUFFIX, new_cache_path + BLOCK_MAP_SUFFIX)
+        self.index.move(old, new)
+        self.writeback.move(old, new)
+        self.journal.move(old, new)
+
+        # cache objects in use follow their nodes
+        prefix = old.rstrip('/') + '/'
+        with self._lock:
+            for path in self._cache_dict.keys():
+                if path == old or path.startswith(prefix):
+                    c = self._cache_dict.pop(path)
+                    c.cache_path = new_cache_path + path[len(old):]
+                    self._cache_dict[new + path[len(old):]] = c
 
-
-class HelperThread(threading.Thread):
-    def __init__(self, run_func, *args):
-        super(HelperThread, self).__init__()
-        self.run_func = run_func
-        self.args = args
-
-    def run(self):
-        try:
-            self.run_func(*self.args)
-        except:
-            log.exception('Exception raised in HelperThread')
-            raise
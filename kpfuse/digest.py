@@ -0,0 +1,48 @@
+# coding: utf-8
+
+"""
+Content hashes of cache objects, comparable with sha1 of server metadata
+"""
+
+import hashlib
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha1(path):
+    """Hex SHA-1 of file content"""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class SequentialHash(object):
+    """
+    SHA-1 computed incrementally while a file is written in order from the
+    start, e.g. by cp. Writes out of order make it unknown.
+    """
+    def __init__(self):
+        self._sha1 = hashlib.sha1()
+        self.size = 0
+        self.valid = True
+
+    def update(self, offset, data):
+        if self.valid and offset == self.size:
+            self._sha1.update(data)
+            self.size += len(data)
+        else:
+            self.valid = False
+
+    def truncate(self, length):
+        if length != self.size:
+            self.valid = False
+
+    def hexdigest(self, size):
+        """Hash of file of given size, or None if unknown"""
+        if self.valid and self.size == size:
+            return self._sha1.hexdigest()
@@ -0,0 +1,178 @@
+# coding: utf-8
+
+"""
+Parallel download of byte ranges with multiple HTTP connections
+"""
+
+import logging
+
+from .retry import is_transient
+from .scheduler import TransferScheduler
+from .scheduler import FOREGROUND
+from .scheduler import BACKGROUND
+from .scheduler import DEFAULT_WORKERS
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PART_SIZE = 4 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class IncompleteDownloadError(IOError):
+    pass
+
+
+def _stream_range(kp, path, begin, end, write):
+    """Stream [begin, end) bytes, and return the end of received data"""
+    # retried by caller, resuming from received data
+    r = kp.download(path, byte_range=(begin, end - 1), retries=0)
+    offset = begin
+    try:
+        if r.status_code != 206:
+            # partial content is not supported, skip leading data
+            log.warn(u'range download is not supported: %s', path)
+            skipped = 0
+            while skipped < begin:
+                chunk = r.raw.read(min(begin - skipped, CHUNK_SIZE))
+                if not chunk:
+                    break
+                skipped += len(chunk)
+        while offset < end:
+            chunk = r.raw.read(min(end - offset, CHUNK_SIZE))
+            if not chunk:
+                break
+            write(offset, chunk)
+            offset += len(chunk)
+    finally:
+        r.close()
+    return offset
+
+
+def fetch_range(kp, path, begin, end, write):
+    """
+    Download [begin, end) bytes of remote file, and stream the data to
+    write(offset, chunk) in chunks, so memory usage does not depend on
+    the size of range. Interrupted download is resumed from the last
+    received byte.
+
+    :type kp: kuaipan.KuaiPan
+    """
+    received = [begin]
+
+    def track(offset, chunk):
+        write(offset, chunk)
+        received[0] = offset + len(chunk)
+
+    attempt = 0
+    while True:
+        offset = received[0]
+        try:
+            if _stream_range(kp, path, offset, end, track) == end:
+                return
+            raise IncompleteDownloadError('incomplete download ({} of {} bytes): {}'.format(
+                received[0] - begin, end - begin, path.encode('utf-8')))
+        except Exception, e:
+            if not isinstance(e, IncompleteDownloadError) and not is_transient(e):
+                raise
+            if received[0] > offset:
+                attempt = 0  # made progress
+            if attempt >= kp.retry.retries:
+                raise
+            kp.retry.sleep(attempt, e)
+            attempt += 1
+
+
+def split_ranges(ranges, part_size, align=1):
+    """
+    Split [begin, end) ranges into parts no larger than part_size.
+    Part boundaries are aligned to align bytes.
+    """
+    part_size = max(align, part_size // align * align)
+    parts = []
+    for begin, end in ranges:
+        while begin < end:
+            stop = min(end, (begin // part_size + 1) * part_size)
+            parts.append((begin, stop))
+            begin = stop
+    return parts
+
+
+class RangeDownloader(object):
+    """
+    Download byte ranges of remote files concurrently, each part with its
+    own HTTP request, on workers of a transfer scheduler. The caller runs
+    parts not taken by workers yet, so reads never wait for busy workers.
+
+    :type kp: kuaipan.KuaiPan
+    :type scheduler: TransferScheduler
+    """
+    def __init__(self, kp, workers=DEFAULT_WORKERS, part_size=DEFAULT_PART_SIZE, scheduler=None):
+        self.kp = kp
+        self.part_size = part_size
+        self._own_scheduler = scheduler is None
+        self.scheduler = scheduler or TransferScheduler(workers)
+
+    @property
+    def workers(self):
+        return self.scheduler.workers
+
+    def _run(self, path, begin, end, write, done):
+        try:
+            fetch_range(self.kp, path, begin, end, write)
+        except Exception, e:
+            log.warn(u'download part [%d, %d) failed: %s (%s)', begin, end, path, e)
+            raise
+        if done is not None:
+            done(begin, end)
+
+    def download(self, path, ranges, write, done=None, align=1, priority=FOREGROUND):
+        """
+        Download [begin, end) byte ranges of remote file and wait until finished.
+
+        :param write: callback of write(offset, chunk), called from worker threads
+            for each received chunk, so it must be thread-safe.
+        :param done: callback of done(begin, end), called from worker threads
+            when a part is completely written.
+        :param align: alignment of part boundaries, e.g. block size of cache file
+        :param priority: priority of parts in scheduler
+        """
+        parts = split_ranges(ranges, self.part_size, align)
+        if not parts:
+            return
+        log.debug(u'download %d parts: %s', len(parts), path)
+        if len(parts) == 1 or self.workers == 1:
+            # no thread switching for small reads
+            for begin, end in parts:
+                self._run(path, begin, end, write, done)
+            return
+        tasks = [self.scheduler.submit(path, self._run, path, begin, end, write, done,
+                                       priority=priority)
+                 for begin, end in parts[1:]]
+        error = None
+        try:
+            self._run(path, parts[0][0], parts[0][1], write, done)
+        except Exception, e:
+            error = e
+        for task in tasks:
+            if error is None:
+                task.run()
+            elif task.cancel():
+                continue
+            e = task.error()
+            if error is None and e is not None:
+                error = e
+        if error is not None:
+            raise error
+
+    def submit(self, path, begin, end, write, done=None, priority=BACKGROUND):
+        """
+        Download [begin, end) bytes of remote file on a worker, without waiting.
+
+        :rtype: kpfuse.scheduler.Task
+        """
+        return self.scheduler.submit(path, self._run, path, begin, end, write, done,
+                                     priority=priority)
+
+    def close(self):
+        if self._own_scheduler:
+            self.scheduler.close()
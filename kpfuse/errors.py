@@ -13,6 +13,7 @@ class OAuthResponseError(Exception):
         """
         super(OAuthResponseError, self).__init__(dict(msg=description or response.content,
                                                       response=repr(response)))
+        self.response = response
 
 
 class FileNotExistedError(OAuthResponseError):
@@ -23,6 +24,11 @@ class FileExistedError(OAuthResponseError):
     pass
 
 
+class ServiceUnavailableError(IOError):
+    """Request is not sent as the service is down"""
+    pass
+
+
 def setup_logging(default_path='logging.json',
                   default_level=logging.DEBUG,
                   env_key='LOG_CFG',
@@ -0,0 +1,58 @@
+# coding: utf-8
+
+"""
+Byte ranges of a cache object changed since its content was the same as at
+server, so that unchanged objects are not uploaded again.
+"""
+
+import bisect
+
+
+class DirtyExtents(object):
+    """
+    Sorted and merged [begin, end) ranges written to a file, relative to the
+    content at server of given size and hash.
+
+    :param mtime: modified time of cache file when extents are recorded in
+        cache index, to detect writes not recorded before a crash
+    """
+    def __init__(self, size, sha1, ranges=(), mtime=None):
+        self.size = size
+        self.sha1 = sha1
+        self.ranges = [tuple(x) for x in ranges]
+        self.mtime = mtime
+
+    def __len__(self):
+        """Dirty bytes pending upload"""
+        return sum(end - begin for begin, end in self.ranges)
+
+    def add(self, begin, end):
+        if begin >= end:
+            return
+        ranges = self.ranges
+        # ranges overlapping or adjacent to [begin, end) are merged into one
+        i = bisect.bisect_left(ranges, (begin,))
+        if i > 0 and ranges[i - 1][1] >= begin:
+            i -= 1
+        j = bisect.bisect_left(ranges, (end + 1,), i)
+        if i < j:
+            begin, end = min(begin, ranges[i][0]), max(end, ranges[j - 1][1])
+        ranges[i:j] = [(begin, end)]
+
+    def truncate(self, old_size, size):
+        """Clip ranges after end of file, or add the zeros of an extended file"""
+        if size > old_size:
+            self.add(old_size, size)
+        else:
+            self.ranges = [(x[0], min(x[1], size)) for x in self.ranges if x[0] < size]
+
+    def changed(self, size):
+        """Whether file of given size differs from content at server"""
+        return bool(self.ranges) or size != self.size
+
+    def to_json(self):
+        return [self.size, self.sha1, self.ranges, self.mtime]
+
+    @classmethod
+    def from_json(cls, d):
+        return cls(*d)
@@ -0,0 +1,108 @@
+# coding: utf-8
+
+"""
+Positional reads and writes, which do not move the offset of the file
+descriptor, and readers with descriptors of their own, so threads read
+and write the same cache file in parallel.
+"""
+
+import os
+import threading
+
+try:
+    import ctypes
+    import ctypes.util
+
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _pwrite = getattr(_libc, 'pwrite64', None) or _libc.pwrite
+    _pwrite.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_size_t, ctypes.c_int64]
+    _pwrite.restype = ctypes.c_ssize_t
+except (ImportError, OSError, AttributeError):
+    _libc = None
+
+# serialize seek and read or write of each descriptor in the fallback
+_locks = dict()
+
+
+def _fd_lock(fd):
+    return _locks.get(fd) or _locks.setdefault(fd, threading.Lock())
+
+
+def _check(n):
+    if n < 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return n
+
+
+if hasattr(os, 'pread'):
+    pread = os.pread
+else:
+    # reads into a buffer of ctypes cost one more copy than os.read
+    def pread(fd, size, offset):
+        """Read at most size bytes at offset of file descriptor"""
+        with _fd_lock(fd):
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.read(fd, size)
+
+if hasattr(os, 'pwrite'):
+    pwrite = os.pwrite
+
+elif _libc is not None:
+    def pwrite(fd, data, offset):
+        """Write data at offset of file descriptor, return bytes written"""
+        return _check(_pwrite(fd, data, len(data), offset))
+
+else:
+    def pwrite(fd, data, offset):
+        """Write data at offset of file descriptor, return bytes written"""
+        with _fd_lock(fd):
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.write(fd, data)
+
+
+class FileReader(object):
+    """
+    Read a file at offsets from many threads without a lock. Each reader
+    takes a descriptor of its own, so seek and read of one thread do not
+    move the offset of others. Descriptors are kept for later reads.
+
+    :param fd: descriptor of the file, read with the lock if the file can
+        not be opened again, e.g. it is being renamed
+    :param path: path of the file, updated when it is renamed
+    """
+    def __init__(self, fd, path):
+        self.fd = fd
+        self.path = path
+        self._fds = []  # descriptors not used by any reader
+
+    def read(self, size, offset):
+        try:
+            fd = self._fds.pop()
+        except IndexError:
+            try:
+                fd = os.open(self.path, os.O_RDONLY)
+            except OSError:
+                return pread(self.fd, size, offset)
+        try:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.read(fd, size)
+        finally:
+            self._fds.append(fd)
+
+    def close(self):
+        fds, self._fds = self._fds, []
+        for fd in fds:
+            os.close(fd)
+
+
+def pwrite_all(fd, data, offset):
+    """Write all data at offset of file descriptor, retrying short writes"""
+    total = len(data)
+    while data:
+        n = pwrite(fd, data, offset)
+        if n == 0:
+            raise IOError('no data is written at {}'.format(offset))
+        offset += n
+        data = data[n:]
+    return total
@@ -0,0 +1,117 @@
+# coding: utf-8
+
+"""
+Results of operations running on other threads
+"""
+
+import time
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class CancelledError(Exception):
+    pass
+
+
+class Future(object):
+    """Result of an operation which may be not finished yet"""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._state = 'pending'  # pending, running, cancelled or done
+        self._result = None
+        self._error = None
+        self._traceback = None
+        self._callbacks = []
+
+    def done(self):
+        with self._cond:
+            return self._state in ('cancelled', 'done')
+
+    def cancelled(self):
+        with self._cond:
+            return self._state == 'cancelled'
+
+    def cancel(self):
+        """Cancel operation not started yet, return whether it is cancelled"""
+        with self._cond:
+            if self._state == 'pending':
+                self._state = 'cancelled'
+                self._error = CancelledError()
+            elif self._state != 'cancelled':
+                return False
+            self._cond.notify_all()
+        self._invoke_callbacks()
+        return True
+
+    def set_running(self):
+        """Return False if it is cancelled"""
+        with self._cond:
+            if self._state != 'pending':
+                return False
+            self._state = 'running'
+            return True
+
+    def set_result(self, result):
+        with self._cond:
+            self._state = 'done'
+            self._result = result
+            self._cond.notify_all()
+        self._invoke_callbacks()
+
+    def set_error(self, error, traceback=None):
+        with self._cond:
+            self._state = 'done'
+            self._error = error
+            self._traceback = traceback
+            self._cond.notify_all()
+        self._invoke_callbacks()
+
+    def error(self, timeout=None):
+        self._wait(timeout)
+        return self._error
+
+    def result(self, timeout=None):
+        """Wait for result, the error of operation is raised"""
+        self._wait(timeout)
+        if self._error is not None:
+            if self._traceback is not None:
+                raise self._error.__class__, self._error, self._traceback
+            raise self._error
+        return self._result
+
+    def add_done_callback(self, func):
+        """Call func(future) when it is done, or now if it is done already"""
+        with self._cond:
+            if self._state not in ('cancelled', 'done'):
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def _wait(self, timeout):
+        """Wait until done, at most timeout seconds unless it is None"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._state not in ('cancelled', 'done'):
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise RuntimeError('operation is not finished in {} seconds'.format(timeout))
+                self._cond.wait(remaining)
+
+    def _invoke_callbacks(self):
+        with self._cond:
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            try:
+                func(self)
+            except Exception:
+                log.exception(u'failed to call back future')
+
+
+def wait(futures, timeout=None):
+    """Wait for all futures, and return their results"""
+    return [x.result(timeout) for x in futures]
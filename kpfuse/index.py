@@ -0,0 +1,251 @@
+# coding: utf-8
+
+"""
+Persistent index of cache objects for quota and eviction
+"""
+
+import os
+import json
+import math
+import time
+import logging
+import threading
+
+from .blocks import BlockMap
+from .blocks import BLOCK_MAP_SUFFIX
+from .extents import DirtyExtents
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024 * 1024
+DEFAULT_MAX_COUNT = 100000
+SAVE_INTERVAL = 60
+
+
+def disk_usage(path):
+    """Allocated size of file, sparse files only count present blocks"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+    if hasattr(st, 'st_blocks'):
+        return st.st_blocks * 512
+    return st.st_size
+
+
+class IndexEntry(object):
+    def __init__(self, size=0, mtime=0, atime=None, hits=0, dirty=False, sha1=None, extents=None):
+        self.size = size
+        self.mtime = mtime
+        self.atime = time.time() if atime is None else atime
+        self.hits = hits
+        self.dirty = dirty
+        self.sha1 = sha1  # hash of complete content, None if unknown or modified
+        self.extents = extents  # JSON of DirtyExtents of modified object, None if unknown
+
+    def score(self, frequency_weight):
+        """
+        Eviction score, the lowest one is evicted first.
+        Every doubling of hits is worth frequency_weight seconds of recency.
+        """
+        return self.atime + frequency_weight * math.log(1 + self.hits, 2)
+
+    def to_json(self):
+        return [self.size, self.mtime, self.atime, self.hits, self.dirty, self.sha1, self.extents]
+
+    @classmethod
+    def from_json(cls, d):
+        return cls(*d)
+
+
+class CacheIndex(object):
+    """
+    Index of cache objects with size, server modified time and last access,
+    saved as a JSON file so that quota is enforced without walking the pool.
+    """
+    def __init__(self, path, pool_dir):
+        self.path = path
+        self.pool_dir = pool_dir
+        self.entries = dict()
+        self.total_size = 0
+        self._sha1_paths = dict()  # sha1 -> set of paths, to find objects by content
+        self._lock = threading.RLock()
+        self._changed = False
+        self._save_time = time.time()
+
+    def load(self, dirty_paths=()):
+        """
+        Load index, or rebuild it from cache pool if it is missing.
+
+        :param dirty_paths: paths of objects known to be modified, e.g. from
+            journal, which may be newer than the saved index
+        """
+        with self._lock:
+            try:
+                with open(self.path, 'rt') as f:
+                    entries = json.load(f)
+                self.entries = dict((k, IndexEntry.from_json(v)) for k, v in entries.iteritems())
+                self._changed = False
+            except (IOError, OSError, ValueError, TypeError), e:
+                log.warn(u'rebuild cache index (%s)', e)
+                self.rebuild()
+            for path in dirty_paths:
+                e = self.entries.get(path)
+                if e is not None and not e.dirty:
+                    e.dirty = True
+                    self._changed = True
+            self.total_size = sum(x.size for x in self.entries.itervalues())
+            self._sha1_paths = dict()
+            for path, e in self.entries.iteritems():
+                self._link_sha1(path, e.sha1)
+            log.info(u'cache index: %d objects, %d bytes', len(self.entries), self.total_size)
+
+    def rebuild(self):
+        with self._lock:
+            self.entries = dict()
+            for root, dirs, files in os.walk(self.pool_dir):
+                for name in files:
+                    if name.endswith(BLOCK_MAP_SUFFIX):
+                        continue
+                    cache_path = os.path.join(root, name)
+                    path = cache_path[len(self.pool_dir):].decode('utf-8')
+                    st = os.stat(cache_path)
+                    # partial objects record whether they are modified
+                    blocks = BlockMap.load(cache_path + BLOCK_MAP_SUFFIX)
+                    self.entries[path] = IndexEntry(disk_usage(cache_path), st.st_mtime, st.st_atime,
+                                                    dirty=blocks is not None and blocks.modified)
+            self._changed = True
+
+    def save(self):
+        with self._lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wt') as f:
+                json.dump(dict((k, v.to_json()) for k, v in self.entries.iteritems()), f)
+            os.rename(tmp_path, self.path)
+            self._changed = False
+            self._save_time = time.time()
+
+    def save_if_needed(self):
+        with self._lock:
+            if self._changed and time.time() - self._save_time > SAVE_INTERVAL:
+                self.save()
+
+    @property
+    def count(self):
+        return len(self.entries)
+
+    def get(self, path):
+        """:rtype: IndexEntry"""
+        with self._lock:
+            return self.entries.get(path)
+
+    def touch(self, path):
+        """Record an access of cache object"""
+        with self._lock:
+            e = self.entries.get(path)
+            if e is None:
+                e = self.entries[path] = IndexEntry()
+            e.atime = time.time()
+            e.hits += 1
+            self._changed = True
+
+    def update(self, path, size=None, mtime=None, dirty=None, sha1=False, extents=False):
+        """Update entry, sha1 and extents are kept unless given"""
+        with self._lock:
+            e = self.entries.get(path)
+            if e is None:
+                e = self.entries[path] = IndexEntry()
+            if size is not None:
+                self.total_size += size - e.size
+                e.size = size
+            if mtime is not None:
+                e.mtime = mtime
+            if dirty is not None:
+                e.dirty = dirty
+            if sha1 is not False and sha1 != e.sha1:
+                self._unlink_sha1(path, e.sha1)
+                self._link_sha1(path, sha1)
+                e.sha1 = sha1
+            if extents is not False:
+                e.extents = extents
+            self._changed = True
+
+    def remove(self, path):
+        with self._lock:
+            e = self.entries.pop(path, None)
+            if e is not None:
+                self._unlink_sha1(path, e.sha1)
+                self.total_size -= e.size
+                self._changed = True
+
+    def move(self, old, new):
+        """Move entry of file, or entries under directory"""
+        with self._lock:
+            prefix = old.rstrip('/') + '/'
+            for path in self.entries.keys():
+                if path == old or path.startswith(prefix):
+                    new_path = new + path[len(old):]
+                    replaced = self.entries.get(new_path)
+                    if replaced is not None:
+                        self._unlink_sha1(new_path, replaced.sha1)
+                        self.total_size -= replaced.size
+                    e = self.entries[new_path] = self.entries.pop(path)
+                    self._unlink_sha1(path, e.sha1)
+                    self._link_sha1(new_path, e.sha1)
+            self._changed = True
+
+    def find(self, sha1):
+        """Path of a clean cache object with given content hash, or None"""
+        with self._lock:
+            for path in self._sha1_paths.get(sha1, ()):
+                if not self.entries[path].dirty:
+                    return path
+
+    def _link_sha1(self, path, sha1):
+        if sha1 is not None:
+            self._sha1_paths.setdefault(sha1, set()).add(path)
+
+    def _unlink_sha1(self, path, sha1):
+        paths = self._sha1_paths.get(sha1)
+        if paths is not None:
+            paths.discard(path)
+            if not paths:
+                del self._sha1_paths[sha1]
+
+    def pending(self):
+        """Count of modified objects and their dirty bytes pending upload"""
+        with self._lock:
+            count, size = 0, 0
+            for e in self.entries.itervalues():
+                if not e.dirty:
+                    continue
+                count += 1
+                # whole object is pending if its dirty ranges are unknown
+                size += len(DirtyExtents.from_json(e.extents)) if e.extents else e.size
+            return count, size
+
+    def over_quota(self, max_size, max_count):
+        with self._lock:
+            return self.total_size > max_size or len(self.entries) > max_count
+
+    def victims(self, max_size, max_count, pinned=lambda path: False,
+                frequency_weight=0, expire_time=0):
+        """
+        Return paths of cache objects to evict, in the order of eviction score,
+        until the quota is satisfied. Objects accessed before expire_time are
+        evicted too.
+
+        :param pinned: function to check whether object must not be evicted
+        """
+        with self._lock:
+            total_size, count = self.total_size, len(self.entries)
+            paths = []
+            for path, e in sorted(self.entries.iteritems(), key=lambda x: x[1].score(frequency_weight)):
+                if total_size <= max_size and count <= max_count and e.atime >= expire_time:
+                    continue
+                if e.dirty or pinned(path):
+                    continue
+                paths.append(path)
+                total_size -= e.size
+                count -= 1
+            return paths
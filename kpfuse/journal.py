@@ -0,0 +1,121 @@
+# coding: utf-8
+
+"""
+Journal of cache objects modified but not uploaded yet, so that they are
+uploaded after a crash without being opened again.
+
+Each line is a JSON record, appended and synced before it takes effect:
+    {"op": "dirty", "path": ...}   file is modified
+    {"op": "clean", "path": ...}   file is uploaded
+    {"op": "delete", "path": ...}  file is deleted
+    {"op": "move", "old": ..., "new": ...}  file or directory is renamed
+"""
+
+import os
+import json
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# records appended before the journal is compacted
+COMPACT_RECORDS = 1000
+
+
+class Journal(object):
+    def __init__(self, path):
+        self.path = path
+        self.pending = set()
+        self._f = None
+        self._records = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, path):
+        with self._lock:
+            return path in self.pending
+
+    def paths(self):
+        with self._lock:
+            return sorted(self.pending)
+
+    def load(self):
+        """Replay journal left by previous mount, and compact it"""
+        with self._lock:
+            self.pending = set()
+            if os.path.exists(self.path):
+                with open(self.path, 'rt') as f:
+                    for line in f:
+                        try:
+                            self._replay(json.loads(line))
+                        except (ValueError, KeyError, TypeError):
+                            # only the last record may be partially written by a crash
+                            log.warn(u'ignore broken journal record: %r', line)
+            if self.pending:
+                log.info(u'journal: %d files not uploaded', len(self.pending))
+            self._compact()
+
+    def _replay(self, record):
+        op = record['op']
+        if op == 'dirty':
+            self.pending.add(record['path'])
+        elif op in ('clean', 'delete'):
+            self.pending.discard(record['path'])
+        elif op == 'move':
+            self._move(record['old'], record['new'])
+
+    def _move(self, old, new):
+        prefix = old.rstrip('/') + '/'
+        moved = [x for x in self.pending if x == old or x.startswith(prefix)]
+        for x in moved:
+            self.pending.remove(x)
+            self.pending.add(new + x[len(old):])
+        return moved
+
+    def _compact(self):
+        """Rewrite journal with pending files only"""
+        if self._f is not None:
+            self._f.close()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wt') as f:
+            for path in sorted(self.pending):
+                f.write(json.dumps(dict(op='dirty', path=path)) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.path)
+        self._f = open(self.path, 'at')
+        self._records = len(self.pending)
+
+    def _append(self, record):
+        if self._f is None:
+            self._compact()
+        self._f.write(json.dumps(record) + '\n')
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._records += 1
+        if self._records > max(COMPACT_RECORDS, 2 * len(self.pending)):
+            self._compact()
+
+    def add(self, path):
+        """Record file is modified, before its cache object is changed"""
+        with self._lock:
+            if path not in self.pending:
+                self._append(dict(op='dirty', path=path))
+                self.pending.add(path)
+
+    def remove(self, path, op='clean'):
+        """Record file is uploaded, or deleted"""
+        with self._lock:
+            if path in self.pending:
+                self._append(dict(op=op, path=path))
+                self.pending.remove(path)
+
+    def move(self, old, new):
+        with self._lock:
+            if self._move(old, new):
+                self._append(dict(op='move', old=old, new=new))
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
@@ -8,12 +8,25 @@ Code inspired from https://github.com/wusuopu/kuaipan-linux
 
 import os
 import errno
+import itertools
 import fuse
 import logging
 import threading
 
 import cache
 from .node import NodeTree
+from .errors import ServiceUnavailableError
+from .node import ATTR_TTL
+from .node import DIR_TTL
+from .node import NEGATIVE_TTL
+from .prefetch import PREFETCH_DEPTH
+from .writeback import WRITEBACK_DELAY
+from .readahead import ReadAhead
+from .readahead import READAHEAD_MAX
+from .locks import PathLocks
+from .download import DEFAULT_WORKERS
+from .index import DEFAULT_MAX_SIZE
+from .index import DEFAULT_MAX_COUNT
 
 
 class LoggingMixIn(object):
@@ -40,6 +53,9 @@ class LoggingMixIn(object):
                 self.log.debug(u"<- %s: %s %s", op, path, msg)
         except fuse.FuseOSError:
             raise
+        except ServiceUnavailableError, e:
+            self.log.warn(u'%s failed: %s (%s)', op, path, e)
+            raise fuse.FuseOSError(errno.EIO)
         except:
             self.log.exception('__call__ exception')
             raise
@@ -49,30 +65,65 @@ class KuaipanFuseOperations(LoggingMixIn, fuse.Operations):
     """
     :type kp: kuaipan.KuaiPan
     """
-    def __init__(self, kp, profile_dir):
+    def __init__(self, kp, profile_dir, download_workers=DEFAULT_WORKERS,
+                 cache_size=DEFAULT_MAX_SIZE, cache_count=DEFAULT_MAX_COUNT,
+                 attr_ttl=ATTR_TTL, dir_ttl=DIR_TTL, negative_ttl=NEGATIVE_TTL,
+                 prefetch_depth=PREFETCH_DEPTH, writeback_delay=WRITEBACK_DELAY,
+                 upload_rate=None, readahead_max=READAHEAD_MAX, use_mmap=False):
+        """
+        :param upload_rate: bytes per second of all uploads, None for unlimited
+        :param readahead_max: bytes read ahead of sequential reads at most, 0 to disable
+        :param use_mmap: serve reads of complete cache files from memory maps
+        """
         self.kp = kp
-        self.tree = NodeTree(kp)
+        kp.set_upload_rate(upload_rate)
+        # each download worker and FUSE thread may hold a connection
+        kp.set_pool_size(max(kp.pool_size, 2 * download_workers))
+        self.tree = NodeTree(kp, os.path.join(profile_dir, 'metadata_snapshot.json.gz'),
+                             attr_ttl, dir_ttl, negative_ttl, prefetch_depth=prefetch_depth)
         self.profile_dir = profile_dir
         self.cache_dir = os.path.join(profile_dir, 'object')
         self.fd = 0
         self.fd_map = dict()
-        self.rwlock = threading.Lock()
+        self.readahead_map = dict()  # fd -> ReadAhead
+        self.readahead_max = readahead_max
+        self.fd_lock = threading.Lock()
+        # operations on the same paths, or under directories being changed, are serialized
+        self.locks = PathLocks()
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
-        self.caches = cache.CachePool(self.tree, self.cache_dir)
+        self.caches = cache.CachePool(self.tree, self.cache_dir,
+                                      os.path.join(profile_dir, 'object_index.json'),
+                                      download_workers,
+                                      max_size=cache_size,
+                                      max_count=cache_count,
+                                      writeback_delay=writeback_delay,
+                                      journal_path=os.path.join(profile_dir, 'writeback_journal.jsonl'),
+                                      use_mmap=use_mmap)
 
     def __del__(self):
-        with self.rwlock:
-            del self.caches     # Invoke the destructor
+        del self.caches     # Invoke the destructor
 
     def _get_fd(self, c):
-        if len(self.fd_map) != 0:
-            self.fd += 1
-        self.fd_map[self.fd] = c
-        return self.fd
+        with self.fd_lock:
+            if len(self.fd_map) != 0:
+                self.fd += 1
+            self.fd_map[self.fd] = c
+            self.readahead_map[self.fd] = ReadAhead(max_size=self.readahead_max)
+            return self.fd
+
+    def _put_fd(self, fh):
+        with self.fd_lock:
+            self.fd_map.pop(fh)
+            self.readahead_map.pop(fh, None)
 
     # ----------------------------------------------------
 
+    def destroy(self, path):
+        # unmount, after queued uploads are finished
+        self.caches.shutdown()
+        self.tree.close()
+
     def access(self, path, amode):
         # whether path is accessible?
         return 0
@@ -89,59 +140,69 @@ class KuaipanFuseOperations(LoggingMixIn, fuse.Operations):
 
     def readdir(self, path, fh):
         # return name list in directory
-        node = self.tree.get(path)
-        if not node:
+        names = self.tree.readdir(path)
+        if names is None:
             raise fuse.FuseOSError(errno.ENOENT)
-        return ['.', '..'] + node.names()
+        return itertools.chain(['.', '..'], names)
 
     def rename(self, old, new):
         # rename file or directory
-        with self.rwlock:
+        with self.locks.hold(old, new):
             self.kp.move(old, new)
             self.tree.move(old, new)
             self.caches.move(old, new)
+            self.tree.invalidate(os.path.dirname(old))
+            self.tree.invalidate(os.path.dirname(new))
 
     def mkdir(self, path, mode=0644):
         # create directory
-        with self.rwlock:
+        with self.locks.hold(path):
             self.kp.mkdir(path)
             self.tree.create(path, True)
+            self.tree.invalidate(os.path.dirname(path))
+
+    def _remove(self, path):
+        # TODO: force delete not-uploaded new file
+        self.kp.delete(path, force=True)
+        self.tree.remove(path)
+        self.tree.invalidate(os.path.dirname(path))
 
     def rmdir(self, path):
         # remove directory
-        with self.rwlock:
-            # TODO: force delete not-uploaded new file
-            self.kp.delete(path, force=True)
-            self.tree.remove(path)
+        with self.locks.hold(path):
+            self._remove(path)
 
     def unlink(self, path):
         # remove file or directory
-        self.rmdir(path)
+        with self.locks.hold(path):
+            self._remove(path)
+            self.caches.delete(path)
 
     def create(self, path, mode=0644, fi=None):
         # create file
-        with self.rwlock:
+        with self.locks.hold(path):
             self.tree.create(path, False)
             c = self.caches.create(path)
-            return self._get_fd(c)
+        return self._get_fd(c)
 
     def open(self, path, flags):
         # open file for reading or writing
-        with self.rwlock:
+        self.tree.get(path)  # revalidate attributes with server, not in lock
+        with self.locks.hold(path):
             c = self.caches.open(path, flags)
-            return self._get_fd(c)
+        return self._get_fd(c)
 
     def release(self, path, fh):
         # close file
-        with self.rwlock:
+        with self.locks.hold(path):
             self.caches.close(path)
-            self.fd_map.pop(fh)
-            return 0
+        self._put_fd(fh)
+        return 0
 
     def read(self, path, size, offset, fh):
         # read data from file
         c = self.fd_map[fh]
-        return c.read(size, offset)
+        return c.read(size, offset, self.readahead_map.get(fh))
 
     def write(self, path, data, offset, fh):
         # write date to file
@@ -150,11 +211,16 @@ class KuaipanFuseOperations(LoggingMixIn, fuse.Operations):
 
     def truncate(self, path, length, fh=None):
         # truncate data in file
-        with self.rwlock:
+        with self.locks.hold(path):
             c = self.caches.get(path) if fh is None else self.fd_map[fh]
             return c.truncate(length)
 
     def flush(self, path, fh):
         # flush file data to disk
         self.fd_map[fh].flush()
+        return 0
+
+    def fsync(self, path, datasync, fh):
+        # upload file data to server now
+        self.caches.sync(path)
         return 0
\ No newline at end of file
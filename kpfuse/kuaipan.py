@@ -6,11 +6,18 @@ Kuaipan Python API:
 """
 
 import os
+import time
 import json
+import threading
 from urllib import quote
+from requests.adapters import HTTPAdapter
 from requests_oauthlib import OAuth1Session
 
 import errors
+from retry import RetryPolicy
+from retry import CircuitBreaker
+from multipart import MultipartFile
+from ratelimit import RateLimiter
 
 
 API_VERSION = 1
@@ -19,26 +26,88 @@ CONV_HOST = 'http://conv.kuaipan.cn/'
 CONTENT_HOST = 'http://api-content.dfs.kuaipan.cn/'
 AUTH_URL = 'https://www.kuaipan.cn/api.php?ac=open&op=authorise'
 
+# (connect, read) timeouts in seconds of each kind of request
+TIMEOUTS = {
+    'API': (3.05, 10),
+    'CONV': (3.05, 30),
+    'CONTENT': (3.05, 30),
+    'UPLOAD': (3.05, 300),
+}
+# connections kept alive per host
+POOL_SIZE = 16
+# hosts with connection pools kept, API, CONV, CONTENT and upload hosts
+POOL_HOSTS = 8
+# seconds a located upload host is reused
+UPLOAD_LOCATE_TTL = 600
+# file operations safe to retry, other ones change files at server
+IDEMPOTENT_OPS = ('fileops/upload_locate', 'fileops/download_file',
+                  'fileops/thumbnail', 'fileops/documentView')
+
 
 class KuaiPan(object):
     def __init__(self,
                  client_key, client_secret,
                  resource_owner_key=None, resource_owner_secret=None,
-                 root='kuaipan'):
-        self.oauth = OAuth1Session(client_key,
-                                   client_secret,
-                                   resource_owner_key,
-                                   resource_owner_secret,
-                                   callback_uri='http://localhost:8888',
-                                   signature_type=u'QUERY')
+                 root='kuaipan', pool_size=POOL_SIZE, timeouts=None, retry=None,
+                 upload_rate=None):
+        """
+        Each thread has its own session, as sessions are not thread-safe.
+        The sessions share connection pools, so connections are kept alive
+        and reused across requests of all threads.
+
+        :param pool_size: connections kept alive per host
+        :param timeouts: (connect, read) timeouts of kinds of request, see TIMEOUTS
+        :type retry: RetryPolicy
+        :param upload_rate: bytes per second of all uploads, None for unlimited
+        """
+        self._credentials = (client_key, client_secret, resource_owner_key, resource_owner_secret)
+        self._local = threading.local()
+        # sessions of threads are created again once it changes
+        self._generation = 0
         self.root = root
+        self.timeouts = dict(TIMEOUTS, **(timeouts or dict()))
+        self.retry = retry or RetryPolicy(breaker=CircuitBreaker())
+        self.upload_limiter = RateLimiter(upload_rate)
+        self._upload_hosts = dict()  # source_ip -> (host, expire time)
+        self._upload_hosts_lock = threading.Lock()
+        self.set_pool_size(pool_size)
+
+    @property
+    def oauth(self):
+        """
+        OAuth session of current thread
+
+        :rtype: OAuth1Session
+        """
+        local = self._local
+        if getattr(local, 'generation', None) != self._generation:
+            local.session = self._new_session()
+            local.generation = self._generation
+        return local.session
+
+    def _new_session(self):
+        session = OAuth1Session(*self._credentials,
+                                callback_uri='http://localhost:8888',
+                                signature_type=u'QUERY')
+        session.mount('http://', self._adapter)
+        session.mount('https://', self._adapter)
+        return session
+
+    def set_pool_size(self, pool_size):
+        """Keep up to pool_size connections alive per host"""
+        self.pool_size = pool_size
+        # connection pools of adapter are thread-safe, shared by sessions of all threads
+        self._adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=pool_size)
+        self._generation += 1
 
     def authorise(self, callback=None):
+        oauth = self.oauth
+
         # requestToken
-        self.oauth.fetch_request_token(API_HOST + 'open/requestToken')
+        oauth.fetch_request_token(API_HOST + 'open/requestToken')
 
         # authorize
-        authorization_url = self.oauth.authorization_url(AUTH_URL)
+        authorization_url = oauth.authorization_url(AUTH_URL)
         if callback:
             verifier = callback(authorization_url)
         else:
@@ -46,16 +115,20 @@ class KuaiPan(object):
             verifier = raw_input('Paste the verifier here: ')
 
         # accessToken
-        self.oauth.fetch_access_token(API_HOST + 'open/accessToken', verifier)
+        oauth.fetch_access_token(API_HOST + 'open/accessToken', verifier)
+        cc = oauth.auth.client
+        self._credentials = (cc.client_key, cc.client_secret,
+                             cc.resource_owner_key, cc.resource_owner_secret)
+        self._generation += 1
 
     def save(self, filename):
         with open(filename, 'wt') as f:
-            cc = self.oauth.auth.client
+            client_key, client_secret, resource_owner_key, resource_owner_secret = self._credentials
             json.dump(
-                dict(client_key=cc.client_key,
-                     client_secret=cc.client_secret,
-                     resource_owner_key=cc.resource_owner_key,
-                     resource_owner_secret=cc.resource_owner_secret,
+                dict(client_key=client_key,
+                     client_secret=client_secret,
+                     resource_owner_key=resource_owner_key,
+                     resource_owner_secret=resource_owner_secret,
                      root=self.root),
                 f, indent=2)
 
@@ -74,12 +147,22 @@ class KuaiPan(object):
         else:
             return url
 
-    def get(self, url, api='API', path=None, **kwargs):
+    def get(self, url, api='API', path=None, retries=None, **kwargs):
+        """
+        Send GET request, transient failures are retried if it is safe
+
+        :param retries: times to retry, None for the retry policy's default
+        """
+        idempotent = not url.startswith('fileops/') or url in IDEMPOTENT_OPS
         url = self.build_url(url, api, path)
-        timeout = kwargs.pop('timeout', 1)
-        r = self.oauth.get(url, timeout=timeout, **kwargs)
-        """:type: Response"""
-        if r.status_code == 200:
+        kwargs.setdefault('timeout', self.timeouts.get(api, self.timeouts['API']))
+        return self.retry.call(lambda: self._check(self.oauth.get(url, **kwargs)),
+                               idempotent, retries)
+
+    @staticmethod
+    def _check(r):
+        """:type r: Response"""
+        if r.status_code in (200, 206):
             return r
         elif r.status_code == 403:
             raise errors.FileExistedError(r)
@@ -151,34 +234,75 @@ class KuaiPan(object):
     def copy_ref(self, path, **kwargs):
         return self.get('copy_ref', path=path, **kwargs).json()
 
-    def upload(self, path, data, overwrite=True, source_ip=None, **kwargs):
+    def upload_host(self, source_ip=None):
+        """Host to upload files to, located once per UPLOAD_LOCATE_TTL"""
+        with self._upload_hosts_lock:
+            host, expire_time = self._upload_hosts.get(source_ip, (None, 0))
+        if host is None or time.time() > expire_time:
+            # not in lock, uploads do not wait for each other's requests
+            host = self.get('fileops/upload_locate', api='CONTENT', params={
+                'source_ip': source_ip
+            }).json().get('url')
+            with self._upload_hosts_lock:
+                self._upload_hosts[source_ip] = (host, time.time() + UPLOAD_LOCATE_TTL)
+        return host
+
+    def set_upload_rate(self, upload_rate):
+        """Limit bytes per second of all uploads, None for unlimited"""
+        self.upload_limiter.rate = upload_rate
+
+    def upload(self, path, data, overwrite=True, source_ip=None, progress=None, **kwargs):
         """
+        Upload file streamed from its current position, it is never read
+        into memory as a whole.
+
         :param data: file object or str data.
+        :param progress: function of progress(sent, total) in bytes
         """
-        host = self.get('fileops/upload_locate', api='CONTENT', params={
-            'source_ip': source_ip
-        }).json().get('url')
+        host = self.upload_host(source_ip)
         url = os.path.join(host, str(API_VERSION), 'fileops/upload_file')
-        return self.oauth.post(url, params={
-            'root': self.root,
-            'path': path,
-            'overwrite': overwrite,
-        }, files=dict(file=data), **kwargs).json()
+        kwargs.setdefault('timeout', self.timeouts['UPLOAD'])
+        body = MultipartFile(data, filename=os.path.basename(path),
+                             progress=progress, limiter=self.upload_limiter)
+        headers = kwargs.setdefault('headers', dict())
+        headers['Content-Type'] = body.content_type
 
-    def download(self, path, rev=None, **kwargs):
+        def post():
+            body.rewind()
+            return self._check(self.oauth.post(url, params={
+                'root': self.root,
+                'path': path,
+                'overwrite': overwrite,
+            }, data=body, **kwargs))
+
+        try:
+            return self.retry.call(post, overwrite).json()
+        except Exception:
+            # locate again, in case the host is gone
+            with self._upload_hosts_lock:
+                self._upload_hosts.pop(source_ip, None)
+            raise
+
+    def download(self, path, rev=None, byte_range=None, **kwargs):
         """
         Download file and return requests.Response
 
+        :param byte_range: (first, last) inclusive byte positions to download.
+            The response status is 206 if server supports partial content.
+
         if r.status_code == 200:
             with open(local_path, 'wb') as f:
                 for chunk in r.iter_content(1024):
                     f.write(chunk)
         """
+        if byte_range:
+            headers = kwargs.setdefault('headers', dict())
+            headers['Range'] = 'bytes={}-{}'.format(*byte_range)
         return self.get('fileops/download_file', api='CONTENT', params={
             'root': self.root,
             'path': path,
             'rev': rev,
-        }, stream=True, timeout=kwargs.get('timeout', 1.5), **kwargs)
+        }, stream=True, **kwargs)
 
     def thumbnail(self, width, height, path, **kwargs):
         """
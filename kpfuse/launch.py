@@ -1,6 +1,7 @@
 # coding: utf-8
 
 import os
+import sys
 import fuse
 import logging
 import json
@@ -11,6 +12,18 @@ import oauth_callback
 import version
 from errors import setup_logging
 from errors import remove_log_handler
+from download import DEFAULT_WORKERS
+from index import DEFAULT_MAX_SIZE
+from index import DEFAULT_MAX_COUNT
+from node import ATTR_TTL
+from node import DIR_TTL
+from node import NEGATIVE_TTL
+from prefetch import PREFETCH_DEPTH
+from writeback import WRITEBACK_DELAY
+from readahead import READAHEAD_MAX
+
+# default of FUSE
+ENTRY_TIMEOUT = 1.0
 
 log = logging.getLogger(__name__)
 
@@ -77,12 +90,12 @@ def create_kuaipan_client(username=None, save_cache=True):
     return username, kp
 
 
-def create_kuaipan_fuse_operations(username=None, save_cache=True):
+def create_kuaipan_fuse_operations(username=None, save_cache=True, **kwargs):
     log.debug('Creating Kuaipan client')
     username, kp = create_kuaipan_client(username, save_cache)
 
     log.debug('Create KuaipanFuse')
-    return kpfuse.KuaipanFuseOperations(kp, get_profile_dir(username))
+    return kpfuse.KuaipanFuseOperations(kp, get_profile_dir(username), **kwargs)
 
 
 def save_key_cache(kp, username):
@@ -104,11 +117,32 @@ def create_logger(foreground=False, verbose=False, **kwargs):
         logging.getLogger('kpfuse').setLevel(logging.DEBUG)
 
 
-def launch(mount_point, username=None, foreground=False, verbose=False):
+def launch(mount_point, username=None, foreground=False, verbose=False,
+           download_workers=DEFAULT_WORKERS,
+           cache_size=DEFAULT_MAX_SIZE >> 20, cache_count=DEFAULT_MAX_COUNT,
+           attr_ttl=ATTR_TTL, dir_ttl=DIR_TTL,
+           entry_timeout=ENTRY_TIMEOUT, negative_timeout=NEGATIVE_TTL,
+           prefetch_depth=PREFETCH_DEPTH, writeback_delay=WRITEBACK_DELAY,
+           upload_rate=0, readahead_max=READAHEAD_MAX >> 20, mmap=False):
     create_logger(foreground, verbose)
 
     log.info('Mount point: %s', mount_point)
-    fuse_op = create_kuaipan_fuse_operations(username)
+    fuse_op = create_kuaipan_fuse_operations(username,
+                                             download_workers=download_workers,
+                                             cache_size=cache_size << 20,
+                                             cache_count=cache_count,
+                                             attr_ttl=attr_ttl,
+                                             dir_ttl=dir_ttl,
+                                             negative_ttl=negative_timeout,
+                                             prefetch_depth=prefetch_depth,
+                                             writeback_delay=writeback_delay,
+                                             upload_rate=upload_rate << 10,
+                                             readahead_max=readahead_max << 20,
+                                             use_mmap=mmap)
+
+    options = dict()
+    if sys.platform.startswith('linux'):
+        options['big_writes'] = True  # writes up to 128 KB instead of 4 KB
 
     log.info('Start FUSE file system')
     fuse.FUSE(fuse_op,
@@ -118,7 +152,10 @@ def launch(mount_point, username=None, foreground=False, verbose=False):
               gid=os.getgid(),
               # nonempty=True, # fuse: unknown option `nonempty' on OS X
               nothreads=False,  # on multiple thread
-              ro=False)  # readonly
+              entry_timeout=entry_timeout,  # kernel cache of name lookup
+              negative_timeout=negative_timeout,  # kernel cache of nonexistent names
+              ro=False,  # readonly
+              **options)
 
 
 def safe_launch(**kwargs):
@@ -147,6 +184,30 @@ def main():
                         help='Run in foreground, for debug')
     parser.add_argument('-u', '--username', nargs='?',
                         help='user name (e.g. <email>)')
+    parser.add_argument('-j', '--download-workers', type=int, default=DEFAULT_WORKERS,
+                        help='number of concurrent connections for downloading a file')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_SIZE >> 20,
+                        help='maximum size of local cache in MB')
+    parser.add_argument('--cache-count', type=int, default=DEFAULT_MAX_COUNT,
+                        help='maximum number of local cache files')
+    parser.add_argument('--attr-ttl', type=float, default=ATTR_TTL,
+                        help='seconds before file attributes are revalidated with server')
+    parser.add_argument('--dir-ttl', type=float, default=DIR_TTL,
+                        help='seconds before directory listings are revalidated with server')
+    parser.add_argument('--entry-timeout', type=float, default=ENTRY_TIMEOUT,
+                        help='seconds for kernel to cache name lookups')
+    parser.add_argument('--negative-timeout', type=float, default=NEGATIVE_TTL,
+                        help='seconds to cache lookups of nonexistent paths')
+    parser.add_argument('--prefetch-depth', type=int, default=PREFETCH_DEPTH,
+                        help='levels of sub-directories listed in advance, 0 to disable')
+    parser.add_argument('--writeback-delay', type=float, default=WRITEBACK_DELAY,
+                        help='seconds a modified file must stay closed before it is uploaded')
+    parser.add_argument('--upload-rate', type=int, default=0,
+                        help='maximum upload bandwidth in KB/s, 0 for unlimited')
+    parser.add_argument('--readahead-max', type=int, default=READAHEAD_MAX >> 20,
+                        help='maximum size in MB read ahead of sequential reads, 0 to disable')
+    parser.add_argument('--mmap', action='store_true',
+                        help='serve reads of fully cached files from memory maps')
     parser.add_argument('--version', '-V', action='version',
                         version='%(prog)s {version}, by {author} <{email}>'.format(version=version.__version__,
                                                                                    author=version.__author__,
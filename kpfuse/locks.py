@@ -0,0 +1,106 @@
+# coding: utf-8
+
+"""
+Locks of paths, so that operations on unrelated files run concurrently
+"""
+
+import os
+import threading
+import contextlib
+
+
+class _PathLock(object):
+    """Lock held by one writer, or shared by readers. Waiting writers go first."""
+    __slots__ = ('cond', 'readers', 'writer', 'waiting', 'users')
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting = 0  # writers waiting
+        self.users = 0
+
+    def acquire(self, shared):
+        with self.cond:
+            if shared:
+                while self.writer or self.waiting:
+                    self.cond.wait()
+                self.readers += 1
+            else:
+                self.waiting += 1
+                while self.writer or self.readers:
+                    self.cond.wait()
+                self.waiting -= 1
+                self.writer = True
+
+    def release(self, shared):
+        with self.cond:
+            if shared:
+                self.readers -= 1
+            else:
+                self.writer = False
+            self.cond.notify_all()
+
+
+def _ancestors(path):
+    """Directories containing path, from root"""
+    paths = []
+    while path != '/' and path:
+        path = os.path.dirname(path)
+        paths.append(path)
+    return reversed(paths)
+
+
+class PathLocks(object):
+    """
+    Lock of each path, created on demand and dropped once no thread uses it.
+    An operation holds its paths exclusively, and their ancestors shared,
+    so a directory being renamed or removed excludes operations under it,
+    while operations on unrelated files of a directory run concurrently.
+    Locks are acquired in sorted order, so threads holding overlapping sets
+    of paths, e.g. renames, can not deadlock.
+    """
+    def __init__(self):
+        self._locks = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._locks)
+
+    def _get(self, path):
+        with self._lock:
+            x = self._locks.get(path)
+            if x is None:
+                x = self._locks[path] = _PathLock()
+            x.users += 1
+            return x
+
+    def _put(self, path, x):
+        with self._lock:
+            x.users -= 1
+            if x.users == 0:
+                del self._locks[path]
+
+    @contextlib.contextmanager
+    def hold(self, *paths):
+        """Hold locks of given paths exclusively, and of their ancestors shared"""
+        shared = dict()  # path -> whether it is held shared
+        for path in paths:
+            for x in _ancestors(path):
+                shared.setdefault(x, True)
+        for path in paths:
+            shared[path] = False
+        paths = sorted(shared)
+        locks = [self._get(x) for x in paths]
+        acquired = []
+        try:
+            for path, x in zip(paths, locks):
+                x.acquire(shared[path])
+                acquired.append((path, x))
+            yield
+        finally:
+            for path, x in reversed(acquired):
+                x.release(shared[path])
+            for path, x in zip(paths, locks):
+                self._put(path, x)
@@ -0,0 +1,112 @@
+# coding: utf-8
+
+"""
+Multipart/form-data body streamed from a file, so that uploads of large
+files do not build the whole body in memory.
+"""
+
+import os
+import io
+import uuid
+import logging
+
+log = logging.getLogger(__name__)
+
+# bytes read from file at a time when the body is iterated
+CHUNK_SIZE = 64 * 1024
+# progress of files smaller than it is not logged
+PROGRESS_MIN_SIZE = 16 << 20
+
+
+class MultipartFile(object):
+    """
+    File-like multipart/form-data body with one file field, read by requests
+    in chunks. The file is sent from its current position to its end.
+
+    :param data: file object or str data, read into memory if not seekable
+    :param progress: function of progress(sent, total) in bytes of file
+    :type limiter: kpfuse.ratelimit.RateLimiter
+    """
+    def __init__(self, data, field='file', filename='file', progress=None, limiter=None):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if isinstance(data, str):
+            data = io.BytesIO(data)
+        try:
+            data.tell()
+        except (AttributeError, IOError):
+            data = io.BytesIO(data.read())  # not seekable, e.g. pipe
+        if isinstance(filename, unicode):
+            filename = filename.encode('utf-8')
+        self.data = data
+        self.progress = progress
+        self.limiter = limiter
+        self._start = data.tell()
+        try:
+            self.size = os.fstat(data.fileno()).st_size - self._start
+        except (AttributeError, io.UnsupportedOperation):
+            data.seek(0, os.SEEK_END)
+            self.size = data.tell() - self._start
+        boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=' + boundary
+        self._head = ('--{}\r\n'
+                      'Content-Disposition: form-data; name="{}"; filename="{}"\r\n'
+                      'Content-Type: application/octet-stream\r\n\r\n'
+                      ).format(boundary, field, filename.replace('"', '%22'))
+        self._tail = '\r\n--{}--\r\n'.format(boundary)
+        self.len = len(self._head) + self.size + len(self._tail)
+        self.rewind()
+
+    def rewind(self):
+        """Send body again from its start, e.g. when request is retried"""
+        self.data.seek(self._start)
+        self._pos = 0
+        self.sent = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len - self._pos
+        chunks = []
+        file_end = len(self._head) + self.size
+        while size > 0 and self._pos < self.len:
+            if self._pos < len(self._head):
+                chunk = self._head[self._pos:self._pos + size]
+            elif self._pos < file_end:
+                chunk = self.data.read(min(size, file_end - self._pos))
+                if not chunk:
+                    raise IOError('file is truncated while uploaded')
+                self._sent_file(len(chunk))
+            else:
+                chunk = self._tail[self._pos - file_end:][:size]
+            self._pos += len(chunk)
+            size -= len(chunk)
+            chunks.append(chunk)
+        return ''.join(chunks)
+
+    def _sent_file(self, n):
+        if self.limiter is not None:
+            self.limiter.acquire(n)
+        self.sent += n
+        if self.progress is not None:
+            self.progress(self.sent, self.size)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def log_progress(name, steps=10):
+    """Progress callback logging upload of large file steps times"""
+    logged = [0]
+
+    def progress(sent, total):
+        if total < PROGRESS_MIN_SIZE:
+            return
+        step = sent * steps // total
+        if step > logged[0]:
+            logged[0] = step
+            log.info(u'uploaded %d%% of %d bytes: %s', 100 * sent // total, total, name)
+    return progress
@@ -3,7 +3,53 @@
 import os
 import stat
 import time
+import logging
+import threading
+import Queue
+import weakref
+import collections
 from kuaipan import KuaiPan
+from scheduler import TransferScheduler
+from scheduler import FOREGROUND
+import errors
+
+log = logging.getLogger(__name__)
+
+# interval of saving snapshot of tree in seconds
+SNAPSHOT_INTERVAL = 300
+# seconds before attributes and directory listings are revalidated
+ATTR_TTL = 60
+DIR_TTL = 60
+# seconds and number of nonexistent paths remembered
+NEGATIVE_TTL = 10
+NEGATIVE_SIZE = 10000
+# entries per page of directory listing, and pages fetched in parallel
+PAGE_SIZE = 1000
+PAGE_WORKERS = 4
+
+
+class Name(unicode):
+    """Name of node, which is dropped from the intern table with its last node"""
+    __slots__ = ('__weakref__',)
+
+
+_names = weakref.WeakValueDictionary()
+
+
+def intern_name(name):
+    """Share one string object for equal names among all nodes"""
+    if not isinstance(name, unicode):
+        return name
+    x = _names.get(name)
+    if x is None:
+        x = _names.setdefault(name, Name(name))
+    return x
+
+
+def _pack_time(value, other=None):
+    """Timestamps are stored as integer seconds, equal ones share one object"""
+    value = int(value)
+    return other if value == other else value
 
 
 class DirNodeAttribute(object):
@@ -15,11 +61,16 @@ class DirNodeAttribute(object):
         st_atime:
         st_mtime:
     """
-    def __init__(self, ctime=time.time(), mtime=None):
+    __slots__ = ('ctime', 'mtime')
+    nlink = 2
+    mode = stat.S_IFDIR | 0644
+    size = 0
+
+    def __init__(self, ctime=None, mtime=None):
+        if ctime is None:
+            ctime = time.time()
         if mtime is None:
             mtime = ctime
-        self.nlink = 2
-        self.mode = stat.S_IFDIR | 0644
         self.ctime = ctime
         self.mtime = mtime
 
@@ -32,11 +83,13 @@ class DirNodeAttribute(object):
 
 
 class FileNodeAttribute(DirNodeAttribute):
-    def __init__(self, size=0, ctime=time.time(), mtime=None):
+    __slots__ = ('size',)
+    nlink = 1
+    mode = stat.S_IFREG | 0644
+
+    def __init__(self, size=0, ctime=None, mtime=None):
         super(FileNodeAttribute, self).__init__(ctime, mtime)
         self.size = size
-        self.nlink = 1
-        self.mode = stat.S_IFREG | 0644
 
     def get(self):
         d = super(FileNodeAttribute, self).get()
@@ -44,33 +97,140 @@ class FileNodeAttribute(DirNodeAttribute):
         return d
 
 
+class NodeAttribute(object):
+    """
+    View of attributes stored in node, so that nodes do not need separate
+    attribute objects.
+    """
+    __slots__ = ('node',)
+
+    def __init__(self, node):
+        self.node = node
+
+    def _set_ctime(self, value):
+        self.node.ctime = _pack_time(value, self.node.mtime)
+
+    def _set_mtime(self, value):
+        self.node.mtime = _pack_time(value, self.node.ctime)
+
+    def _set_size(self, value):
+        self.node.size = value
+
+    ctime = property(lambda self: self.node.ctime, _set_ctime)
+    mtime = property(lambda self: self.node.mtime, _set_mtime)
+    size = property(lambda self: self.node.size, _set_size)
+    mode = property(lambda self: self.node.mode)
+    nlink = property(lambda self: self.node.nlink)
+
+    def get(self):
+        return self.node.stat()
+
+
 class AbstractNode(object):
+    """
+    Node of tree. Path is derived from parent and name instead of stored.
+    """
+    __slots__ = ('name', 'parent', 'ctime', 'mtime', 'local')
+    attribute_class = None
+
     def __init__(self, path):
-        self.path = path
-        self.attribute = None
+        self.name = intern_name(os.path.basename(path))
+        self.parent = None
+        self.local = False  # created locally, not uploaded or listed at server yet
+        self.attribute = self.attribute_class()
+
+    @property
+    def path(self):
+        names = []
+        node = self
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        if not names and self.name:
+            return u'/' + self.name  # not inserted into tree
+        return u'/' + u'/'.join(reversed(names))
+
+    def _get_attribute(self):
+        return NodeAttribute(self)
+
+    def _set_attribute(self, attribute):
+        self.mtime = int(attribute.mtime)
+        self.ctime = _pack_time(attribute.ctime, self.mtime)
+        self.size = attribute.size
+
+    attribute = property(_get_attribute, _set_attribute)
+
+    def stat(self):
+        return dict(st_mode=self.mode,
+                    st_nlink=self.nlink,
+                    st_ctime=self.ctime,
+                    st_mtime=self.mtime,
+                    st_atime=self.mtime)
+
+    def set_meta(self, meta):
+        """Set attributes from server metadata"""
+        self.attribute = create_stat(meta)
 
     def update_meta(self, kp):
         """Update meta information for node"""
-        meta = kp.metadata(self.path)
-        self.attribute = create_stat(meta)
+        self.set_meta(kp.metadata(self.path))
+        self.local = False
 
 
 class FileNode(AbstractNode):
+    __slots__ = ('size', 'sha1')
+    attribute_class = FileNodeAttribute
+    mode = FileNodeAttribute.mode
+    nlink = FileNodeAttribute.nlink
+
     def __init__(self, path):
         super(FileNode, self).__init__(path)
-        self.attribute = FileNodeAttribute()
+        self.sha1 = None  # hash of content at server
+
+    def set_meta(self, meta):
+        super(FileNode, self).set_meta(meta)
+        self.sha1 = meta.get('sha1')
+
+    def stat(self):
+        d = super(FileNode, self).stat()
+        d.update(dict(st_size=self.size))
+        return d
 
 
 class DirNode(AbstractNode):
+    __slots__ = ('nodes', 'hash', 'checked')
+    attribute_class = DirNodeAttribute
+    mode = DirNodeAttribute.mode
+    nlink = DirNodeAttribute.nlink
+
     def __init__(self, path, nodes=None):
         super(DirNode, self).__init__(path)
-        self.attribute = DirNodeAttribute()
-        self.valid = nodes is not None
-        self.nodes = dict() if nodes is None else nodes
+        self.nodes = nodes  # None if not listed yet
+        if nodes is not None:
+            for name, node in nodes.iteritems():
+                node.name = intern_name(name)
+                node.parent = self
+        self.hash = None  # hash of listing from server
+        # time of listing validated with server, 0 if it needs revalidation
+        self.checked = time.time() if self.valid else 0
+
+    @property
+    def valid(self):
+        return self.nodes is not None
+
+    @property
+    def size(self):
+        return 0
+
+    @size.setter
+    def size(self, value):
+        pass
 
     def insert(self, name, node):
         assert self.valid
-        self.nodes[name] = node
+        node.name = intern_name(name)
+        node.parent = self
+        self.nodes[node.name] = node
 
     def remove(self, name):
         assert self.valid
@@ -85,24 +245,49 @@ class DirNode(AbstractNode):
         assert self.valid
         return self.nodes.keys()
 
-    def build(self, kp):
-        if self.valid:
-            return
-
-        meta = kp.metadata(self.path)
+    def create_child(self, meta, old_nodes):
+        """
+        Create child node from server metadata, reuse node in old_nodes if any.
+        """
+        child_name = intern_name(meta['name'])
+        child_node = old_nodes.get(child_name)
+        isdir = meta['type'] != 'file'
+        if child_node is None or isinstance(child_node, DirNode) != isdir:
+            child_node = DirNode(child_name) if isdir else FileNode(child_name)
+            child_node.parent = self
+        elif child_node.local and not isdir:
+            return child_node  # not uploaded yet
+        child_node.local = False
+        child_node.set_meta(meta)
+        return child_node
+
+    def update(self, meta):
+        """
+        Update listing from server metadata. Existing child nodes are kept,
+        so that listings of sub-directories and references of nodes are
+        still valid.
+        """
         assert meta, 'Could not find directory {} at server'.format(self.path)
         assert meta.get('path') == '/' or meta['type'] == 'folder'
 
+        if self.valid and meta.get('hash') and meta.get('hash') == self.hash:
+            self.checked = time.time()
+            return
+
+        old_nodes = self.nodes if self.valid else dict()
         children_nodes = dict()
         for x in meta.get('files', []):
-            child_name = x['name']
-            child_path = os.path.join(self.path, child_name)
-            child_node = FileNode(child_path) if x['type'] == 'file' else DirNode(child_path)
-            child_node.attribute = create_stat(x)
-            children_nodes[child_name] = child_node
+            child_node = self.create_child(x, old_nodes)
+            children_nodes[child_node.name] = child_node
+
+        # keep nodes not uploaded yet, or created after the listing was fetched
+        for child_name, child_node in old_nodes.items():
+            if child_node.local and child_name not in children_nodes:
+                children_nodes[child_name] = child_node
 
         self.nodes = children_nodes
-        self.valid = True
+        self.hash = meta.get('hash')
+        self.checked = time.time()
 
 
 def get_time(time_str):
@@ -121,34 +306,503 @@ def create_stat(meta):
         return FileNodeAttribute(meta.get('size', 0), ctime, mtime)
 
 
+def _parent_dirs(path):
+    """Directories containing path, except root"""
+    path = os.path.dirname(path)
+    while path not in ('/', ''):
+        yield path
+        path = os.path.dirname(path)
+
+
+class NegativeCache(object):
+    """
+    Bounded cache of nonexistent paths, expired after ttl seconds. Paths are
+    indexed by the directories containing them, so paths under a created
+    directory are invalidated without scanning all paths.
+    """
+    def __init__(self, ttl=NEGATIVE_TTL, size=NEGATIVE_SIZE, clock=time.time):
+        self.ttl = ttl
+        self.size = size
+        self.clock = clock
+        self._entries = collections.OrderedDict()
+        self._under = dict()  # directory -> paths under it
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, path):
+        if not self.ttl:
+            return False
+        with self._lock:
+            expire_time = self._entries.get(path)
+            if expire_time is None:
+                return False
+            if expire_time < self.clock():
+                self._delete(path)
+                return False
+            return True
+
+    def add(self, path):
+        if not self.ttl:
+            return
+        with self._lock:
+            if self._entries.pop(path, None) is None:
+                for x in _parent_dirs(path):
+                    self._under.setdefault(x, set()).add(path)
+            self._entries[path] = self.clock() + self.ttl
+            while len(self._entries) > self.size:
+                self._delete(next(iter(self._entries)))
+
+    def invalidate(self, path):
+        """Remove given path and paths under it"""
+        with self._lock:
+            if path in self._entries:
+                self._delete(path)
+            for x in list(self._under.get(path, ())):
+                self._delete(x)
+
+    def _delete(self, path):
+        del self._entries[path]
+        for x in _parent_dirs(path):
+            paths = self._under[x]
+            paths.discard(path)
+            if not paths:
+                del self._under[x]
+
+
+def _fetch_parallel(kp, path, pages, page_size, scheduler):
+    """
+    Fetch metadata of given pages of directory, following pages on workers
+    of scheduler. Pages not taken by workers yet are fetched by the caller.
+
+    :type scheduler: TransferScheduler
+    """
+    tasks = [scheduler.submit(path, kp.metadata, path, page=x, page_size=page_size,
+                              priority=FOREGROUND)
+             for x in pages[1:]]
+    try:
+        results = [kp.metadata(path, page=pages[0], page_size=page_size)]
+        for task in tasks:
+            task.run()
+            results.append(task.result())
+        return results
+    finally:
+        for task in tasks:
+            task.cancel()  # after a failure
+
+
+def list_pages(kp, path, scheduler, page_size=PAGE_SIZE):
+    """
+    Generate metadata of directory page by page. Only the first page is
+    fetched alone, following pages are fetched in batches of one page for
+    each worker of scheduler, until a page is not full.
+
+    :type scheduler: TransferScheduler
+    """
+    meta = kp.metadata(path, page=1, page_size=page_size)
+    yield meta
+    page = 2
+    while len(meta.get('files', [])) == page_size:
+        first = meta['files'][0]['name']
+        pages = range(page, page + scheduler.workers)
+        for meta in _fetch_parallel(kp, path, pages, page_size, scheduler):
+            files = meta.get('files', [])
+            if files and files[0]['name'] == first:
+                return  # paging is ignored by server
+            yield meta
+            if len(files) != page_size:
+                return
+        page += len(pages)
+
+
+def merge_pages(metas):
+    """Merge metadata of pages into metadata of the whole directory"""
+    meta = None
+    for x in metas:
+        if meta is None:
+            meta = dict(x)
+            meta['files'] = list(x.get('files', []))
+        else:
+            meta['files'].extend(x.get('files', []))
+    return meta
+
+
+class PagedListing(object):
+    """
+    Listing of directory being built page by page. Child nodes are
+    available as soon as their page arrives, and other threads follow
+    the pages while the listing is fetched.
+
+    :type node: DirNode
+    """
+    def __init__(self, node):
+        self.node = node
+        self.nodes = dict()
+        self.pages = []  # names of each page
+        self.hash = None
+        self.completed = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def fetch(self, kp, scheduler, page_size, install):
+        """
+        Fetch all pages, and call install(listing) before waiting threads
+        are woken up, so they find the directory listed.
+        """
+        try:
+            for meta in list_pages(kp, self.node.path, scheduler, page_size):
+                assert meta, 'Could not find directory {} at server'.format(self.node.path)
+                if self.hash is None:
+                    self.hash = meta.get('hash')
+                names = []
+                for x in meta.get('files', []):
+                    child_node = self.node.create_child(x, self.nodes)
+                    names.append(child_node.name)
+                    with self._cond:
+                        self.nodes[child_node.name] = child_node
+                with self._cond:
+                    self.pages.append(names)
+                    self._cond.notify_all()
+            install(self)
+        except Exception, e:
+            self.error = e
+            raise
+        finally:
+            with self._cond:
+                self.completed = True
+                self._cond.notify_all()
+
+    def get(self, name):
+        with self._cond:
+            return self.nodes.get(name)
+
+    def wait(self):
+        with self._cond:
+            while not self.completed:
+                self._cond.wait()
+        if self.error is not None:
+            raise self.error
+
+    def follow(self):
+        """Generate names page by page, as they arrive"""
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self.pages) and not self.completed:
+                    self._cond.wait()
+                if i < len(self.pages):
+                    names = self.pages[i]
+                    i += 1
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            for name in names:
+                yield name
+
+
 class NodeTree:
-    def __init__(self, kp):
+    def __init__(self, kp, snapshot_path=None, attr_ttl=ATTR_TTL, dir_ttl=DIR_TTL,
+                 negative_ttl=NEGATIVE_TTL, page_size=PAGE_SIZE, page_workers=PAGE_WORKERS,
+                 prefetch_depth=0):
+        """
+        Expired attributes and directory listings are still served, while
+        they are revalidated in background.
+
+        :param snapshot_path: file to save directory listings, which are loaded
+            at next mount and revalidated in background.
+        :param attr_ttl: seconds before attributes are revalidated, None for never
+        :param dir_ttl: seconds before directory listings are revalidated, None for never
+        :param negative_ttl: seconds to remember nonexistent paths, 0 to disable
+        :param page_size: entries per page of directory listing
+        :param page_workers: workers fetching listings, and pages of each
+            listing in parallel
+        :param prefetch_depth: levels of sub-directories listed in background
+            after a directory is listed, 0 to disable
+        """
         assert isinstance(kp, KuaiPan)
         self.kp = kp
         self.tree = DirNode('/')
+        self.snapshot_path = snapshot_path
+        self.attr_ttl = attr_ttl
+        self.dir_ttl = dir_ttl
+        self.negatives = NegativeCache(negative_ttl)
+        self.page_size = page_size
+        self.scheduler = TransferScheduler(page_workers)
+        # listings of directories being fetched for the first time
+        self._listings = dict()
+        self._listings_lock = threading.Lock()
+        # flat index of path to loaded directories, besides the hierarchy.
+        # Files are found in listing of their parent directories.
+        self.index = {u'/': self.tree}
+        # guard changes of listings, so that a listing replaced by server
+        # metadata does not lose entries inserted meanwhile
+        self._lock = threading.Lock()
+        self.changed = False
+        if snapshot_path:
+            self.load_snapshot()
+        self.revalidator = Revalidator(self)
+        self.revalidator.start()
+        self.prefetcher = None
+        if prefetch_depth > 0:
+            from .prefetch import Prefetcher
+            self.prefetcher = Prefetcher(self, prefetch_depth)
+
+    def load_snapshot(self):
+        from . import snapshot
+        root = snapshot.load(self.snapshot_path)
+        if root is not None:
+            log.info(u'loaded snapshot: %s', self.snapshot_path)
+            self.tree = root
+            self.index = dict()
+            self._add_index(u'/', root)
+
+    def save_snapshot(self):
+        from . import snapshot
+        log.info(u'saving snapshot: %s', self.snapshot_path)
+        self.changed = False
+        snapshot.save(self.tree, self.snapshot_path)
+
+    def close(self):
+        if self.prefetcher:
+            self.prefetcher.stop()
+            self.prefetcher = None
+        if self.revalidator:
+            self.revalidator.stop()
+            self.revalidator = None
+        self.scheduler.close()
+        if self.snapshot_path:
+            self.save_snapshot()
+
+    @staticmethod
+    def _expired(node, ttl):
+        """:type node: DirNode"""
+        return ttl is not None and time.time() - node.checked > ttl
+
+    def _revalidate(self, node):
+        if self.revalidator:
+            self.revalidator.add(node)
+
+    def _add_index(self, path, node):
+        """Add directory and its loaded sub-directories to index"""
+        if isinstance(node, DirNode):
+            self.index[path] = node
+            if node.valid:
+                for name, child in node.nodes.items():
+                    self._add_index(os.path.join(path, name), child)
 
-    def get(self, path):
+    def _remove_index(self, path, node):
+        """Remove directory and its loaded sub-directories from index"""
+        if isinstance(node, DirNode):
+            if self.index.get(path) is node:
+                del self.index[path]
+            if node.valid:
+                for name, child in node.nodes.items():
+                    self._remove_index(os.path.join(path, name), child)
+
+    def update(self, node, meta):
+        """
+        Update listing of directory from server metadata.
+
+        :type node: DirNode
+        """
+        with self._lock:
+            old_nodes = node.nodes if node.valid else dict()
+            node.update(meta)
+            for name, child in old_nodes.items():
+                if node.nodes.get(name) is not child:
+                    self._remove_index(os.path.join(node.path, name), child)
+            for name, child in node.nodes.items():
+                if old_nodes.get(name) is not child:
+                    self._add_index(os.path.join(node.path, name), child)
+            self.changed = True
+
+    def list(self, path):
+        """
+        Fetch metadata of the whole directory page by page.
+
+        :rtype: dict
+        """
+        return merge_pages(list_pages(self.kp, path, self.scheduler, self.page_size))
+
+    def _start_listing(self, node):
+        """
+        Return listing of directory, and whether it is new and should be
+        fetched by caller. Listing is None if directory is listed already.
+
+        :type node: DirNode
+        :rtype: (PagedListing, bool)
+        """
+        with self._listings_lock:
+            if node.valid:
+                return None, False
+            listing = self._listings.get(node)
+            if listing is not None:
+                return listing, False
+            listing = self._listings[node] = PagedListing(node)
+            return listing, True
+
+    def _fetch_listing(self, listing, prefetch_depth=None):
         """
+        :type listing: PagedListing
+        :param prefetch_depth: levels of sub-directories to prefetch, None for default
+        """
+        node = listing.node
+        try:
+            listing.fetch(self.kp, self.scheduler, self.page_size, self._install_listing)
+        finally:
+            with self._listings_lock:
+                self._listings.pop(node, None)
+        if self.prefetcher:
+            self.prefetcher.add(node, prefetch_depth)
+
+    def _install_listing(self, listing):
+        """:type listing: PagedListing"""
+        node = listing.node
+        with self._lock:
+            if not node.valid:
+                node.nodes = listing.nodes
+                node.hash = listing.hash
+                node.checked = time.time()
+                path = node.path
+                for name, child in node.nodes.items():
+                    self._add_index(os.path.join(path, name), child)
+                self.changed = True
+
+    def prefetch(self, node, depth):
+        """
+        List directory in advance, unless it is listed by others.
+
+        :type node: DirNode
+        :param depth: levels of its sub-directories to prefetch then
+        """
+        listing, new = self._start_listing(node)
+        if new:
+            self._fetch_listing(listing, depth)
+
+    def _build(self, node):
+        """:type node: DirNode"""
+        if node.valid:
+            if self._expired(node, self.dir_ttl):
+                self._revalidate(node)
+            return
+        while not node.valid:
+            listing, new = self._start_listing(node)
+            if new:
+                self._fetch_listing(listing)
+            elif listing:
+                listing.wait()
+
+    def readdir(self, path):
+        """
+        Get names in directory. Names of directory not listed yet are
+        generated as soon as each page arrives.
+
+        :rtype: collections.Iterable
+        """
+        node = self.get(path, build=False)
+        if not isinstance(node, DirNode):
+            return None
+        listing, new = self._start_listing(node)
+        if listing is None:
+            self._build(node)
+            return node.names()
+        if new:
+            # errors are raised to readers by listing
+            self.scheduler.submit(path, self._fetch_listing, listing, priority=FOREGROUND)
+        return listing.follow()
+
+    def get(self, path, build=True):
+        """
+        :param build: whether to list the directory at path
+        :rtype: DirNode
+        """
+        dir_path, name = os.path.split(path)
+        parent = self.index.get(dir_path)
+        node = self.index.get(path)
+        if node is None and parent is not None and name:
+            if parent.valid:
+                node = parent.get(name)
+                if node is None:
+                    # not in listing of parent
+                    if self._expired(parent, self.dir_ttl):
+                        self._revalidate(parent)
+                    return None
+            else:
+                # parent is being listed, its first pages may have the name
+                listing = self._listings.get(parent)
+                if listing is not None:
+                    node = listing.get(name)
+
+        if node is None:
+            if path in self.negatives:
+                return None
+            return self._walk(path, build)
+
+        if isinstance(node, DirNode) and build:
+            self._build(node)
+        # attributes come from listing of parent directory
+        if parent is not None and parent is not node and parent.valid \
+                and self._expired(parent, self.attr_ttl):
+            self._revalidate(parent)
+        return node
+
+    def _walk(self, path, build=True):
+        """
+        Get node by walking the tree from root, building directories on the way.
+
         :rtype: DirNode
         """
+        parent = None
         node = self.tree
         for name in filter(None, path.split('/')):
-            if node is None or isinstance(node, FileNode):
-                return node
+            if not isinstance(node, DirNode):
+                node = None
+                break
             """:type node: DirNode"""
-            node.build(self.kp)
-            node = node.get(name)
+            self._build(node)
+            parent, node = node, node.get(name)
 
-        if isinstance(node, DirNode):
-            node.build(self.kp)
+        if node is None:
+            self.negatives.add(path)
+            return None
+
+        if isinstance(node, DirNode) and build:
+            self._build(node)
 
+        # attributes come from listing of parent directory
+        if parent is not None and self._expired(parent, self.attr_ttl):
+            self._revalidate(parent)
+
+        return node
+
+    def peek(self, path):
+        """
+        Get node only from directories already listed, without any request.
+
+        :rtype: AbstractNode
+        """
+        node = self.index.get(path)
+        if node is None:
+            parent = self.index.get(os.path.dirname(path))
+            if parent is not None and parent.valid:
+                node = parent.get(os.path.basename(path))
         return node
 
+    def invalidate(self, path):
+        """Revalidate listing of directory at next access"""
+        node = self.peek(path)
+        if isinstance(node, DirNode):
+            node.checked = 0
+
     def create(self, path, isdir):
         """
         :rtype: AbstractNode
         """
         node = DirNode(path, dict()) if isdir else FileNode(path)
+        node.local = True
         self.insert(path, node)
         return node
 
@@ -159,18 +813,88 @@ class NodeTree:
         dir_path, base_name = os.path.split(path)
         node = self.get(dir_path)
         if node:
-            return node.remove(base_name)
+            with self._lock:
+                self.changed = True
+                removed = node.remove(base_name)
+                self._remove_index(path, removed)
+            return removed
 
     def insert(self, path, node):
+        self.negatives.invalidate(path)
         dir_path, base_name = os.path.split(path)
         parent_node = self.get(dir_path)
         """:type: DirNode"""
         if parent_node:
-            parent_node.insert(base_name, node)
+            with self._lock:
+                self.changed = True
+                parent_node.insert(base_name, node)
+                self._add_index(path, node)
 
     def move(self, path, new_path):
         node = self.remove(path)
         if node:
-            node.path = new_path
             self.insert(new_path, node)
         return node
+
+
+class Revalidator(threading.Thread):
+    """
+    Revalidate stale directory listings in background, and save snapshot
+    of tree periodically.
+
+    :type tree: NodeTree
+    """
+    def __init__(self, tree):
+        super(Revalidator, self).__init__(name='revalidator')
+        self.daemon = True
+        self.tree = tree
+        self._queue = Queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def add(self, node):
+        """:type node: DirNode"""
+        with self._lock:
+            if node.path in self._pending:
+                return
+            self._pending.add(node.path)
+        self._queue.put(node)
+
+    def stop(self):
+        self._queue.put(None)
+        self.join()
+
+    def run(self):
+        save_time = time.time()
+        while True:
+            try:
+                node = self._queue.get(timeout=SNAPSHOT_INTERVAL)
+            except Queue.Empty:
+                node = False
+            if node is None:
+                break
+            if node:
+                self._revalidate(node)
+            if self.tree.changed and time.time() - save_time > SNAPSHOT_INTERVAL:
+                try:
+                    self.tree.save_snapshot()
+                except (IOError, OSError):
+                    log.exception(u'failed to save snapshot')
+                save_time = time.time()
+
+    def _revalidate(self, node):
+        """:type node: DirNode"""
+        path = node.path
+        try:
+            log.debug(u'revalidate: %s', path)
+            self.tree.update(node, self.tree.list(path))
+            self.tree.negatives.invalidate(path)
+        except errors.FileNotExistedError:
+            log.info(u'removed at server: %s', path)
+            self.tree.remove(path)
+        except Exception:
+            log.exception(u'failed to revalidate %s', path)
+            node.checked = time.time()  # retry after TTL
+        finally:
+            with self._lock:
+                self._pending.discard(path)
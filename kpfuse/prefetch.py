@@ -0,0 +1,118 @@
+# coding: utf-8
+
+"""
+Speculative listing of sub-directories, so that recursive walks of the
+tree do not pay a round trip for every directory.
+"""
+
+import logging
+import threading
+import Queue
+
+from .node import DirNode
+from .ratelimit import RateLimiter
+
+log = logging.getLogger(__name__)
+
+# levels of sub-directories listed after a directory is listed, 0 to disable
+PREFETCH_DEPTH = 1
+PREFETCH_WORKERS = 4
+# maximum listings requested per second
+PREFETCH_RATE = 50
+# directories waiting for prefetch
+PREFETCH_QUEUE_SIZE = 10000
+# no prefetch once this number of directories are loaded
+PREFETCH_MAX_DIRS = 50000
+
+
+class Prefetcher(object):
+    """
+    List sub-directories of newly listed directories on a pool of workers.
+    Prefetch is cancelled when too many directories are loaded.
+
+    :type tree: kpfuse.node.NodeTree
+    """
+    def __init__(self, tree, depth=PREFETCH_DEPTH, workers=PREFETCH_WORKERS,
+                 rate=PREFETCH_RATE, max_dirs=PREFETCH_MAX_DIRS):
+        self.tree = tree
+        self.depth = depth
+        self.max_dirs = max_dirs
+        self.limiter = RateLimiter(rate)
+        self._queue = Queue.Queue(PREFETCH_QUEUE_SIZE)
+        self._threads = []
+        self._workers = workers
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            while not self._stopped and len(self._threads) < self._workers:
+                t = threading.Thread(target=self._run, name='prefetch')
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+
+    def _under_pressure(self):
+        return len(self.tree.index) >= self.max_dirs
+
+    def add(self, node, depth=None):
+        """
+        Queue sub-directories of a listed directory.
+
+        :type node: kpfuse.node.DirNode
+        :param depth: levels of sub-directories to list
+        """
+        if depth is None:
+            depth = self.depth
+        if depth <= 0 or not node.valid or self._stopped:
+            return
+        if self._under_pressure():
+            self.cancel()
+            return
+        self._start()
+        for child in node.nodes.values():
+            if isinstance(child, DirNode) and not child.valid:
+                try:
+                    self._queue.put_nowait((child, depth))
+                except Queue.Full:
+                    return
+
+    def cancel(self):
+        """Drop all pending prefetch"""
+        stops = 0
+        try:
+            while True:
+                if self._queue.get_nowait() is None:
+                    stops += 1
+        except Queue.Empty:
+            pass
+        for _ in xrange(stops):
+            self._queue.put(None)
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            threads, self._threads = self._threads, []
+        self.cancel()
+        for _ in threads:
+            self._queue.put(None)
+        for t in threads:
+            t.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            node, depth = item
+            if node.valid:
+                continue
+            if self._under_pressure():
+                log.info(u'too many directories loaded, cancel prefetch')
+                self.cancel()
+                continue
+            self.limiter.acquire()
+            try:
+                self.tree.prefetch(node, depth - 1)
+            except Exception, e:
+                log.debug(u'failed to prefetch %s: %s', node.path, e)
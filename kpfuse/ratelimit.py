@@ -0,0 +1,29 @@
+# coding: utf-8
+
+"""
+Limits of rate of requests and bytes transferred
+"""
+
+import time
+import threading
+
+
+class RateLimiter(object):
+    """Space out events to at most rate per second, e.g. requests or bytes"""
+    def __init__(self, rate, clock=time.time, sleep=time.sleep):
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Wait until amount of events are allowed"""
+        if not self.rate:
+            return
+        with self._lock:
+            now = self.clock()
+            delay = self._next - now
+            self._next = max(now, self._next) + float(amount) / self.rate
+        if delay > 0:
+            self.sleep(delay)
@@ -0,0 +1,52 @@
+# coding: utf-8
+
+"""
+Detection of sequential reads of open files, to download data ahead of
+the reader instead of one round trip per read.
+"""
+
+import threading
+
+from .blocks import BLOCK_SIZE
+
+# bytes read ahead once a handle reads sequentially
+READAHEAD_MIN = BLOCK_SIZE
+# bytes read ahead at most, after the window grows
+READAHEAD_MAX = 32 * 1024 * 1024
+
+
+class ReadAhead(object):
+    """
+    Read-ahead window of one open handle. The window starts at min_size on
+    sequential reads, doubles each time the reader consumes half of it, and
+    is dropped on random access. Threads reading the same handle update it
+    one at a time.
+    """
+    __slots__ = ('min_size', 'max_size', 'window', '_next', '_mark', '_lock')
+
+    def __init__(self, min_size=READAHEAD_MIN, max_size=READAHEAD_MAX):
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.window = 0
+        self._next = 0  # offset following the last read
+        self._mark = 0  # window grows once the reader passes it
+        self._lock = threading.Lock()
+
+    def update(self, offset, size):
+        """Record a read, and return [begin, end) bytes to read ahead, or None"""
+        with self._lock:
+            return self._update(offset, size)
+
+    def _update(self, offset, size):
+        sequential = offset == self._next
+        self._next = offset + size
+        if not sequential or not self.max_size:
+            self.window = 0
+            return None
+        if self.window == 0:
+            self.window = self.min_size
+            self._mark = self._next + self.window // 2
+        elif self._next >= self._mark:
+            self.window = min(self.max_size, self.window * 2)
+            self._mark = self._next + self.window // 2
+        return self._next, self._next + self.window
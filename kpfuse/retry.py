@@ -0,0 +1,142 @@
+# coding: utf-8
+
+"""
+Retry of transient failures with exponential backoff and jitter, and a
+circuit breaker to fail fast while the service is down.
+"""
+
+import time
+import socket
+import random
+import httplib
+import logging
+import threading
+import requests
+from requests.packages.urllib3.exceptions import ProtocolError
+from requests.packages.urllib3.exceptions import ReadTimeoutError
+
+import errors
+
+log = logging.getLogger(__name__)
+
+RETRIES = 3
+BACKOFF = 0.2
+MAX_BACKOFF = 5
+# consecutive failures before the circuit opens, and seconds it stays open
+BREAKER_THRESHOLD = 5
+BREAKER_TIMEOUT = 30
+
+# status codes worth retrying, only 429 and 503 are surely not processed
+RETRY_STATUS = (429, 500, 502, 503, 504)
+UNPROCESSED_STATUS = (429, 503)
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError,
+                    ProtocolError,  # raised by streaming reads
+                    ReadTimeoutError,
+                    socket.error,
+                    httplib.HTTPException)
+
+
+def is_transient(e, idempotent=True):
+    """
+    Whether request failed with error e is worth retrying. Requests not
+    idempotent are only retried if they were surely not processed.
+    """
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(e, errors.OAuthResponseError):
+        status = getattr(e.response, 'status_code', None)
+        return status in UNPROCESSED_STATUS or (idempotent and status in RETRY_STATUS)
+    return idempotent and isinstance(e, TRANSIENT_ERRORS)
+
+
+class CircuitBreaker(object):
+    """
+    Open after threshold consecutive failures, then requests fail fast
+    until timeout, when a single request is let through to probe the service.
+    """
+    def __init__(self, threshold=BREAKER_THRESHOLD, timeout=BREAKER_TIMEOUT):
+        self.threshold = threshold
+        self.timeout = timeout
+        self._failures = 0
+        self._open_until = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def opened(self):
+        return self.threshold and self._failures >= self.threshold
+
+    def before(self):
+        """Raise ServiceUnavailableError if the circuit is open"""
+        with self._lock:
+            if not self.opened:
+                return
+            if self._probing or time.time() < self._open_until:
+                raise errors.ServiceUnavailableError(
+                    'service unavailable after {} failures'.format(self._failures))
+            self._probing = True
+
+    def success(self):
+        with self._lock:
+            if self.opened:
+                log.info(u'service is available again')
+            self._failures = 0
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.opened:
+                if self._failures == self.threshold:
+                    log.warn(u'service unavailable, fail fast for %s seconds', self.timeout)
+                self._open_until = time.time() + self.timeout
+
+
+class RetryPolicy(object):
+    """
+    Retry up to retries times, sleeping a random time up to exponentially
+    growing backoff between attempts (full jitter).
+
+    :type breaker: CircuitBreaker
+    """
+    def __init__(self, retries=RETRIES, backoff=BACKOFF, max_backoff=MAX_BACKOFF, breaker=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def sleep(self, attempt, e):
+        delay = self.delay(attempt)
+        log.info(u'retry in %.2f seconds (%s)', delay, e)
+        time.sleep(delay)
+
+    def call(self, func, idempotent=True, retries=None):
+        """Call func(), retrying it on transient errors up to retries times, or default"""
+        retries = self.retries if retries is None else retries
+        attempt = 0
+        while True:
+            if self.breaker:
+                self.breaker.before()
+            try:
+                result = func()
+            except Exception, e:
+                transient = is_transient(e)
+                if self.breaker:
+                    if transient:
+                        self.breaker.failure()
+                    else:
+                        self.breaker.success()  # service answered
+                if not is_transient(e, idempotent) or attempt >= retries:
+                    raise
+                self.sleep(attempt, e)
+                attempt += 1
+            else:
+                if self.breaker:
+                    self.breaker.success()
+                return result
@@ -0,0 +1,149 @@
+# coding: utf-8
+
+"""
+Scheduler of transfers on a fixed pool of workers
+"""
+
+import sys
+import logging
+import threading
+import collections
+
+from .futures import Future
+
+log = logging.getLogger(__name__)
+
+# priorities of transfers, lower runs first
+FOREGROUND = 0  # parts of reads waited by applications
+READAHEAD = 1  # parts ahead of sequential reads
+UPLOAD = 2
+BACKGROUND = 3  # completion of partially downloaded files
+PRIORITY_NAMES = ('foreground', 'readahead', 'upload', 'background')
+
+DEFAULT_WORKERS = 4
+
+
+class Task(Future):
+    def __init__(self, key, priority, func, args, kwargs):
+        super(Task, self).__init__()
+        self.key = key
+        self.priority = priority
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        """Run task unless it is taken by others, return whether it is run"""
+        if not self.set_running():
+            return False
+        try:
+            self.set_result(self.func(*self.args, **self.kwargs))
+        except Exception, e:
+            self.set_error(e, sys.exc_info()[2])
+        return True
+
+
+class TransferScheduler(object):
+    """
+    Run transfers on workers threads, from separate queues of each priority.
+    Tasks of the same priority run in submission order, so long transfers
+    re-submit their next step to share workers fairly across files.
+    """
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = max(1, workers)
+        self._queues = [collections.deque() for _ in PRIORITY_NAMES]
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = 0
+        self._closing = False
+        self._submitted = [0] * len(PRIORITY_NAMES)
+        self._completed = [0] * len(PRIORITY_NAMES)
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._work,
+                                 name='transfer-{}'.format(len(self._threads)))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def _next(self):
+        """Pop next task, or return None when closing with empty queues"""
+        with self._cond:
+            while True:
+                for queue in self._queues:
+                    if queue:
+                        self._running += 1
+                        return queue.popleft()
+                if self._closing:
+                    return None
+                self._cond.wait()
+
+    def _work(self):
+        while True:
+            task = self._next()
+            if task is None:
+                break
+            try:
+                task.run()
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._completed[task.priority] += 1
+
+    def submit(self, key, func, *args, **kwargs):
+        """
+        Queue func(*args, **kwargs) for transfer of key, e.g. path of file.
+
+        :param priority: keyword argument of FOREGROUND, READAHEAD, UPLOAD or BACKGROUND
+        :rtype: Task
+        """
+        priority = kwargs.pop('priority', BACKGROUND)
+        task = Task(key, priority, func, args, kwargs)
+        with self._cond:
+            self._start_workers()
+            self._queues[priority].append(task)
+            self._submitted[priority] += 1
+            self._cond.notify()
+        return task
+
+    def cancel(self, key, priority=None):
+        """Cancel tasks of key not started yet, of given priority or all"""
+        cancelled = []
+        with self._cond:
+            for i, queue in enumerate(self._queues):
+                if priority is not None and i != priority:
+                    continue
+                tasks = [x for x in queue if x.key == key]
+                for x in tasks:
+                    queue.remove(x)
+                cancelled += tasks
+        for x in cancelled:
+            x.cancel()
+        if cancelled:
+            log.debug(u'cancelled %d tasks: %s', len(cancelled), key)
+        return len(cancelled)
+
+    def pending(self, key):
+        """Whether tasks of key are queued"""
+        with self._cond:
+            return any(x.key == key for queue in self._queues for x in queue)
+
+    def metrics(self):
+        """Queue depth of each priority, and tasks running, submitted and completed"""
+        with self._cond:
+            return dict(queued=dict(zip(PRIORITY_NAMES, map(len, self._queues))),
+                        running=self._running,
+                        submitted=dict(zip(PRIORITY_NAMES, self._submitted)),
+                        completed=dict(zip(PRIORITY_NAMES, self._completed)))
+
+    def close(self):
+        """Finish all queued tasks and stop workers"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+            threads, self._threads = self._threads, []
+        for t in threads:
+            t.join()
+        with self._cond:
+            self._closing = False
@@ -0,0 +1,94 @@
+# coding: utf-8
+
+"""
+Snapshot of directory listings in NodeTree, for fast warm mounts.
+
+Each node is saved as a compact list:
+    [name, is_dir, size, ctime, mtime, hash, children]
+where hash is of listing for directories and of content for files, and
+children is None for directories not listed yet.
+"""
+
+import os
+import gzip
+import json
+import logging
+
+from .node import DirNode
+from .node import FileNode
+from .node import DirNodeAttribute
+from .node import FileNodeAttribute
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+def _dump_node(name, node):
+    attribute = node.attribute
+    if isinstance(node, DirNode):
+        children = None
+        if node.valid:
+            # files not uploaded yet are not saved
+            children = [_dump_node(k, v) for k, v in node.nodes.items()
+                        if not (v.local and isinstance(v, FileNode))]
+        return [name, 1, 0, attribute.ctime, attribute.mtime, node.hash, children]
+    else:
+        return [name, 0, attribute.size, attribute.ctime, attribute.mtime, node.sha1, None]
+
+
+def _load_node(d):
+    name, is_dir, size, ctime, mtime, hash_value, children = d
+    if is_dir:
+        nodes = None
+        if children is not None:
+            nodes = dict((x[0], _load_node(x)) for x in children)
+        node = DirNode(name, nodes)
+        node.attribute = DirNodeAttribute(ctime, mtime)
+        node.hash = hash_value
+        node.checked = 0
+    else:
+        node = FileNode(name)
+        node.attribute = FileNodeAttribute(size, ctime, mtime)
+        node.sha1 = hash_value
+    return node
+
+
+def save(root, path):
+    """
+    Save tree to snapshot file.
+
+    :type root: DirNode
+    """
+    tmp_path = path + '.tmp'
+    f = gzip.open(tmp_path, 'wb')
+    try:
+        json.dump(dict(version=SNAPSHOT_VERSION, root=_dump_node(u'', root)), f,
+                  separators=(',', ':'))
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
+
+
+def load(path):
+    """
+    Load tree from snapshot file, all listed directories need revalidation.
+    Return None if snapshot is missing or corrupted.
+
+    :rtype: DirNode
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        f = gzip.open(path, 'rb')
+        try:
+            d = json.load(f)
+        finally:
+            f.close()
+        if d.get('version') != SNAPSHOT_VERSION:
+            log.warn(u'ignore snapshot of version %s', d.get('version'))
+            return None
+        return _load_node(d['root'])
+    except (IOError, OSError, ValueError, KeyError, TypeError), e:
+        log.warn(u'failed to load snapshot %s: %s', path, e)
+        return None
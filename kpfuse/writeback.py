@@ -0,0 +1,131 @@
+# coding: utf-8
+
+"""
+Debounced write-back of dirty files
+"""
+
+import time
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# seconds a dirty file must stay closed before it is uploaded
+WRITEBACK_DELAY = 3
+# seconds a dirty file waits at most, even if it keeps being closed again
+WRITEBACK_MAX_DELAY = 60
+
+
+class _Pending(object):
+    __slots__ = ('item', 'since', 'due')
+
+    def __init__(self, item, since, due):
+        self.item = item
+        self.since = since
+        self.due = due
+
+
+class WriteBack(object):
+    """
+    Collect dirty files and hand them to upload(path, item) after a quiet
+    period. Closing a pending file again postpones and coalesces its upload,
+    up to max_delay after it is first closed dirty.
+
+    :param clock: function returning current time in seconds
+    """
+    def __init__(self, upload, delay=WRITEBACK_DELAY, max_delay=WRITEBACK_MAX_DELAY,
+                 clock=time.time):
+        self.upload = upload
+        self.clock = clock
+        self.delay = delay
+        self.max_delay = max(delay, max_delay)
+        self._pending = dict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pending)
+
+    def __contains__(self, path):
+        with self._cond:
+            return path in self._pending
+
+    def add(self, path, item):
+        """Schedule upload of dirty file, postponing the pending one"""
+        now = self.clock()
+        with self._cond:
+            pending = self._pending.get(path)
+            if pending is None:
+                self._pending[path] = _Pending(item, now, now + self.delay)
+            else:
+                pending.item = item
+                pending.due = min(pending.since + self.max_delay, now + self.delay)
+            self._start()
+            self._cond.notify()
+
+    def cancel(self, path):
+        """Drop pending upload, return its item"""
+        with self._cond:
+            pending = self._pending.pop(path, None)
+            return pending and pending.item
+
+    def move(self, old, new):
+        """Follow rename of file, or files under directory"""
+        prefix = old.rstrip('/') + '/'
+        with self._cond:
+            for path in self._pending.keys():
+                if path == old or path.startswith(prefix):
+                    self._pending[new + path[len(old):]] = self._pending.pop(path)
+
+    def flush(self, path=None):
+        """Upload pending file, or all pending files, without waiting"""
+        with self._cond:
+            for key, pending in self._pending.iteritems():
+                if path is None or key == path:
+                    pending.due = 0
+            self._cond.notify()
+
+    def stop(self):
+        """Hand all pending files to upload, and stop"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread, self._thread = self._thread, None
+        if thread:
+            thread.join()
+        self._stopping = False
+        for path, item in self._pop_due(None):
+            self.upload(path, item)
+
+    def _start(self):
+        if self._thread is None and not self._stopping:
+            self._thread = threading.Thread(target=self._run, name='writeback')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _pop_due(self, now):
+        """Pop pending files due at now, or all if now is None"""
+        with self._cond:
+            due = [k for k, v in self._pending.iteritems() if now is None or v.due <= now]
+            return [(k, self._pending.pop(k).item) for k in due]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    now = self.clock()
+                    next_due = min(x.due for x in self._pending.itervalues()) \
+                        if self._pending else None
+                    if next_due is not None and next_due <= now:
+                        break
+                    self._cond.wait(None if next_due is None else next_due - now)
+                if self._stopping:
+                    return
+            for path, item in self._pop_due(self.clock()):
+                log.debug(u'write back: %s', path)
+                try:
+                    self.upload(path, item)
+                except Exception:
+                    log.exception(u'failed to write back %s', path)
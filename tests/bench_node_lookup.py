@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Micro benchmark of NodeTree lookup cost versus path depth, comparing
+walking the hierarchy with the flat path index.
+
+    python tests/bench_node_lookup.py
+"""
+
+import timeit
+from kpfuse.kuaipan import KuaiPan
+from kpfuse.node import NodeTree
+
+MAX_DEPTH = 16
+FANOUT = 10
+NUMBER = 100000
+
+
+class FakeKuaiPan(KuaiPan):
+    """Server with a directory tree of given depth and fanout"""
+    def __init__(self):
+        pass
+
+    def metadata(self, path, **kwargs):
+        depth = len(filter(None, path.split('/')))
+        files = [dict(name='file{}'.format(i), type='file', size=i) for i in xrange(FANOUT)]
+        if depth < MAX_DEPTH:
+            files += [dict(name='dir{}'.format(i), type='folder') for i in xrange(FANOUT)]
+        return dict(path=path, type='folder', files=files)
+
+
+def main():
+    tree = NodeTree(FakeKuaiPan(), attr_ttl=None, dir_ttl=None)
+    print '{:>5} {:>12} {:>12}'.format('depth', 'walk (us)', 'index (us)')
+    for depth in xrange(1, MAX_DEPTH + 1):
+        path = '/' + '/'.join(['dir0'] * (depth - 1) + ['file0'])
+        assert tree.get(path) is tree._walk(path)
+        walk = timeit.timeit(lambda: tree._walk(path), number=NUMBER)
+        index = timeit.timeit(lambda: tree.get(path), number=NUMBER)
+        print '{:>5} {:>12.3f} {:>12.3f}'.format(depth, walk * 1e6 / NUMBER, index * 1e6 / NUMBER)
+    tree.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Memory benchmark of NodeTree, building a synthetic tree with given number
+of entries and reporting resident memory per node.
+
+    python tests/bench_node_memory.py [entries]
+"""
+
+import os
+import sys
+import gc
+from kpfuse.kuaipan import KuaiPan
+from kpfuse.node import NodeTree
+
+FILES_PER_DIR = 1000
+
+
+class FakeKuaiPan(KuaiPan):
+    """Server with directories /dirN of FILES_PER_DIR files each"""
+    def __init__(self, entries):
+        self.dirs = max(1, entries // (FILES_PER_DIR + 1))
+
+    def metadata(self, path, **kwargs):
+        if path == '/':
+            files = [dict(name=u'dir{}'.format(i), type='folder',
+                          create_time='2015-01-01 00:00:00',
+                          modify_time='2015-01-01 00:00:00') for i in xrange(self.dirs)]
+        else:
+            files = [dict(name=u'IMG_{:04d}.JPG'.format(i), type='file', size=1000000 + i,
+                          create_time='2015-01-01 00:00:00',
+                          modify_time='2015-03-01 12:00:00') for i in xrange(FILES_PER_DIR)]
+        return dict(path=path, type='folder', files=files)
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    kp = FakeKuaiPan(entries)
+    tree = NodeTree(kp, attr_ttl=None, dir_ttl=None)
+    gc.collect()
+    before = rss()
+    for i in xrange(kp.dirs):
+        tree.get(u'/dir{}'.format(i))
+    gc.collect()
+    count = kp.dirs * (FILES_PER_DIR + 1)
+    used = rss() - before
+    print 'nodes: {}, memory: {:.1f} MB, {:.1f} bytes per node'.format(count, used / 1e6, float(used) / count)
+    tree.close()
+
+
+if __name__ == '__main__':
+    main()
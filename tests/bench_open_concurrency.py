@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Benchmark of many threads opening distinct files, against a stand-in server
+adding latency to every request, comparing per-path locks of
+KuaipanFuseOperations with one global lock around open and release.
+
+    python tests/bench_open_concurrency.py
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+from kpfuse.kuaipan import KuaiPan
+from kpfuse.kpfuse import KuaipanFuseOperations
+
+LATENCY = 0.05
+THREADS = 32
+FILES = 4  # opened by each thread, in its own directory
+
+
+class FakeKuaiPan(KuaiPan):
+    """Server with a directory of empty files for each thread, and latency"""
+    def __init__(self):
+        self.pool_size = 0
+
+    def set_pool_size(self, pool_size):
+        self.pool_size = pool_size
+
+    def set_upload_rate(self, upload_rate):
+        pass
+
+    def metadata(self, path, **kwargs):
+        time.sleep(LATENCY)
+        if path == '/':
+            files = [dict(name='dir{}'.format(i), type='folder') for i in xrange(THREADS)]
+        else:
+            files = [dict(name='file{}'.format(i), type='file', size=0) for i in xrange(FILES)]
+        return dict(path=path, type='folder', files=files)
+
+
+def run(global_lock):
+    profile_dir = tempfile.mkdtemp()
+    ops = KuaipanFuseOperations(FakeKuaiPan(), profile_dir, prefetch_depth=0)
+    lock = threading.Lock() if global_lock else None
+
+    def worker(i):
+        for j in xrange(FILES):
+            path = '/dir{}/file{}'.format(i, j)
+            if lock is not None:
+                with lock:
+                    fh = ops.open(path, os.O_RDONLY)
+                    ops.release(path, fh)
+            else:
+                fh = ops.open(path, os.O_RDONLY)
+                ops.release(path, fh)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in xrange(THREADS)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    ops.destroy('/')
+    shutil.rmtree(profile_dir)
+    return elapsed
+
+
+def main():
+    print '{} threads opening {} files each, {} ms latency'.format(THREADS, FILES, LATENCY * 1000)
+    print '{:>10} {:>10} {:>12}'.format('locking', 'time (s)', 'opens/s')
+    for name, global_lock in (('global', True), ('per-path', False)):
+        elapsed = run(global_lock)
+        print '{:>10} {:>10.3f} {:>12.1f}'.format(name, elapsed, THREADS * FILES / elapsed)
+
+
+if __name__ == '__main__':
+    main()
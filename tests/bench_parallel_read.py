@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Benchmark of threads reading the same fully cached file at random offsets,
+with seek and read of a descriptor of each reader outside of the lock of
+the cache object, and slices of its memory map, versus seek and read in
+the lock. Throughput and CPU time per GB read are reported.
+
+    python tests/bench_parallel_read.py
+"""
+
+import os
+import time
+import random
+import shutil
+import tempfile
+import threading
+from kpfuse.node import FileNode
+from kpfuse.cache import FileCache
+
+FILE_SIZE = 64 * 1024 * 1024
+READ_SIZE = 128 * 1024
+READS = 2000  # by each thread
+
+
+def locked_read(c, size, offset):
+    with c._rwlock:
+        os.lseek(c.fh, offset, 0)
+        return os.read(c.fh, size)
+
+
+def run(c, read, threads):
+    def worker():
+        r = random.Random()
+        for _ in xrange(READS):
+            read(c, READ_SIZE, r.randrange(0, FILE_SIZE - READ_SIZE))
+
+    workers = [threading.Thread(target=worker) for _ in xrange(threads)]
+    start, cpu = time.time(), sum(os.times()[:2])
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    size = threads * READS * READ_SIZE
+    return size / (time.time() - start) / (1 << 20), (sum(os.times()[:2]) - cpu) * (1 << 30) / size
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    cache_path = os.path.join(tmp_dir, 'file')
+    with open(cache_path, 'wb') as f:
+        f.write(os.urandom(FILE_SIZE))
+    node = FileNode(u'/file')
+    node.attribute.size = FILE_SIZE
+    node.attribute.mtime = os.path.getmtime(cache_path)
+    os.utime(cache_path, (node.attribute.mtime, node.attribute.mtime))  # not modified
+    c = FileCache(node, cache_path, None)
+    c.open(os.O_RDONLY)
+    mapped = FileCache(node, cache_path, None, use_mmap=True)
+    mapped.open(os.O_RDONLY)
+    print '{:>8} {:>20} {:>20} {:>20}'.format('threads', 'locked', 'reader', 'mmap')
+    print '{:>8}{}'.format('', ' {:>9} {:>10}'.format('MB/s', 'CPU s/GB') * 3)
+    for threads in (1, 2, 4, 8):
+        results = [run(c, locked_read, threads),
+                   run(c, FileCache.read, threads),
+                   run(mapped, FileCache.read, threads)]
+        print '{:>8}{}'.format(threads, ''.join(' {:>9.1f} {:>10.3f}'.format(*x) for x in results))
+    c.close()
+    mapped.close()
+    shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
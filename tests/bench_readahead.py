@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Benchmark of reading a file not cached yet from start to end, in reads of
+the size FUSE issues, against a stand-in content server with a latency
+for each request. Reads with read-ahead are compared with reads which
+download the missing block of each read in turn.
+
+    python tests/bench_readahead.py
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+from kpfuse import kuaipan
+from kpfuse.node import FileNode
+from kpfuse.cache import FileCache
+from kpfuse.download import RangeDownloader
+from kpfuse.readahead import ReadAhead
+from test_download import RangeServer
+from test_download import RangeRequestHandler
+
+FILE_SIZE = 40 * 1024 * 1024
+READ_SIZE = 128 * 1024
+LATENCY = 0.05
+
+
+class SlowRequestHandler(RangeRequestHandler):
+    def do_GET(self):
+        time.sleep(LATENCY)
+        RangeRequestHandler.do_GET(self)
+
+
+def run(kp, tmp_dir, readahead):
+    node = FileNode(u'/file')
+    node.attribute.size = FILE_SIZE
+    node.attribute.mtime = 1
+    downloader = RangeDownloader(kp)
+    c = FileCache(node, os.path.join(tmp_dir, 'file'), downloader)
+    start = time.time()
+    c.open(os.O_RDONLY)
+    for offset in xrange(0, FILE_SIZE, READ_SIZE):
+        c.read(READ_SIZE, offset, readahead)
+    c.close()
+    elapsed = time.time() - start
+    downloader.close()
+    os.remove(c.cache_path)
+    return elapsed
+
+
+def main():
+    server = RangeServer(os.urandom(FILE_SIZE))
+    server.RequestHandlerClass = SlowRequestHandler
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    kuaipan.CONTENT_HOST = 'http://127.0.0.1:{}/'.format(server.server_port)
+    kp = kuaipan.KuaiPan('key', 'secret', 'owner_key', 'owner_secret')
+    tmp_dir = tempfile.mkdtemp()
+    print '{:>12} {:>8}'.format('', 'seconds')
+    print '{:>12} {:>8.2f}'.format('no readahead', run(kp, tmp_dir, None))
+    print '{:>12} {:>8.2f}'.format('readahead', run(kp, tmp_dir, ReadAhead()))
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import threading
+import unittest
+from kpfuse import errors
+from kpfuse.kuaipan import KuaiPan
+from kpfuse.asyncclient import AsyncKuaiPan
+from kpfuse.futures import CancelledError
+from kpfuse.futures import wait
+from kpfuse.scheduler import TransferScheduler
+from kpfuse.scheduler import FOREGROUND
+
+
+class FakeKuaiPan(KuaiPan):
+    def __init__(self):
+        KuaiPan.__init__(self, 'key', 'secret', pool_size=1)
+        self.moves = []
+
+    def metadata(self, path, **kwargs):
+        if path == u'/missing':
+            raise errors.FileNotExistedError(description=path)
+        return dict(path=path)
+
+    def move(self, from_path, to_path, **kwargs):
+        self.moves.append((from_path, to_path))
+
+
+class TestAsyncKuaiPan(unittest.TestCase):
+    def setUp(self):
+        self.kp = FakeKuaiPan()
+        # hold the only worker, so operations stay queued
+        self.scheduler = TransferScheduler(workers=1)
+        self.gate = threading.Event()
+        self.scheduler.submit(u'/gate', self.gate.wait, priority=FOREGROUND)
+        self.client = AsyncKuaiPan(self.kp, self.scheduler, max_pending=2)
+
+    def test_operations(self):
+        self.assertEqual(self.kp.pool_size, 1)  # as many as workers
+        futures = [self.client.metadata(u'/a'), self.client.move(u'/a', u'/b')]
+        self.gate.set()
+        self.assertEqual(wait(futures), [dict(path=u'/a'), None])
+        self.assertEqual(self.kp.moves, [(u'/a', u'/b')])
+        self.assertRaises(AttributeError, getattr, self.client, 'authorise')
+
+    def test_error(self):
+        future = self.client.metadata(u'/missing')
+        self.gate.set()
+        self.assertRaises(errors.FileNotExistedError, future.result, 5)
+
+    def test_max_pending(self):
+        futures = [self.client.metadata(u'/{}'.format(i)) for i in xrange(2)]
+        submitted = threading.Event()
+
+        def submit():
+            futures.append(self.client.metadata(u'/2'))
+            submitted.set()
+
+        t = threading.Thread(target=submit)
+        t.start()
+        self.assertFalse(submitted.wait(0.1))  # blocked until one is finished
+        self.assertEqual(self.scheduler.cancel(u'/0'), 1)
+        self.assertTrue(submitted.wait(5))
+        t.join()
+        self.gate.set()
+        self.assertRaises(CancelledError, futures[0].result)
+        self.assertEqual(wait(futures[1:], 5), [dict(path=u'/1'), dict(path=u'/2')])
+
+    def tearDown(self):
+        self.gate.set()
+        self.client.close()
+        self.scheduler.close()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+from kpfuse.blocks import BlockMap
+
+
+class TestBlockMap(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def test_missing(self):
+        m = BlockMap(10, block_size=4)
+        self.assertEqual(m.count, 3)
+        self.assertEqual(m.missing(), [(0, 3)])
+        m.add(1)
+        self.assertEqual(m.missing(), [(0, 1), (2, 3)])
+        self.assertEqual(m.missing(4, 4), [])
+        self.assertEqual(m.missing(7, 100), [(2, 3)])
+        self.assertEqual(m.byte_range(2, 3), (8, 10))
+        self.assertEqual(m.next_missing(), (0, 1))
+        m.add_blocks(0, 3)
+        self.assertTrue(m.completed)
+        self.assertEqual(m.next_missing(), None)
+
+    def test_resize(self):
+        m = BlockMap(10, block_size=4)
+        m.resize(20)
+        self.assertEqual(m.missing(), [(0, 3)])
+        m.resize(5)
+        self.assertEqual(m.missing(), [(0, 2)])
+
+    def test_save_load(self):
+        path = os.path.join(self.tmp_dir, 'a.kpblocks')
+        m = BlockMap(100, 12345, block_size=8)
+        m.add_blocks(3, 7)
+        m.save(path)
+        m2 = BlockMap.load(path)
+        self.assertEqual(m2.mtime, 12345)
+        self.assertEqual(m2.missing(), m.missing())
+        self.assertEqual(BlockMap.load(path + '.none'), None)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import shutil
+import threading
+import tempfile
+import unittest
+from kpfuse import kuaipan
+from kpfuse.node import FileNode
+from kpfuse.node import NodeTree
+from kpfuse.kuaipan import KuaiPan
+from kpfuse.errors import FileNotExistedError
+from kpfuse.journal import Journal
+from kpfuse.cache import FileCache
+from kpfuse.cache import CachePool
+from kpfuse.cache import NOT_MODIFIED
+from kpfuse.blocks import BLOCK_SIZE
+from kpfuse.download import RangeDownloader
+from kpfuse.readahead import ReadAhead
+from kpfuse.scheduler import TransferScheduler
+from kpfuse.scheduler import FOREGROUND
+from test_download import RangeServer
+
+
+class CacheTestCase(unittest.TestCase):
+    """Cache object of a complete and unmodified file of 10 bytes"""
+    use_mmap = False
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tmp_dir, 'file')
+        with open(self.cache_path, 'wb') as f:
+            f.write('0123456789')
+        node = FileNode(u'/file')
+        node.attribute.size = 10
+        node.attribute.mtime = os.path.getmtime(self.cache_path)
+        os.utime(self.cache_path, (node.attribute.mtime, node.attribute.mtime))  # not modified
+        self.cache = FileCache(node, self.cache_path, None, use_mmap=self.use_mmap)
+        self.cache.open(os.O_RDWR)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmp_dir)
+
+
+class TestFileCacheMap(CacheTestCase):
+    use_mmap = True
+
+    def test_read_mapped(self):
+        c = self.cache
+        self.assertEqual(c.read(4, 3), '3456')
+        self.assertIsNotNone(c._map)
+        self.assertEqual(c.read(100, 8), '89')
+
+    def test_remap(self):
+        c = self.cache
+        self.assertEqual(c.read(10, 0), '0123456789')
+        c.truncate(4)
+        self.assertIsNone(c._map)
+        self.assertEqual(c.read(10, 0), '0123')
+        c.write('abcdef', 2)
+        self.assertEqual(c.read(10, 0), '01abcdef')
+        self.assertIsNone(c._map)  # modified files are not mapped
+
+
+class TestFileCacheWrite(CacheTestCase):
+    def test_size(self):
+        c = self.cache
+        c.write('abc', 20)
+        self.assertEqual(c.node.attribute.size, 23)
+        c.write('x', 0)
+        self.assertEqual(c.node.attribute.size, 23)
+        c.truncate(5)
+        self.assertEqual(c.node.attribute.size, 5)
+
+
+class TestFileCacheDirty(CacheTestCase):
+    def test_same_data(self):
+        c = self.cache
+        self.assertEqual(c.write('2345', 2), 4)
+        self.assertEqual(c.modified, NOT_MODIFIED)  # nothing to upload
+        c.write('ab', 4)
+        self.assertEqual(c.dirty.ranges, [(4, 6)])
+        c.write('89', 8)  # not compared once modified
+        self.assertEqual(c.dirty.ranges, [(4, 6), (8, 10)])
+        self.assertEqual(c.read(10, 0), '0123ab6789')
+
+
+class TestFileCacheReadAhead(unittest.TestCase):
+    """Partial cache object of 4 blocks, downloaded from a stand-in server"""
+    def setUp(self):
+        self.data = os.urandom(4 * BLOCK_SIZE)
+        self.server = RangeServer(self.data)
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        self.content_host = kuaipan.CONTENT_HOST
+        kuaipan.CONTENT_HOST = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        # hold the only worker, so read-ahead stays queued
+        self.scheduler = TransferScheduler(workers=1)
+        self.gate = threading.Event()
+        self.scheduler.submit(u'/gate', self.gate.wait, priority=FOREGROUND)
+        kp = KuaiPan('key', 'secret', 'owner_key', 'owner_secret')
+        downloader = RangeDownloader(kp, part_size=BLOCK_SIZE, scheduler=self.scheduler)
+        self.tmp_dir = tempfile.mkdtemp()
+        node = FileNode(u'/file')
+        node.attribute.size = len(self.data)
+        node.attribute.mtime = 1
+        self.cache = FileCache(node, os.path.join(self.tmp_dir, 'file'), downloader)
+        self.cache.open(os.O_RDWR)
+        self.readahead = ReadAhead(min_size=2 * BLOCK_SIZE)
+
+    def test_inflight(self):
+        c = self.cache
+        self.assertEqual(c.read(10, 0, self.readahead), self.data[:10])
+        # first block is stolen from read-ahead by the read, the next ones are in flight
+        self.assertEqual(self.server.ranges, [(0, BLOCK_SIZE - 1)])
+        self.assertEqual(sorted(c._inflight), [1, 2])
+        tasks = set(c._inflight.itervalues())
+        self.gate.set()
+        for task in tasks:
+            self.assertIsNone(task.error(5))
+        self.assertEqual(c._inflight, {})
+        self.assertEqual(c.blocks.missing(), [(3, 4)])
+        self.assertEqual(c.read(10, 2 * BLOCK_SIZE), self.data[2 * BLOCK_SIZE:2 * BLOCK_SIZE + 10])
+        self.assertEqual(len(self.server.ranges), 3)  # not downloaded again
+
+    def test_steal(self):
+        c = self.cache
+        c.read(10, 0, self.readahead)
+        task = c._inflight[2]
+        offset = 2 * BLOCK_SIZE + 5
+        self.assertEqual(c.read(10, offset), self.data[offset:offset + 10])
+        # run by the read, while the worker is busy
+        self.assertTrue(task.done())
+        self.assertEqual(sorted(c._inflight), [1])
+        self.assertEqual(self.server.ranges, [(0, BLOCK_SIZE - 1), (2 * BLOCK_SIZE, 3 * BLOCK_SIZE - 1)])
+
+    def test_write_drains(self):
+        c = self.cache
+        c.read(10, 0, self.readahead)
+        tasks = set(c._inflight.itervalues())
+        c.write(chr(ord(self.data[0]) ^ 1), 0)
+        self.assertEqual(c._inflight, {})
+        self.assertTrue(all(x.cancelled() for x in tasks))
+        self.assertEqual(c.blocks.missing(), [(1, 4)])
+
+    def tearDown(self):
+        self.gate.set()
+        self.cache.close()
+        self.scheduler.close()
+        kuaipan.CONTENT_HOST = self.content_host
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+
+class FakeKuaiPan(KuaiPan):
+    """Server with an empty root directory"""
+    def __init__(self):
+        self.uploads = []
+
+    def metadata(self, path, **kwargs):
+        if path != '/':
+            raise FileNotExistedError(description=path)
+        return dict(path=path, type='folder', files=[])
+
+    def upload(self, path, data, overwrite=False, **kwargs):
+        self.uploads.append(path)
+
+
+class TestCachePoolRecover(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.pool_dir = os.path.join(self.tmp_dir, 'object')
+        self.journal_path = os.path.join(self.tmp_dir, 'journal.jsonl')
+        os.makedirs(os.path.join(self.pool_dir, 'gone'))
+        with open(os.path.join(self.pool_dir, 'gone', 'file'), 'wb') as f:
+            f.write('data')
+        journal = Journal(self.journal_path)
+        journal.load()
+        journal.add(u'/gone/file')
+        journal.close()
+        self.kp = FakeKuaiPan()
+        self.tree = NodeTree(self.kp, attr_ttl=None, dir_ttl=None)
+
+    def test_missing_directory(self):
+        pool = CachePool(self.tree, self.pool_dir, os.path.join(self.tmp_dir, 'index.json'),
+                         journal_path=self.journal_path)
+        pool.shutdown()
+        self.assertEqual(self.kp.uploads, [])  # not uploaded into root
+        self.assertIn(u'/gone/file', pool.journal)
+
+    def tearDown(self):
+        self.tree.close()
+        shutil.rmtree(self.tmp_dir)
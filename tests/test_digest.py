@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import hashlib
+import tempfile
+import unittest
+from kpfuse.digest import SequentialHash, file_sha1
+
+
+class TestDigest(unittest.TestCase):
+    def test_sequential(self):
+        h = SequentialHash()
+        h.update(0, 'hello ')
+        h.update(6, 'world')
+        self.assertEqual(h.hexdigest(11), hashlib.sha1('hello world').hexdigest())
+        self.assertIsNone(h.hexdigest(12))
+        h.truncate(11)
+        self.assertIsNotNone(h.hexdigest(11))
+        h.update(0, 'H')  # rewrite makes it unknown
+        self.assertIsNone(h.hexdigest(11))
+
+    def test_file(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, 'x' * 3000000)
+            os.close(fd)
+            self.assertEqual(file_sha1(path), hashlib.sha1('x' * 3000000).hexdigest())
+        finally:
+            os.remove(path)
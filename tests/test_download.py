@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import re
+import threading
+import unittest
+import BaseHTTPServer
+import SocketServer
+from kpfuse import kuaipan
+from kpfuse.retry import RetryPolicy
+from kpfuse.download import RangeDownloader
+from kpfuse.download import fetch_range
+from requests.exceptions import ConnectionError
+
+
+class RangeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Stand-in content server which supports range requests"""
+    daemon_threads = True
+
+    def __init__(self, data, support_range=True):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), RangeRequestHandler)
+        self.data = data
+        self.support_range = support_range
+        self.ranges = []
+        self.drops = 0  # number of responses cut in the middle
+
+
+class RangeRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        data = self.server.data
+        m = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if m and self.server.support_range:
+            first, last = int(m.group(1)), min(int(m.group(2)), len(data) - 1)
+            self.server.ranges.append((first, last))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(first, last, len(data)))
+            data = data[first:last + 1]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.server.drops > 0:
+            self.server.drops -= 1
+            data = data[:len(data) // 2]
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRangeDownloader(unittest.TestCase):
+    def setUp(self):
+        self.data = os.urandom(1000)
+        self.content_host = kuaipan.CONTENT_HOST
+        self.kp = kuaipan.KuaiPan('key', 'secret', 'owner_key', 'owner_secret')
+
+    def start_server(self, support_range=True):
+        self.server = RangeServer(self.data, support_range)
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        kuaipan.CONTENT_HOST = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+
+    def download(self, ranges, workers=4):
+        buf = bytearray(len(self.data))
+
+        def write(offset, data):
+            buf[offset:offset + len(data)] = data
+
+        downloader = RangeDownloader(self.kp, workers=workers, part_size=64)
+        try:
+            downloader.download(u'/file', ranges, write, align=32)
+        finally:
+            downloader.close()
+        return buf
+
+    def test_parallel_download(self):
+        self.start_server()
+        buf = self.download([(0, len(self.data))])
+        self.assertEqual(str(buf), self.data)
+        self.assertEqual(len(self.server.ranges), 16)
+
+    def test_partial_download(self):
+        self.start_server()
+        buf = self.download([(40, 100), (900, 1000)])
+        self.assertEqual(str(buf[40:100]), self.data[40:100])
+        self.assertEqual(str(buf[900:]), self.data[900:])
+        self.assertEqual(buf[:40], bytearray(40))
+
+    def test_range_not_supported(self):
+        self.start_server(support_range=False)
+        buf = self.download([(100, 300)], workers=2)
+        self.assertEqual(str(buf[100:300]), self.data[100:300])
+
+    def test_resume(self):
+        self.start_server()
+        self.server.drops = 2
+        buf = self.download([(0, len(self.data))], workers=1)
+        self.assertEqual(str(buf), self.data)
+        # resumed from the middle of the dropped parts
+        self.assertIn((32, 63), self.server.ranges)
+
+    def test_retry_once(self):
+        self.start_server()
+        self.kp.retry = RetryPolicy(retries=3, backoff=0.001)
+        requests = []
+
+        def get(url, **kwargs):
+            requests.append(url)
+            raise ConnectionError()
+
+        self.kp.oauth.get = get
+        self.assertRaises(ConnectionError, fetch_range, self.kp, u'/file', 0, 100, None)
+        self.assertEqual(len(requests), 4)  # not retried again by each attempt
+
+    def tearDown(self):
+        kuaipan.CONTENT_HOST = self.content_host
+        self.server.shutdown()
+        self.server.server_close()
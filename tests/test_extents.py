@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import unittest
+from kpfuse.extents import DirtyExtents
+
+
+class TestDirtyExtents(unittest.TestCase):
+    def test_add(self):
+        e = DirtyExtents(100, 'abc')
+        e.add(10, 20)
+        e.add(30, 40)
+        e.add(20, 25)  # adjacent ranges are merged
+        self.assertEqual(e.ranges, [(10, 25), (30, 40)])
+        e.add(5, 35)
+        self.assertEqual(e.ranges, [(5, 40)])
+        self.assertEqual(len(e), 35)
+        e.add(50, 60)
+        e.add(0, 1)
+        e.add(45, 47)
+        self.assertEqual(e.ranges, [(0, 1), (5, 40), (45, 47), (50, 60)])
+        e.add(1, 50)
+        self.assertEqual(e.ranges, [(0, 60)])
+
+    def test_truncate(self):
+        e = DirtyExtents(100, 'abc')
+        self.assertFalse(e.changed(100))
+        e.add(90, 100)
+        e.truncate(100, 120)
+        self.assertEqual(e.ranges, [(90, 120)])
+        e.truncate(120, 100)
+        e.truncate(100, 90)
+        self.assertEqual(e.ranges, [])
+        self.assertTrue(e.changed(90))
+        e.truncate(90, 100)
+        self.assertTrue(e.changed(100))  # zeros instead of data at server
+
+    def test_json(self):
+        e = DirtyExtents(100, 'abc', [(0, 10)], mtime=1.5)
+        e = DirtyExtents.from_json(e.to_json())
+        self.assertEqual((e.size, e.sha1, e.ranges, e.mtime), (100, 'abc', [(0, 10)], 1.5))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import tempfile
+import unittest
+from kpfuse import fileio
+from kpfuse.fileio import pread, pwrite, pwrite_all
+from kpfuse.fileio import FileReader
+
+
+class TestFileIO(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        self.fd = fd
+
+    def test_positional(self):
+        self.assertEqual(pwrite(self.fd, 'hello world', 0), 11)
+        self.assertEqual(pwrite(self.fd, 'W', 6), 1)
+        self.assertEqual(os.lseek(self.fd, 0, os.SEEK_CUR), 0)  # offset not moved
+        self.assertEqual(pread(self.fd, 5, 6), 'World')
+        self.assertEqual(pread(self.fd, 100, 0), 'hello World')  # short at end
+        self.assertEqual(pread(self.fd, 10, 100), '')
+        self.assertRaises(OSError, pread, -1, 10, 0)
+
+    def test_short_writes(self):
+        writes = []
+
+        def short_pwrite(fd, data, offset):
+            writes.append(offset)
+            return pwrite(fd, data[:3], offset)
+
+        fileio.pwrite = short_pwrite
+        try:
+            self.assertEqual(pwrite_all(self.fd, 'hello world', 2), 11)
+        finally:
+            fileio.pwrite = pwrite
+        self.assertEqual(writes, [2, 5, 8, 11])
+        self.assertEqual(pread(self.fd, 20, 0), '\0\0hello world')
+
+    def test_reader(self):
+        pwrite(self.fd, 'hello world', 0)
+        reader = FileReader(self.fd, self.path)
+        self.assertEqual(reader.read(5, 6), 'world')
+        fd = reader._fds[0]
+        self.assertEqual(reader.read(100, 0), 'hello world')
+        self.assertEqual(reader._fds, [fd])  # reused
+        self.assertNotEqual(fd, self.fd)
+        reader.close()
+        self.assertRaises(OSError, os.fstat, fd)
+
+    def test_reader_renamed(self):
+        pwrite(self.fd, 'hello world', 0)
+        reader = FileReader(self.fd, self.path + '.renamed')
+        self.assertEqual(reader.read(5, 0), 'hello')  # read by descriptor of the file
+        self.assertEqual(reader._fds, [])
+
+    def test_fd_lock(self):
+        self.assertIs(fileio._fd_lock(self.fd), fileio._fd_lock(self.fd))
+        self.assertIsNot(fileio._fd_lock(self.fd), fileio._fd_lock(self.fd + 1))
+
+    def tearDown(self):
+        os.close(self.fd)
+        os.remove(self.path)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import threading
+import unittest
+from kpfuse.futures import Future
+from kpfuse.futures import CancelledError
+from kpfuse.futures import wait
+
+
+class TestFuture(unittest.TestCase):
+    def test_result(self):
+        futures = [Future() for _ in xrange(3)]
+        for i, x in enumerate(futures):
+            threading.Thread(target=x.set_result, args=(i,)).start()
+        self.assertEqual(wait(futures), [0, 1, 2])
+
+    def test_error(self):
+        future = Future()
+        future.set_error(ValueError('x'))
+        self.assertRaises(ValueError, future.result)
+        self.assertIsInstance(future.error(), ValueError)
+
+    def test_timeout(self):
+        future = Future()
+        self.assertRaises(RuntimeError, future.result, 0.01)
+        threading.Timer(0.01, future.set_result, args=(1,)).start()
+        self.assertEqual(future.result(), 1)
+
+    def test_cancel(self):
+        future = Future()
+        called = []
+        future.add_done_callback(called.append)
+        self.assertTrue(future.cancel())
+        self.assertRaises(CancelledError, future.result)
+        self.assertEqual(called, [future])
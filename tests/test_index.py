@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from kpfuse.index import CacheIndex
+from kpfuse.blocks import BlockMap
+from kpfuse.blocks import BLOCK_MAP_SUFFIX
+
+
+class TestCacheIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.pool_dir = os.path.join(self.tmp_dir, 'object')
+        os.makedirs(self.pool_dir)
+        self.index = CacheIndex(os.path.join(self.tmp_dir, 'index.json'), self.pool_dir)
+        self.index.load()
+
+    def test_lru(self):
+        now = time.time()
+        for i, name in enumerate([u'/a', u'/b', u'/c', u'/d']):
+            self.index.update(name, size=10)
+            self.index.get(name).atime = now + i
+        self.assertTrue(self.index.over_quota(35, 10))
+        self.assertEqual(self.index.victims(25, 10), [u'/a', u'/b'])
+        self.assertEqual(self.index.victims(35, 10, pinned=lambda x: x == u'/a'), [u'/b'])
+        self.index.update(u'/b', dirty=True)
+        self.assertEqual(self.index.victims(100, 2), [u'/a', u'/c'])
+        self.assertEqual(self.index.victims(100, 10, expire_time=now + 0.5), [u'/a'])
+
+    def test_frequency(self):
+        now = time.time()
+        self.index.update(u'/hot', size=10)
+        self.index.get(u'/hot').atime = now
+        self.index.get(u'/hot').hits = 7
+        self.index.update(u'/cold', size=10)
+        self.index.get(u'/cold').atime = now + 10
+        self.assertEqual(self.index.victims(10, 10), [u'/hot'])
+        self.assertEqual(self.index.victims(10, 10, frequency_weight=5), [u'/cold'])
+
+    def test_save_load(self):
+        with open(os.path.join(self.pool_dir, 'x'), 'wb') as f:
+            f.write('x' * 10000)
+        self.index.load()  # rebuild from pool
+        self.assertEqual(self.index.count, 1)
+        self.index.move(u'/x', u'/y')
+        self.index.save()
+        index = CacheIndex(self.index.path, self.pool_dir)
+        index.load()
+        self.assertEqual(index.entries.keys(), [u'/y'])
+        self.assertEqual(index.total_size, self.index.total_size)
+
+    def test_dirty_after_crash(self):
+        for name in ('a', 'b', 'c'):
+            with open(os.path.join(self.pool_dir, name), 'wb') as f:
+                f.write('x' * 100)
+        blocks = BlockMap(100)
+        blocks.modified = True
+        blocks.save(os.path.join(self.pool_dir, 'a' + BLOCK_MAP_SUFFIX))
+        self.index.load([u'/b'])  # rebuild, /b is in journal
+        self.assertEqual(self.index.count, 3)
+        self.assertTrue(self.index.get(u'/a').dirty)
+        self.assertTrue(self.index.get(u'/b').dirty)
+        self.assertFalse(self.index.get(u'/c').dirty)
+        self.assertEqual(self.index.victims(0, 0), [u'/c'])
+
+    def test_find_sha1(self):
+        self.index.update(u'/a', size=10, sha1='abc')
+        self.index.update(u'/b', size=10, sha1='def', dirty=True)
+        self.index.update(u'/a', size=20)  # kept
+        self.assertEqual(self.index.find('abc'), u'/a')
+        self.assertIsNone(self.index.find('def'))
+        self.index.save()
+        index = CacheIndex(self.index.path, self.pool_dir)
+        index.load()
+        self.assertEqual(index.get(u'/a').sha1, 'abc')
+        self.assertEqual(index.find('abc'), u'/a')
+        index.move(u'/a', u'/c')
+        self.assertEqual(index.find('abc'), u'/c')
+        index.update(u'/c', sha1='xyz')
+        self.assertIsNone(index.find('abc'))
+        index.remove(u'/c')
+        self.assertIsNone(index.find('xyz'))
+
+    def test_pending(self):
+        self.index.update(u'/a', size=4096, dirty=True, extents=[100, 'abc', [(0, 10)], 1.0])
+        self.index.update(u'/b', size=8192, dirty=True)  # extents unknown
+        self.index.update(u'/c', size=4096)
+        self.assertEqual(self.index.pending(), (2, 8202))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+from kpfuse.journal import Journal
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'journal.jsonl')
+
+    def reload(self, journal):
+        journal.close()
+        journal = Journal(self.path)
+        journal.load()
+        return journal
+
+    def test_replay(self):
+        journal = Journal(self.path)
+        journal.load()
+        for path in (u'/a', u'/dir/b', u'/dir/c', u'/d'):
+            journal.add(path)
+        journal.remove(u'/a')
+        journal.remove(u'/d', 'delete')
+        journal.move(u'/dir', u'/new')
+        journal = self.reload(journal)
+        self.assertEqual(journal.paths(), [u'/new/b', u'/new/c'])
+
+    def test_broken_record(self):
+        journal = Journal(self.path)
+        journal.load()
+        journal.add(u'/a')
+        journal.close()
+        with open(self.path, 'at') as f:
+            f.write('{"op": "dirty", "pa')  # crashed while appending
+        journal = self.reload(journal)
+        self.assertEqual(journal.paths(), [u'/a'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import io
+import cgi
+import threading
+import unittest
+import requests
+from kpfuse.kuaipan import KuaiPan
+from kpfuse.kuaipan import TIMEOUTS
+from kpfuse.retry import RetryPolicy
+
+
+class FakeResponse(object):
+    def __init__(self, data=None, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.content = str(data)
+
+    def json(self):
+        return self.data
+
+
+class FakeSession(object):
+    def __init__(self, get, post=None):
+        self.get = get
+        self.post = post
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        self.kp = KuaiPan('key', 'secret', 'owner_key', 'owner_secret',
+                          pool_size=4, timeouts=dict(API=(1, 2)))
+
+    def in_thread(self, func):
+        result = []
+        t = threading.Thread(target=lambda: result.append(func()))
+        t.start()
+        t.join()
+        return result[0]
+
+    def test_session_per_thread(self):
+        oauth = self.kp.oauth
+        self.assertIs(self.kp.oauth, oauth)
+        other = self.in_thread(lambda: self.kp.oauth)
+        self.assertIsNot(other, oauth)
+        # connection pools are shared
+        self.assertIs(other.get_adapter('http://x/'), oauth.get_adapter('http://x/'))
+
+    def test_set_pool_size(self):
+        oauth = self.kp.oauth
+        self.kp.set_pool_size(32)
+        self.assertIsNot(self.kp.oauth, oauth)
+        self.assertEqual(self.kp.oauth.get_adapter('https://x/')._pool_maxsize, 32)
+        adapter = self.in_thread(lambda: self.kp.oauth.get_adapter('http://x/'))
+        self.assertEqual(adapter._pool_maxsize, 32)
+
+    def test_timeouts(self):
+        timeouts = []
+
+        def get(url, **kwargs):
+            timeouts.append(kwargs['timeout'])
+            return FakeResponse(dict())
+
+        self.kp._new_session = lambda: FakeSession(get)
+        self.kp.metadata(u'/a')
+        self.kp.download(u'/a')
+        self.kp.thumbnail(10, 10, u'/a')
+        self.kp.metadata(u'/a', timeout=7)
+        self.assertEqual(timeouts, [(1, 2), TIMEOUTS['CONTENT'], TIMEOUTS['CONV'], 7])
+
+
+class TestUpload(unittest.TestCase):
+    def setUp(self):
+        self.kp = KuaiPan('key', 'secret', 'owner_key', 'owner_secret',
+                          retry=RetryPolicy(retries=2, backoff=0.001))
+        self.locates = []
+        self.bodies = []
+        self.failures = []  # errors raised by next posts
+        self.kp._new_session = lambda: FakeSession(self.locate, self.post)
+
+    def locate(self, url, **kwargs):
+        self.locates.append(url)
+        return FakeResponse(dict(url='http://upload{}/'.format(len(self.locates))))
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        content = data.read(10)
+        if self.failures:
+            raise self.failures.pop(0)
+        content += data.read()
+        environ = dict(REQUEST_METHOD='POST', CONTENT_TYPE=headers['Content-Type'],
+                       CONTENT_LENGTH=str(data.len))
+        self.bodies.append((url, content, environ))
+        return FakeResponse(dict(msg='ok'))
+
+    def test_retry_rewinds(self):
+        self.failures.append(requests.exceptions.ConnectionError())
+        self.kp.upload(u'/a', io.BytesIO('0123456789' * 10))
+        url, content, environ = self.bodies[0]
+        # body is sent again from its start
+        form = cgi.FieldStorage(io.BytesIO(content), environ=environ)
+        self.assertEqual(form['file'].value, '0123456789' * 10)
+        self.assertEqual(len(self.locates), 1)
+
+    def test_locate_again_after_failure(self):
+        self.kp.upload(u'/a', 'data')
+        self.kp.upload(u'/b', 'data')
+        self.assertEqual(len(self.locates), 1)  # host is reused
+        self.failures.extend([requests.exceptions.ConnectionError()] * 3)
+        self.assertRaises(requests.exceptions.ConnectionError, self.kp.upload, u'/c', 'data')
+        self.kp.upload(u'/d', 'data')
+        self.assertEqual(len(self.locates), 2)
+        self.assertTrue(self.bodies[-1][0].startswith('http://upload2/'))
+
+    def test_concurrent_locate(self):
+        both = threading.Event()
+        waited = []
+
+        def locate(url, **kwargs):
+            self.locates.append(url)
+            if len(self.locates) == 2:
+                both.set()
+            # the other thread can locate meanwhile
+            waited.append(both.wait(5))
+            return FakeResponse(dict(url='http://upload/'))
+
+        self.kp._new_session = lambda: FakeSession(locate, self.post)
+        threads = [threading.Thread(target=self.kp.upload_host, args=(x,)) for x in ('1', '2')]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(waited, [True, True])
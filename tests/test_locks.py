@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+import threading
+import unittest
+from kpfuse.locks import PathLocks
+
+
+class TestPathLocks(unittest.TestCase):
+    def setUp(self):
+        self.locks = PathLocks()
+
+    def test_exclusive(self):
+        events = []
+
+        def hold(path):
+            with self.locks.hold(path):
+                events.append(('enter', path))
+                time.sleep(0.05)
+                events.append(('exit', path))
+
+        threads = [threading.Thread(target=hold, args=(x,)) for x in (u'/a', u'/a', u'/b')]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        a = [x for x, path in events if path == u'/a']
+        self.assertEqual(a, ['enter', 'exit', 'enter', 'exit'])
+        # unrelated path is not blocked
+        self.assertLess(events.index(('enter', u'/b')), events.index(('exit', u'/a')))
+        self.assertEqual(len(self.locks), 0)
+
+    def test_rename_order(self):
+        # opposite renames must not deadlock
+        def rename(old, new):
+            for _ in xrange(200):
+                with self.locks.hold(old, new):
+                    pass
+
+        threads = [threading.Thread(target=rename, args=(u'/x/a', u'/y/b')),
+                   threading.Thread(target=rename, args=(u'/y/b', u'/x/a'))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+            self.assertFalse(t.is_alive())
+        self.assertEqual(len(self.locks), 0)
+
+    def in_thread(self, paths, entered, leave):
+        def hold():
+            with self.locks.hold(*paths):
+                entered.set()
+                leave.wait(5)
+
+        t = threading.Thread(target=hold)
+        t.start()
+        return t
+
+    def test_rename_directory(self):
+        renamed, leave_rename = threading.Event(), threading.Event()
+        opened, leave_open = threading.Event(), threading.Event()
+        rename = self.in_thread((u'/a', u'/b'), renamed, leave_rename)
+        self.assertTrue(renamed.wait(5))
+        # file under renamed directory waits for the rename
+        open_child = self.in_thread((u'/a/x',), opened, leave_open)
+        self.assertFalse(opened.wait(0.1))
+        leave_rename.set()
+        self.assertTrue(opened.wait(5))
+        leave_open.set()
+        for t in (rename, open_child):
+            t.join()
+        self.assertEqual(len(self.locks), 0)
+
+    def test_siblings(self):
+        leave = threading.Event()
+        entered = [threading.Event() for _ in xrange(2)]
+        threads = [self.in_thread((path,), x, leave) for path, x in zip((u'/a/x', u'/a/y'), entered)]
+        # both hold the directory shared at the same time
+        for x in entered:
+            self.assertTrue(x.wait(5))
+        leave.set()
+        for t in threads:
+            t.join()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import io
+import cgi
+import time
+import unittest
+import requests
+from kpfuse.multipart import MultipartFile
+from kpfuse.ratelimit import RateLimiter
+
+
+class TestMultipartFile(unittest.TestCase):
+    def parse(self, body, content):
+        environ = dict(REQUEST_METHOD='POST', CONTENT_TYPE=body.content_type,
+                       CONTENT_LENGTH=str(body.len))
+        form = cgi.FieldStorage(io.BytesIO(content), environ=environ)
+        return form['file'].value
+
+    def test_stream(self):
+        data = io.BytesIO('x' + '0123456789' * 100000)
+        data.read(1)  # sent from current position
+        progress = []
+        body = MultipartFile(data, filename=u'a"b.txt', progress=lambda *x: progress.append(x))
+        r = requests.Request('POST', 'http://localhost/', data=body,
+                             headers={'Content-Type': body.content_type}).prepare()
+        self.assertIs(r.body, body)  # streamed, not built in memory
+        self.assertEqual(r.headers['Content-Length'], str(body.len))
+        content = ''.join(body)
+        self.assertEqual(len(content), body.len)
+        self.assertEqual(self.parse(body, content), '0123456789' * 100000)
+        self.assertEqual(progress[-1], (1000000, 1000000))
+
+        body.rewind()
+        self.assertEqual(body.read(), content)
+
+    def test_rate(self):
+        body = MultipartFile('x' * 100000, limiter=RateLimiter(1000000))
+        start = time.time()
+        body.read(50000)
+        body.read()
+        self.assertGreater(time.time() - start, 0.04)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import gc
+import threading
+import unittest
+from kpfuse import node
+from kpfuse.node import FileNode
+from kpfuse.node import NodeTree
+from kpfuse.node import NegativeCache
+from kpfuse.node import list_pages
+from kpfuse.node import merge_pages
+from kpfuse.scheduler import TransferScheduler
+from kpfuse.kuaipan import KuaiPan
+from kpfuse.errors import FileNotExistedError
+
+
+def file_meta(name):
+    return dict(name=name, type='file', size=1, sha1='sha1 of ' + name)
+
+
+class FakeKuaiPan(KuaiPan):
+    """Server of listings given as path -> list of metadata of entries"""
+    def __init__(self, listings, paging=True):
+        self.listings = listings
+        self.paging = paging
+        self.requests = []
+
+    def metadata(self, path, page=None, page_size=None, **kwargs):
+        self.requests.append(path if page is None else (path, page))
+        files = self.listings.get(path)
+        if files is None:
+            raise FileNotExistedError(description=path)
+        if page is not None and self.paging:
+            files = files[(page - 1) * page_size:page * page_size]
+        return dict(path=path, type='folder', files=files)
+
+
+class PausedMeta(dict):
+    """Metadata of entry, which pauses the thread reading its name"""
+    def __init__(self, meta, reading, resume):
+        super(PausedMeta, self).__init__(meta)
+        self.reading = reading
+        self.resume = resume
+
+    def __getitem__(self, key):
+        if key == 'name' and not self.reading.is_set():
+            self.reading.set()
+            self.resume.wait(0.2)
+        return super(PausedMeta, self).__getitem__(key)
+
+
+class TestInternName(unittest.TestCase):
+    def test_shared_and_dropped(self):
+        a = FileNode(u'/x/name-of-test')
+        b = FileNode(u'/y/name-of-test')
+        self.assertIs(a.name, b.name)
+        del a, b
+        gc.collect()
+        self.assertNotIn(u'name-of-test', node._names)
+
+
+class TestNegativeCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.negatives = NegativeCache(ttl=10, size=3, clock=lambda: self.now)
+
+    def test_expire(self):
+        self.negatives.add(u'/a')
+        self.now = 10
+        self.assertIn(u'/a', self.negatives)
+        self.now = 11
+        self.assertNotIn(u'/a', self.negatives)
+        self.assertEqual(len(self.negatives), 0)
+
+    def test_size(self):
+        for x in (u'/a/1', u'/a/2', u'/b/1'):
+            self.negatives.add(x)
+        self.negatives.add(u'/a/1')  # used again
+        self.negatives.add(u'/c/1')
+        self.assertNotIn(u'/a/2', self.negatives)
+        self.assertEqual(sorted(self.negatives._under), [u'/a', u'/b', u'/c'])
+
+    def test_invalidate(self):
+        for x in (u'/a', u'/a/b/c', u'/ab'):
+            self.negatives.add(x)
+        self.negatives.invalidate(u'/a')
+        self.assertNotIn(u'/a', self.negatives)
+        self.assertNotIn(u'/a/b/c', self.negatives)
+        self.assertIn(u'/ab', self.negatives)
+        self.assertEqual(self.negatives._under, {})
+
+
+class TestListPages(unittest.TestCase):
+    def setUp(self):
+        self.files = [file_meta(unicode(i)) for i in xrange(10)]
+        self.kp = FakeKuaiPan({u'/': self.files})
+        self.scheduler = TransferScheduler(workers=2)
+
+    def list(self, page_size=3):
+        return list(list_pages(self.kp, u'/', self.scheduler, page_size))
+
+    def test_pages(self):
+        metas = self.list()
+        self.assertEqual([len(x['files']) for x in metas], [3, 3, 3, 1])
+        # fetched in batches of one page for each worker, until a page is not full
+        self.assertEqual(sorted(self.kp.requests), [(u'/', i) for i in xrange(1, 6)])
+        self.assertEqual(merge_pages(metas)['files'], self.files)
+
+    def test_paging_ignored(self):
+        self.kp.paging = False
+        self.assertEqual(len(self.list(page_size=10)), 1)
+
+    def test_concurrent_pages(self):
+        fetched = threading.Event()
+        metadata = self.kp.metadata
+
+        def wait_next_page(path, page=None, page_size=None):
+            if page == 2:
+                # fetched by caller, while next page is fetched by a worker
+                self.assertTrue(fetched.wait(5))
+            elif page == 3:
+                fetched.set()
+            return metadata(path, page=page, page_size=page_size)
+
+        self.kp.metadata = wait_next_page
+        self.assertEqual(len(self.list()), 4)
+
+    def tearDown(self):
+        self.scheduler.close()
+
+
+class TestNodeTree(unittest.TestCase):
+    def setUp(self):
+        self.kp = FakeKuaiPan({u'/': [file_meta(u'a')]})
+        self.tree = NodeTree(self.kp, attr_ttl=None, dir_ttl=None)
+
+    def test_insert_during_update(self):
+        root = self.tree.get(u'/')
+        reading, inserted = threading.Event(), threading.Event()
+        meta = dict(path=u'/', type='folder', files=[PausedMeta(file_meta(u'a'), reading, inserted)])
+        t = threading.Thread(target=self.tree.update, args=(root, meta))
+        t.start()
+        self.assertTrue(reading.wait(5))
+        # e.g. renamed into the directory, while its listing is replaced
+        self.tree.insert(u'/b', FileNode(u'/b'))
+        inserted.set()
+        t.join()
+        self.assertEqual(sorted(root.names()), [u'a', u'b'])
+
+    def test_dir_ttl(self):
+        self.tree.dir_ttl = 60
+        root = self.tree.get(u'/')
+        self.kp.listings[u'/'] = [file_meta(u'b')]
+        self.tree.get(u'/')
+        self.assertEqual(self.tree.revalidator._pending, set())  # not expired yet
+        root.checked -= 61
+        # expired listing is served, while it is revalidated in background
+        self.assertEqual(self.tree.get(u'/').names(), [u'a'])
+        self.stop_revalidator()
+        self.assertEqual(root.names(), [u'b'])
+
+    def test_attr_ttl(self):
+        self.tree.attr_ttl = 60
+        root = self.tree.get(u'/')
+        a = self.tree.get(u'/a')
+        self.kp.listings[u'/'][0] = dict(file_meta(u'a'), size=2)
+        root.checked -= 61
+        self.assertEqual(self.tree.get(u'/a').attribute.size, 1)
+        self.stop_revalidator()
+        # attributes are updated in place from listing of parent
+        self.assertIs(root.get(u'a'), a)
+        self.assertEqual(a.attribute.size, 2)
+
+    def test_peek(self):
+        self.assertIsNone(self.tree.peek(u'/a'))
+        self.assertEqual(self.kp.requests, [])
+        root = self.tree.get(u'/')
+        self.assertIs(self.tree.peek(u'/'), root)
+        self.assertIs(self.tree.peek(u'/a'), root.get(u'a'))
+        self.assertIsNone(self.tree.peek(u'/b'))
+        self.assertEqual(self.kp.requests, [(u'/', 1)])
+
+    def test_invalidate(self):
+        self.tree.dir_ttl = 60
+        root = self.tree.get(u'/')
+        self.tree.create(u'/b', True)
+        self.tree.invalidate(u'/')
+        self.assertEqual(root.checked, 0)
+        self.tree.get(u'/')
+        self.assertEqual(self.tree.revalidator._pending, {u'/'})
+
+    def test_create_during_listing(self):
+        root = self.tree.get(u'/')
+        meta = self.tree.list(u'/')  # fetched before mkdir
+        made = self.tree.create(u'/made', True)
+        made_file = self.tree.create(u'/made/file', False)
+        self.tree.update(root, meta)
+        self.assertIs(root.get(u'made'), made)
+        self.assertIs(self.tree.get(u'/made/file'), made_file)
+        self.kp.listings[u'/'].append(dict(name=u'made', type='folder'))
+        self.tree.update(root, self.tree.list(u'/'))
+        self.assertIs(root.get(u'made'), made)
+        self.assertFalse(made.local)  # listed at server
+        self.assertTrue(made_file.local)
+
+    def stop_revalidator(self):
+        """Stop revalidator after queued revalidation"""
+        self.tree.revalidator.stop()
+        self.tree.revalidator = None
+
+    def test_lookup_during_listing(self):
+        self.kp.listings.update({
+            u'/': [dict(name=u'd', type='folder')],
+            u'/d': [dict(name=u'e', type='folder')],
+            u'/d/e': [file_meta(u'f')],
+        })
+        self.tree.get(u'/')
+        listing, release = threading.Event(), threading.Event()
+        metadata = self.kp.metadata
+
+        def wait_release(path, **kwargs):
+            if path == u'/d':
+                listing.set()
+                self.assertTrue(release.wait(5))
+            return metadata(path, **kwargs)
+
+        self.kp.metadata = wait_release
+        results = []
+
+        def lookup():
+            try:
+                results.append(self.tree.get(u'/d/e/f'))
+            except Exception, e:
+                results.append(e)
+
+        first = threading.Thread(target=lookup)
+        first.start()
+        self.assertTrue(listing.wait(5))
+        second = threading.Thread(target=lookup)
+        with self.tree._lock:
+            # listing is fetched, but not put into the tree yet
+            release.set()
+            second.start()
+            second.join(0.2)
+        for t in (first, second):
+            t.join()
+        f = self.tree.peek(u'/d/e/f')
+        self.assertIsNotNone(f)
+        self.assertEqual(results, [f, f])
+
+    def test_readdir(self):
+        self.kp.listings[u'/'] = [file_meta(unicode(i)) for i in xrange(10)]
+        self.tree.page_size = 3
+        self.assertEqual(sorted(self.tree.readdir(u'/')), sorted(unicode(i) for i in xrange(10)))
+        self.assertEqual(len(self.tree.get(u'/').names()), 10)
+
+    def tearDown(self):
+        self.tree.close()
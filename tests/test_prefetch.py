@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import unittest
+from kpfuse.node import NodeTree
+from kpfuse.prefetch import Prefetcher
+from kpfuse.ratelimit import RateLimiter
+from test_node import FakeKuaiPan
+
+
+def dir_meta(name):
+    return dict(name=name, type='folder')
+
+
+class TestPrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.kp = FakeKuaiPan({
+            u'/': [dir_meta(u'a'), dir_meta(u'b')],
+            u'/a': [dir_meta(u'c')],
+            u'/a/c': [dir_meta(u'd')],
+            u'/a/c/d': [],
+            u'/b': [],
+        })
+        self.tree = NodeTree(self.kp, attr_ttl=None, dir_ttl=None)
+
+    def start(self, **kwargs):
+        """Prefetcher without workers, its queue is run by drain()"""
+        self.tree.prefetcher = Prefetcher(self.tree, workers=0, rate=0, **kwargs)
+        self.tree.get(u'/')
+        return self.tree.prefetcher
+
+    def drain(self):
+        """Run queued prefetch in this thread, until nothing is queued"""
+        prefetcher = self.tree.prefetcher
+        while not prefetcher._queue.empty():
+            prefetcher._queue.put(None)
+            prefetcher._run()
+
+    def listed(self):
+        return sorted(x[0] for x in self.kp.requests)
+
+    def test_depth(self):
+        self.start(depth=2)
+        self.drain()
+        self.assertEqual(self.listed(), [u'/', u'/a', u'/a/c', u'/b'])
+        self.assertFalse(self.tree.peek(u'/a/c/d').valid)
+
+    def test_rate(self):
+        prefetcher = self.start(depth=2)
+        delays = []
+        prefetcher.limiter = RateLimiter(10, clock=lambda: 0, sleep=delays.append)
+        self.drain()
+        # listings are spaced out, not sent at once
+        self.assertEqual(delays, [0.1, 0.2])
+
+    def test_memory_pressure(self):
+        prefetcher = self.start(depth=2, max_dirs=4)
+        self.drain()
+        # pending prefetch is dropped once sub-directories of /a are loaded
+        self.assertEqual(self.listed(), [u'/', u'/a'])
+        self.assertTrue(prefetcher._queue.empty())
+        self.tree.get(u'/b')
+        self.assertTrue(prefetcher._queue.empty())
+
+    def tearDown(self):
+        self.tree.close()
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import unittest
+from kpfuse.readahead import ReadAhead
+
+
+class TestReadAhead(unittest.TestCase):
+    def test_sequential(self):
+        r = ReadAhead(min_size=100, max_size=400)
+        self.assertEqual(r.update(0, 10), (10, 110))
+        windows = [r.update(offset, 10) for offset in xrange(10, 1000, 10)]
+        self.assertEqual(windows[0], (20, 120))
+        self.assertEqual(max(end - begin for begin, end in windows), 400)
+        self.assertEqual(windows[-1], (1000, 1400))
+
+    def test_random(self):
+        r = ReadAhead(min_size=100, max_size=400)
+        self.assertIsNone(r.update(500, 10))
+        self.assertEqual(r.update(510, 10), (520, 620))
+        self.assertIsNone(r.update(0, 10))
+        self.assertEqual(r.window, 0)
+        self.assertIsNone(ReadAhead(max_size=0).update(0, 10))
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import unittest
+import requests
+from kpfuse import errors
+from kpfuse.retry import RetryPolicy
+from kpfuse.retry import CircuitBreaker
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.calls = 0
+
+    def failing(self, times, error):
+        def func():
+            self.calls += 1
+            if self.calls <= times:
+                raise error
+            return self.calls
+        return func
+
+    def test_retry(self):
+        policy = RetryPolicy(retries=3, backoff=0.001)
+        self.assertEqual(policy.call(self.failing(2, requests.exceptions.ReadTimeout())), 3)
+        self.calls = 0
+        self.assertRaises(requests.exceptions.ReadTimeout,
+                          policy.call, self.failing(10, requests.exceptions.ReadTimeout()))
+        self.assertEqual(self.calls, 4)
+
+    def test_not_idempotent(self):
+        policy = RetryPolicy(retries=3, backoff=0.001)
+        self.assertRaises(requests.exceptions.ReadTimeout, policy.call,
+                          self.failing(1, requests.exceptions.ReadTimeout()), idempotent=False)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(policy.call(self.failing(1, requests.exceptions.ConnectTimeout()),
+                                     idempotent=False), 2)
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(threshold=2, timeout=60)
+        policy = RetryPolicy(retries=5, backoff=0.001, breaker=breaker)
+        self.assertRaises(errors.ServiceUnavailableError,
+                          policy.call, self.failing(10, requests.exceptions.ConnectionError()))
+        self.assertEqual(self.calls, 2)
+        # fail fast while the circuit is open
+        self.assertRaises(errors.ServiceUnavailableError, policy.call, lambda: None)
+        breaker._open_until = 0
+        self.assertEqual(policy.call(lambda: 1), 1)
+        self.assertFalse(breaker.opened)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import threading
+import unittest
+from kpfuse.scheduler import TransferScheduler
+from kpfuse.scheduler import FOREGROUND
+from kpfuse.scheduler import UPLOAD
+from kpfuse.scheduler import BACKGROUND
+
+
+class TestTransferScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = TransferScheduler(workers=1)
+        self.order = []
+        # hold the only worker until all tasks are queued
+        self.gate = threading.Event()
+        self.scheduler.submit(u'/gate', self.gate.wait, priority=FOREGROUND)
+
+    def record(self, name):
+        self.order.append(name)
+
+    def test_priority(self):
+        self.scheduler.submit(u'/a', self.record, 'background', priority=BACKGROUND)
+        self.scheduler.submit(u'/b', self.record, 'upload', priority=UPLOAD)
+        self.scheduler.submit(u'/c', self.record, 'foreground', priority=FOREGROUND)
+        self.gate.set()
+        self.scheduler.close()
+        self.assertEqual(self.order, ['foreground', 'upload', 'background'])
+        self.assertEqual(self.scheduler.metrics()['completed']['background'], 1)
+
+    def test_cancel(self):
+        task = self.scheduler.submit(u'/a', self.record, 'a', priority=UPLOAD)
+        self.scheduler.submit(u'/b', self.record, 'b', priority=UPLOAD)
+        self.assertTrue(self.scheduler.pending(u'/a'))
+        self.assertEqual(self.scheduler.cancel(u'/a'), 1)
+        self.assertTrue(task.cancelled())
+        self.gate.set()
+        self.scheduler.close()
+        self.assertEqual(self.order, ['b'])
+
+    def tearDown(self):
+        self.gate.set()
+        self.scheduler.close()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+from kpfuse import snapshot
+from kpfuse.node import DirNode
+from kpfuse.node import FileNode
+from kpfuse.node import FileNodeAttribute
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'snapshot.json.gz')
+
+    def test_save_and_load(self):
+        a = FileNode(u'a')
+        a.attribute = FileNodeAttribute(10, 1000000000, 1000000001)
+        a.sha1 = 'sha1 of a'
+        new = FileNode(u'new')
+        new.local = True
+        made = DirNode(u'made', dict())
+        made.local = True
+        listed = DirNode(u'listed', dict(b=FileNode(u'b')))
+        listed.hash = 'hash of listed'
+        root = DirNode(u'/', dict(a=a, new=new, made=made, listed=listed,
+                                unlisted=DirNode(u'unlisted')))
+        snapshot.save(root, self.path)
+
+        root = snapshot.load(self.path)
+        # file not uploaded yet is left out
+        self.assertEqual(sorted(root.names()), [u'a', u'listed', u'made', u'unlisted'])
+        a = root.get(u'a')
+        self.assertEqual((a.attribute.size, a.attribute.ctime, a.attribute.mtime),
+                         (10, 1000000000, 1000000001))
+        self.assertEqual(a.sha1, 'sha1 of a')
+        listed = root.get(u'listed')
+        self.assertEqual(listed.names(), [u'b'])
+        self.assertEqual(listed.hash, 'hash of listed')
+        self.assertIs(listed.get(u'b').parent, listed)
+        self.assertFalse(root.get(u'unlisted').valid)
+        # listings are revalidated at first access
+        self.assertEqual((root.checked, listed.checked), (0, 0))
+
+    def test_corrupted(self):
+        with open(self.path, 'wb') as f:
+            f.write('not gzip')
+        self.assertIsNone(snapshot.load(self.path))
+        self.assertIsNone(snapshot.load(os.path.join(self.tmp_dir, 'missing')))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import threading
+import unittest
+from kpfuse.writeback import WriteBack
+
+
+class TestWriteBack(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.uploads = []
+        self.uploaded = threading.Event()
+        self.writeback = WriteBack(self.upload, delay=10, max_delay=25, clock=lambda: self.now)
+
+    def upload(self, path, item):
+        self.uploads.append((path, item))
+        self.uploaded.set()
+
+    def advance(self, now):
+        """Move the clock, and wake the write-back thread to look at it"""
+        self.now = now
+        with self.writeback._cond:
+            self.writeback._cond.notify()
+
+    def wait_upload(self):
+        self.assertTrue(self.uploaded.wait(5))
+
+    def test_coalesce(self):
+        for i in xrange(3):
+            self.now = i * 5
+            self.writeback.add(u'/a', i)
+        self.advance(19)
+        self.assertEqual(self.uploads, [])
+        self.advance(20)
+        self.wait_upload()
+        self.assertEqual(self.uploads, [(u'/a', 2)])
+
+    def test_max_delay(self):
+        for i in xrange(5):
+            self.now = i * 5
+            self.writeback.add(u'/a', i)
+        # uploaded although closed again less than delay ago
+        self.advance(25)
+        self.wait_upload()
+        self.assertEqual(self.uploads, [(u'/a', 4)])
+
+    def test_flush_and_stop(self):
+        self.writeback.add(u'/a', 1)
+        self.writeback.add(u'/b', 2)
+        self.writeback.cancel(u'/b')
+        self.writeback.move(u'/a', u'/c')
+        self.writeback.flush(u'/c')
+        self.wait_upload()
+        self.assertEqual(self.uploads, [(u'/c', 1)])
+        self.writeback.add(u'/d', 3)
+        self.writeback.stop()
+        self.assertEqual(self.uploads, [(u'/c', 1), (u'/d', 3)])
+
+    def tearDown(self):
+        self.writeback.stop()